@@ -1,16 +1,24 @@
-from openai import OpenAI
-from typing import List, Tuple, Dict
-from config import load_config
+import re
+from concurrent.futures import ThreadPoolExecutor
+from OpenAI_Client import get_gateway, BACKGROUND, estimate_tokens, truncate_tokens
+from typing import TYPE_CHECKING, Any, List, Tuple, Dict
+from Cache import get_response_cache
+from Tracing import in_current_context
+from Budget import CHEAPER_MODEL, FEWER_TRANSCRIPTS, current_budget
 
-config = load_config()
-client = OpenAI(api_key=config["OPENAI_API_KEY"])
+if TYPE_CHECKING:
+    import pandas as pd
 
-def general_analysis(query: str, relevant_transcripts: str) -> str:
+# Model for intermediate analysis until the question's budget forces a cheaper one
+ANALYSIS_MODEL = "gpt-4o"
+
+def general_analysis(query: str, relevant_transcripts: str, model: str = ANALYSIS_MODEL) -> str:
     """
     Analyzes call transcripts and provides an summary based answer based on the query.
 
     :param query: The user's query.
     :param relevant_transcripts: A single string containing concatenated transcripts.
+    :param model: The chat model to analyse with.
     :return: A string with the analysis and summary based on the question asked 
     """
     # Define system instructions
@@ -35,21 +43,25 @@ Analyze these transcripts and provide a brief summary answer:
     ]
 
     # Generate response with OpenAI
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        max_tokens=500
-    )
+    def generate() -> str:
+        response = get_gateway().chat_completion(
+            model=model,
+            messages=messages,
+            priority=BACKGROUND,
+            max_tokens=500
+        )
+        return response.choices[0].message.content.strip()
 
-    # Return the response content
-    return response.choices[0].message.content.strip()
+    # Return the cached response for an identical prompt, generating it on a miss
+    return get_response_cache().get_or_compute(model, messages, {"max_tokens": 500}, generate)
 
-def detailed_analysis(query: str, relevant_transcripts: str) -> str:
+def detailed_analysis(query: str, relevant_transcripts: str, model: str = ANALYSIS_MODEL) -> str:
     """
     Analyzes call transcripts and provides an detailed analysis based on the query.
 
     :param query: The user's query.
     :param relevant_transcripts: A single string containing concatenated transcripts.
+    :param model: The chat model to analyse with.
     :return: A string with the initial analysis and identified reasons or key points.
     """
     # Define system instructions
@@ -82,41 +94,347 @@ Reasons/Key Points:
     ]
 
     # Generate response with OpenAI
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        max_tokens=500
-    )
+    def generate() -> str:
+        response = get_gateway().chat_completion(
+            model=model,
+            messages=messages,
+            priority=BACKGROUND,
+            max_tokens=500
+        )
+        return response.choices[0].message.content.strip()
+
+    # Return the cached response for an identical prompt, generating it on a miss
+    return get_response_cache().get_or_compute(model, messages, {"max_tokens": 500}, generate)
+
+# Token budget for the transcripts in one analysis request
+TRANSCRIPT_TOKEN_BUDGET = 12000
+
+# Estimated tokens of an analysis prompt besides the transcripts, and of its completion
+ANALYSIS_PROMPT_TOKENS = 250
+ANALYSIS_COMPLETION_TOKENS = 500
+
+# Smallest transcript allowance worth analysing when the question's budget is nearly spent
+MIN_TRANSCRIPT_TOKENS = 1000
+
+
+def pack_transcripts(documents: list, max_tokens: int = TRANSCRIPT_TOKEN_BUDGET) -> List[str]:
+    """
+    Pack retrieved transcript chunks into batches that each fit the token budget.
+
+    Chunks are grouped by serial number and every call is labelled, so the model sees
+    which text belongs to which call. A call that doesn't fit in the current batch starts
+    the next one; only a call larger than the budget by itself is split across batches,
+    at chunk boundaries, and a single chunk larger than the budget is truncated.
+
+    :param documents: Retrieved transcript chunks with "Serial Number" in their metadata.
+    :param max_tokens: Token budget for the transcripts of one batch.
+    :return: List of batch strings.
+    """
+    # Group chunks by call, keeping retrieval order
+    calls: Dict[Any, List[str]] = {}
+    for doc in documents:
+        calls.setdefault(doc.metadata.get("Serial Number"), []).append(doc.page_content)
+
+    batches = []
+    current, current_tokens = [], 0
+    for serial_number, chunks in calls.items():
+        header = f"[Call {serial_number}]"
+        header_tokens = estimate_tokens(header)
+        sized = []
+        for chunk in chunks:
+            chunk_tokens = estimate_tokens(chunk)
+            if header_tokens + chunk_tokens > max_tokens:
+                chunk = truncate_tokens(chunk, max_tokens - header_tokens)
+                chunk_tokens = estimate_tokens(chunk)
+            sized.append((chunk, chunk_tokens))
+        call_tokens = header_tokens + sum(chunk_tokens for _, chunk_tokens in sized)
+
+        if call_tokens <= max_tokens:
+            # Close the batch before a call that doesn't fit, so the call stays whole
+            if current and current_tokens + call_tokens > max_tokens:
+                batches.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.extend([header] + [chunk for chunk, _ in sized])
+            current_tokens += call_tokens
+            continue
+
+        # Larger than a batch by itself: split at chunk boundaries, repeating the call label
+        if current:
+            batches.append("\n".join(current))
+            current, current_tokens = [], 0
+        for chunk, chunk_tokens in sized:
+            if current and current_tokens + chunk_tokens > max_tokens:
+                batches.append("\n".join(current))
+                current, current_tokens = [], 0
+            if not current:
+                current, current_tokens = [header], header_tokens
+            current.append(chunk)
+            current_tokens += chunk_tokens
+    if current:
+        batches.append("\n".join(current))
+    return batches
+
+
+def reduce_analysis(query: str, partial_analyses: List[str], detailed: bool, model: str = ANALYSIS_MODEL) -> str:
+    """
+    Merge analyses of separate transcript batches into a single answer.
+
+    :param query: The user's query.
+    :param partial_analyses: One analysis per batch.
+    :param detailed: Whether the partials come from detailed_analysis, whose reason list must be kept.
+    :param model: The chat model to merge with.
+    :return: The merged analysis in the same format as the partials.
+    """
+    system_instruction = """You are an assistant for analyzing call transcripts of Aavas. You are given analyses of separate batches of call transcripts for the same question.
+    Your task is to merge them into one answer, combining overlapping points and keeping every distinct finding."""
+
+    partials = "\n\n".join(f"Batch {i + 1}:\n{analysis}" for i, analysis in enumerate(partial_analyses))
+    if detailed:
+        output_format = """Format your response as:
+Initial Analysis: [Your brief analysis here]
+
+Reasons/Key Points:
+1. [First reason/point]
+2. [Second reason/point]
+..."""
+    else:
+        output_format = "Provide a brief summary answer."
+
+    prompt = f"""The user asked: {query}
+
+Merge these batch analyses:
+
+{partials}
+
+{output_format}
+"""
+
+    messages = [
+        {"role": "system", "content": system_instruction},
+        {"role": "user", "content": prompt}
+    ]
+
+    # Generate response with OpenAI
+    def generate() -> str:
+        response = get_gateway().chat_completion(
+            model=model,
+            messages=messages,
+            priority=BACKGROUND,
+            max_tokens=500
+        )
+        return response.choices[0].message.content.strip()
+
+    # Return the cached response for an identical prompt, generating it on a miss
+    return get_response_cache().get_or_compute(model, messages, {"max_tokens": 500}, generate)
+
+
+def estimate_analysis_tokens(batches: List[str]) -> Tuple[int, int]:
+    """
+    Estimate the (prompt, completion) tokens of analysing the batches and merging the results.
+    """
+    prompt_tokens = sum(estimate_tokens(batch) for batch in batches) + ANALYSIS_PROMPT_TOKENS * len(batches)
+    completion_tokens = ANALYSIS_COMPLETION_TOKENS * len(batches)
+    if len(batches) > 1:
+        # The reduce call reads every partial analysis and writes one more
+        prompt_tokens += completion_tokens + ANALYSIS_PROMPT_TOKENS
+        completion_tokens += ANALYSIS_COMPLETION_TOKENS
+    return prompt_tokens, completion_tokens
 
-    # Return the response content
-    return response.choices[0].message.content.strip()
 
-from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
-from langchain_openai import ChatOpenAI
-import pandas as pd
-from langchain.agents.agent_types import AgentType
+def map_reduce_analysis(query: str, documents: list, detailed: bool = False, max_tokens: int = TRANSCRIPT_TOKEN_BUDGET, max_workers: int = 8) -> str:
+    """
+    Analyze retrieved transcripts in token-budgeted batches concurrently and merge the results.
+
+    When the question's budget is approached the analysis degrades in steps: first the least
+    relevant batches are dropped, then a cheaper model is used.
+
+    :param query: The user's query.
+    :param documents: Retrieved transcript chunks with "Serial Number" in their metadata.
+    :param detailed: Use detailed_analysis (numbered reasons) instead of general_analysis.
+    :param max_tokens: Token budget for the transcripts of one batch.
+    :param max_workers: Maximum number of batch analyses in flight.
+    :return: The analysis, in the same format as general_analysis or detailed_analysis.
+    """
+    analyse = detailed_analysis if detailed else general_analysis
+    batches = pack_transcripts(documents, max_tokens)
+    model = ANALYSIS_MODEL
+
+    budget = current_budget()
+    if budget is not None and budget.level(model, *estimate_analysis_tokens(batches)) >= FEWER_TRANSCRIPTS:
+        # Batches follow retrieval order, so the least relevant transcripts are dropped first
+        kept = list(batches)
+        while len(kept) > 1 and budget.level(model, *estimate_analysis_tokens(kept)) >= FEWER_TRANSCRIPTS:
+            kept.pop()
+        if budget.level(model, *estimate_analysis_tokens(kept)) >= FEWER_TRANSCRIPTS:
+            allowance = budget.headroom(model, ANALYSIS_COMPLETION_TOKENS) - ANALYSIS_PROMPT_TOKENS
+            kept = pack_transcripts(documents, max(MIN_TRANSCRIPT_TOKENS, min(max_tokens, allowance)))[:1]
+        budget.degrade(f"fewer transcripts for '{query}': {estimate_tokens(''.join(kept))} of {estimate_tokens(''.join(batches))} tokens")
+        batches = kept
+
+        if budget.level(model, *estimate_analysis_tokens(batches)) >= CHEAPER_MODEL:
+            model = budget.fallback_model
+            budget.degrade(f"cheaper model for '{query}': {model}")
+
+    if len(batches) <= 1:
+        return analyse(query, batches[0] if batches else "", model)
+
+    # Map: latency is bounded by the slowest batch
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+        partial_analyses = list(executor.map(in_current_context(lambda batch: analyse(query, batch, model)), batches))
+
+    # Reduce
+    return reduce_analysis(query, partial_analyses, detailed, model)
+
+# Metadata fields used by the analytics engine, with the dtype each column is loaded as
+METADATA_DTYPES = {
+    "Serial Number": "string",
+    "Call Length": "float64",
+    "Call DateTime": "datetime64[ns]",
+    "Language of the call": "category",
+    "Purpose": "category",
+    "Product offered": "category",
+    "Lead Source": "category",
+    "Location": "category",
+    "Branch": "category",
+    "Opportunity Created": "boolean",
+    "Business Created": "boolean",
+    "Agent Name": "category",
+    "Agent ID": "category",
+}
+
+# Words in a query that ask for a breakdown by a metadata field
+GROUP_BY_KEYWORDS = {
+    "Branch": ["branch"],
+    "Agent Name": ["agent"],
+    "Lead Source": ["lead source", "source"],
+    "Language of the call": ["language", "hindi", "marathi"],
+    "Purpose": ["purpose"],
+    "Product offered": ["product"],
+    "Location": ["location", "city"],
+}
+
+# Words in a query that ask for a time series, mapped to the bucket size
+TIME_BUCKET_KEYWORDS = {
+    "hour": ["hourly", "hour", "time of day"],
+    "day": ["daily", "day", "date"],
+    "week": ["weekly", "week"],
+    "month": ["monthly", "month", "trend", "over time"],
+}
+
+PERCENTILES = [0.25, 0.5, 0.75, 0.9]
+
+
+def aggregation_plan(query: str) -> Dict[str, Any]:
+    """
+    Decide which aggregations answer a metadata query, beyond the overall totals always computed.
+
+    :param query: The metadata query.
+    :return: {"group_by": [metadata fields], "time_bucket": "hour" | "day" | "week" | "month" | None}
+    """
+    lowered = query.lower()
+
+    def mentions(words: List[str]) -> bool:
+        return any(re.search(rf"\b{re.escape(word)}", lowered) for word in words)
+
+    group_by = [field for field, words in GROUP_BY_KEYWORDS.items() if mentions(words)]
+    time_bucket = next((bucket for bucket, words in TIME_BUCKET_KEYWORDS.items() if mentions(words)), None)
+    return {"group_by": group_by, "time_bucket": time_bucket}
+
+
+def metadata_frame(metadata_list: List[dict]) -> "pd.DataFrame":
+    """
+    Load call metadata column by column with explicit dtypes, skipping transcripts and unknown fields.
+
+    :param metadata_list: Metadata dictionaries, one per call.
+    :return: DataFrame with categorical, float, datetime and boolean columns.
+    """
+    import numpy as np
+    import pandas as pd
+
+    columns = {}
+    for field, dtype in METADATA_DTYPES.items():
+        values = [metadata.get(field) for metadata in metadata_list]
+        if dtype == "float64":
+            columns[field] = pd.to_numeric(pd.Series(values, dtype="object"), errors="coerce")
+        elif dtype == "datetime64[ns]":
+            columns[field] = pd.to_datetime(pd.Series(values, dtype="object"), errors="coerce")
+        elif dtype == "boolean":
+            # Parse each distinct value once and expand by code; missing values get code -1
+            codes, uniques = pd.factorize(pd.Series(values, dtype="object"))
+            truth = np.array([str(value).lower() in ("true", "1", "yes") for value in uniques] + [False])
+            columns[field] = pd.Series(pd.arrays.BooleanArray(truth[codes], codes == -1))
+        else:
+            columns[field] = pd.Series(values, dtype=dtype)
+    return pd.DataFrame(columns)
+
+
+def summarize_metadata_frame(df: "pd.DataFrame", plan: Dict[str, Any]) -> Dict[str, "pd.DataFrame"]:
+    """
+    Compute the overall totals plus the planned group-bys and time buckets with vectorized operations.
+
+    :param df: Output of metadata_frame.
+    :param plan: Output of aggregation_plan.
+    :return: Dictionary of section title to result table.
+    """
+    import pandas as pd
+
+    call_length = df["Call Length"]
+    overall = {
+        "Calls": len(df),
+        "Mean Call Length": call_length.mean(),
+        "Min Call Length": call_length.min(),
+        "Max Call Length": call_length.max(),
+        "Opportunities Created": int(df["Opportunity Created"].sum()),
+        "Businesses Created": int(df["Business Created"].sum()),
+        "First Call": df["Call DateTime"].min(),
+        "Last Call": df["Call DateTime"].max(),
+    }
+    for percentile, value in zip(PERCENTILES, call_length.quantile(PERCENTILES)):
+        overall[f"P{int(percentile * 100)} Call Length"] = value
+    sections = {"Overall": pd.DataFrame([overall])}
+
+    for field in plan["group_by"]:
+        grouped = df.groupby(field, observed=True).agg(
+            Calls=("Serial Number", "size"),
+            Mean_Call_Length=("Call Length", "mean"),
+            Median_Call_Length=("Call Length", "median"),
+            Opportunities_Created=("Opportunity Created", "sum"),
+        )
+        sections[f"By {field}"] = grouped.sort_values("Calls", ascending=False)
+
+    if plan["time_bucket"]:
+        frequency = {"hour": "H", "day": "D", "week": "W", "month": "M"}[plan["time_bucket"]]
+        bucketed = df.groupby(pd.Grouper(key="Call DateTime", freq=frequency)).agg(
+            Calls=("Serial Number", "size"),
+            Mean_Call_Length=("Call Length", "mean"),
+        )
+        sections[f"By {plan['time_bucket']}"] = bucketed[bucketed["Calls"] > 0]
+    return sections
+
+
+def format_metadata_summary(query: str, sections: Dict[str, "pd.DataFrame"]) -> str:
+    """
+    Render aggregation results as the metadata summary text passed on to reporting.
+    """
+    summary_str = "\n\n".join(f"{title}:\n{table.to_string()}" for title, table in sections.items())
+    return f"Metadata Statistical Summary :\n{summary_str}\n\n for Metadata Query:\n{query}"
+
 
 def execute_query_on_metadata(query: str, documents: list) -> str:
     """
-    Convert metadata JSON to a Pandas DataFrame and execute a query on it using LangChain's Pandas agent.
+    Summarize the metadata of the retrieved documents with the aggregations the query asks for.
 
     :param query: The question to ask about the data.
-    :param metadata_json: The metadata in JSON format retrieved from the database.
+    :param documents: The retrieved documents; only their metadata is used.
     :return: The result of the query as a string.
     """
-    
-    # Extract metadata from each document and organize it into a list of dictionaries
+    # Extract metadata from each document and load it column by column with explicit dtypes
     metadata_list = [doc.metadata for doc in documents if hasattr(doc, "metadata")]
-    
-    # Convert the list of metadata dictionaries to a DataFrame
-    df = pd.DataFrame(metadata_list)
-    # Generate the statistical summary of the DataFrame
-    summary_df = df.describe(include='all')
-    
-    # Convert the summary to a string format
-    summary_str = summary_df.to_string()
-    final_response = f"Metadata Statistical Summary :\n{summary_str}\n\n for Metadata Query:\n{query}"
-    return final_response
+    df = metadata_frame(metadata_list)
+
+    # Compute the overall statistics plus any breakdowns the query mentions
+    sections = summarize_metadata_frame(df, aggregation_plan(query))
+    return format_metadata_summary(query, sections)
 
 # def execute_query_on_metadata(query: str, documents: list) -> str:
 #     """
@@ -0,0 +1,737 @@
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import operator
+import random
+import re
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import httpx
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.structured_query import Comparison, Operation, StructuredQuery, Visitor
+from langchain_core.vectorstores import VectorStore
+from Settings import set_config
+from OpenAI_Client import DEFAULT_RATE_LIMITS, OpenAIGateway, set_encoding, set_gateway
+from Embeddings import build_embedding_model
+from Pipeline import build_execution_graph, plan_question, run_dag
+
+# Synthetic corpus vocabulary; the stand-in LLM answers with these reasons so counting finds evidence
+REASONS = [
+    "The interest rate is higher than other banks",
+    "The customer needs time to arrange property documents",
+    "The customer already took a loan from another lender",
+    "The processing fee is too high",
+    "The customer is waiting for construction approval",
+    "The customer wants a higher loan amount than offered",
+    "The customer is not interested in a home loan right now",
+    "The customer asked for a callback from the branch",
+]
+AGENTS = [("Rahul Sharma", 101), ("Priya Verma", 102), ("Amit Patil", 103), ("Sneha Joshi", 104)]
+BRANCHES = ["Jaipur", "Pune", "Indore", "Nagpur"]
+LEAD_SOURCES = ["PhonePe", "Google Ads", "Self Sourced", "Website", "Reference"]
+PURPOSES = ["Construction", "Purchase", "Repair and Renovation Loan", "Other Loans - Home Equity"]
+LANGUAGES = ["Hindi", "Marathi"]
+
+DEFAULT_QUESTIONS = [
+    "No of calls where call duration is more than 600 seconds",
+    "Why are customers not going ahead with the loan offer?",
+    "How many calls came from PhonePe leads and why did those customers not proceed?",
+    "Give a detailed account of the objections raised by Hindi speaking customers",
+]
+
+# Words the stand-in router treats as asking about call characteristics or call content
+METADATA_WORDS = ["duration", "seconds", "how many", "no of", "number of", "branch", "agent", "lead", "source", "language", "hindi", "marathi", "phonepe", "month"]
+TRANSCRIPT_WORDS = ["why", "reason", "objection", "said", "concern", "complain"]
+
+
+def synthetic_calls(count: int, seed: int = 7) -> List[Dict[str, Any]]:
+    """
+    Generate call metadata with role-wise transcripts, in the shape stored in call_embeddings.
+
+    :param count: Number of calls.
+    :param seed: Random seed, so every run sees the same corpus.
+    :return: Metadata dictionaries, one per call, including "Rolewise Transcript".
+    """
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, 9)
+    calls = []
+    for i in range(count):
+        agent_name, agent_id = rng.choice(AGENTS)
+        purpose = rng.choice(PURPOSES)
+        branch = rng.choice(BRANCHES)
+        turns = [
+            f"Agent: Hello, this is {agent_name} calling from Aavas about your {purpose.lower()} loan enquiry.",
+            "Customer: Yes, I had enquired last week.",
+        ]
+        for reason in rng.sample(REASONS, rng.randint(1, 2)):
+            turns.append("Agent: Would you like to go ahead with the application?")
+            turns.append(f"Customer: Not yet. {reason}.")
+        turns.append("Agent: Thank you, I will share the details on WhatsApp.")
+        calls.append({
+            "Serial Number": f"SN{i:06d}",
+            "Lead Id": f"L{rng.randint(100000, 999999)}",
+            "Call Length": float(rng.randint(30, 1200)),
+            "Call DateTime": (start + timedelta(minutes=37 * i)).isoformat(),
+            "Language of the call": rng.choice(LANGUAGES),
+            "Purpose": purpose,
+            "Product offered": purpose,
+            "Lead Source": rng.choice(LEAD_SOURCES),
+            "Location": branch,
+            "Branch": branch,
+            "Opportunity Created": rng.random() < 0.3,
+            "Business Created": rng.random() < 0.1,
+            "Agent Name": agent_name,
+            "Agent ID": agent_id,
+            "Rolewise Transcript": "\n".join(turns),
+        })
+    return calls
+
+
+def transcript_chunks(calls: List[Dict[str, Any]], turns_per_chunk: int = 2) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Split each call transcript into chunks, in the shape stored in call_embeddings_detailed.
+    """
+    chunks = []
+    for call in calls:
+        turns = call["Rolewise Transcript"].split("\n")
+        for start in range(0, len(turns), turns_per_chunk):
+            chunks.append(("\n".join(turns[start:start + turns_per_chunk]), {"Serial Number": call["Serial Number"], "Chunk": start // turns_per_chunk}))
+    return chunks
+
+
+def hashed_embedding(text: str, dimensions: int = 256) -> List[float]:
+    """
+    Deterministic bag-of-words embedding: texts sharing words get a high cosine similarity.
+    """
+    vector = [0.0] * dimensions
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        digest = hashlib.md5(token.encode("utf-8")).digest()
+        vector[int.from_bytes(digest[:4], "little") % dimensions] += 1.0
+    norm = math.sqrt(sum(value * value for value in vector))
+    if norm == 0:
+        vector[0], norm = 1.0, 1.0
+    return [value / norm for value in vector]
+
+
+def split_question(question: str) -> List[str]:
+    """
+    Stand-in query decomposition: one sub question per clause joined by "and".
+    """
+    parts = [part.strip(" ?.") for part in re.split(r"\s+and\s+", question) if part.strip(" ?.")]
+    return [part[0].upper() + part[1:] + "?" for part in parts] or [question]
+
+
+def fake_route(query: str) -> Dict[str, str]:
+    """
+    Stand-in routing decisions for a sub question, by keyword.
+    """
+    lowered = query.lower()
+    about_content = any(re.search(rf"\b{word}", lowered) for word in TRANSCRIPT_WORDS)
+    about_metadata = any(re.search(rf"\b{word}", lowered) for word in METADATA_WORDS)
+    if about_metadata and not about_content:
+        filtering, analysis = "metadata_filtering", "metadata_analysis"
+    else:
+        filtering, analysis = "transcript_filtering", "detailed_analysis" if "detail" in lowered else "general_analysis"
+    return {"filtering_function": filtering, "analysis_function": analysis, "reporting_function": "Pointers"}
+
+
+def fake_filter(query: str) -> str:
+    """
+    Stand-in self-query filter in the query constructor's grammar, e.g. 'gt("Call Length", 600)'.
+    """
+    lowered = query.lower()
+    comparisons = []
+    longer = re.search(r"(?:more|greater|longer|over|above)\s+than\s+(\d+)", lowered)
+    if longer:
+        comparisons.append(f'gt("Call Length", {longer.group(1)})')
+    shorter = re.search(r"(?:less|shorter|under|below)\s+than\s+(\d+)", lowered)
+    if shorter:
+        comparisons.append(f'lt("Call Length", {shorter.group(1)})')
+    comparisons += [f'eq("Language of the call", "{language}")' for language in LANGUAGES if language.lower() in lowered]
+    comparisons += [f'eq("Lead Source", "{source}")' for source in LEAD_SOURCES if source.lower() in lowered]
+    if not comparisons:
+        return "NO_FILTER"
+    return comparisons[0] if len(comparisons) == 1 else f"and({', '.join(comparisons)})"
+
+
+def fake_analysis(prompt: str) -> str:
+    """
+    Stand-in analysis or report: three numbered reasons chosen deterministically from the prompt.
+    """
+    rng = random.Random(int(hashlib.md5(prompt.encode("utf-8")).hexdigest()[:8], 16))
+    reasons = rng.sample(REASONS, 3)
+    return "Customers gave the following reasons:\n" + "\n".join(f"{i}. {reason}" for i, reason in enumerate(reasons, 1))
+
+
+def _approximate_tokens(text: str) -> int:
+    return max(1, len(text.split()) * 4 // 3)
+
+
+class ApproximateEncoding:
+    """
+    Offline stand-in for the cl100k encoding: a token per four characters of a word, with any
+    trailing whitespace, which is close to cl100k on English and keeps decoded prefixes exact.
+    """
+
+    def encode(self, text: str, disallowed_special: Any = ()) -> List[str]:
+        return re.findall(r"\S{1,4}\s*|\s+", text)
+
+    def decode(self, tokens: List[str]) -> str:
+        return "".join(tokens)
+
+
+class FakeOpenAI:
+    """
+    Deterministic stand-in for the OpenAI HTTP API, served through an httpx transport.
+
+    Chat and embedding requests are answered from the request content alone after a
+    fixed latency plus a per-completion-token delay, so runs are repeatable and need
+    no network access.
+    """
+
+    def __init__(self, latency: float = 0.2, seconds_per_token: float = 0.0, embedding_latency: float = 0.02, dimensions: int = 256):
+        """
+        :param latency: Seconds before every chat response.
+        :param seconds_per_token: Extra seconds per completion token.
+        :param embedding_latency: Seconds before every embedding response.
+        :param dimensions: Embedding size.
+        """
+        self.latency = latency
+        self.seconds_per_token = seconds_per_token
+        self.embedding_latency = embedding_latency
+        self.dimensions = dimensions
+        self.requests: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def async_transport(self) -> httpx.MockTransport:
+        """
+        Transport for the gateway's async client; sleeps without blocking the event loop.
+        """
+        async def handle(request: httpx.Request) -> httpx.Response:
+            response, delay = self._respond(request)
+            await asyncio.sleep(delay)
+            return response
+        return httpx.MockTransport(handle)
+
+    def _respond(self, request: httpx.Request) -> Tuple[httpx.Response, float]:
+        body = json.loads(request.content or b"{}")
+        model = body.get("model", "")
+        endpoint = request.url.path.rsplit("/v1", 1)[-1]
+        with self._lock:
+            self.requests[f"{endpoint} {model}"] += 1
+
+        if endpoint == "/embeddings":
+            return self._embeddings(body), self.embedding_latency
+        if endpoint == "/chat/completions":
+            message, finish_reason = self._chat(body)
+            content = message.get("content") or json.dumps(message.get("tool_calls"))
+            prompt = " ".join(str(m.get("content") or "") for m in body.get("messages", []))
+            usage = self._usage(prompt, content)
+            delay = self.latency + self.seconds_per_token * usage["completion_tokens"]
+            if body.get("stream"):
+                return self._stream(model, message, finish_reason, usage), delay
+            choice = {"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}
+            return httpx.Response(200, json={"id": "chatcmpl-bench", "object": "chat.completion", "created": 0, "model": model, "choices": [choice], "usage": usage}), delay
+        return httpx.Response(404, json={"error": {"message": f"Unknown endpoint {endpoint}"}}), 0.0
+
+    def _usage(self, prompt: str, completion: str) -> Dict[str, int]:
+        prompt_tokens, completion_tokens = _approximate_tokens(prompt), _approximate_tokens(completion)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+    def _chat(self, body: Dict[str, Any]) -> Tuple[Dict[str, Any], str]:
+        messages = body.get("messages", [])
+        system = " ".join(str(m.get("content") or "") for m in messages if m.get("role") == "system")
+        user = next((str(m.get("content") or "") for m in reversed(messages) if m.get("role") == "user"), "")
+        tools = [tool["function"]["name"] for tool in body.get("tools", [])]
+
+        if "Structured Request:" in user:
+            return {"role": "assistant", "content": self._self_query(user)}, "stop"
+        if "QueryPlan" in tools:
+            plan = {
+                "sub_queries": [{"sub_query": query, **fake_route(query)} for query in split_question(user)],
+                "reporting_function": "Pointers",
+            }
+            return self._tool_message([("QueryPlan", plan)]), "tool_calls"
+        if "SubQuery" in tools:
+            return self._tool_message([("SubQuery", {"sub_query": query}) for query in split_question(user)]), "tool_calls"
+        for key in ("filtering_function", "analysis_function", "reporting_function"):
+            if f'"{key}"' in system:
+                return {"role": "assistant", "content": json.dumps({key: fake_route(user)[key]})}, "stop"
+        return {"role": "assistant", "content": fake_analysis(user)}, "stop"
+
+    def _tool_message(self, calls: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]:
+        tool_calls = [
+            {"id": f"call_{i}", "type": "function", "function": {"name": name, "arguments": json.dumps(arguments)}}
+            for i, (name, arguments) in enumerate(calls)
+        ]
+        return {"role": "assistant", "content": None, "tool_calls": tool_calls}
+
+    def _self_query(self, prompt: str) -> str:
+        # The query constructor prompt ends with the user's query after its few-shot examples
+        query = prompt.rsplit("User Query:", 1)[-1].split("Structured Request:", 1)[0].strip()
+        return "```json\n" + json.dumps({"query": query, "filter": fake_filter(query)}) + "\n```"
+
+    def _stream(self, model: str, message: Dict[str, Any], finish_reason: str, usage: Dict[str, int]) -> httpx.Response:
+        def chunk(choices: List[Dict[str, Any]], **extra: Any) -> str:
+            payload = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": model, "choices": choices, **extra}
+            return f"data: {json.dumps(payload)}\n\n"
+
+        words = re.findall(r"\S+\s*", message.get("content") or "")
+        events = [chunk([{"index": 0, "delta": {"content": word}, "finish_reason": None}]) for word in words]
+        events.append(chunk([{"index": 0, "delta": {}, "finish_reason": finish_reason}]))
+        events.append(chunk([], usage=usage))
+        events.append("data: [DONE]\n\n")
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content="".join(events).encode("utf-8"))
+
+    def _embeddings(self, body: Dict[str, Any]) -> httpx.Response:
+        inputs = body.get("input", [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        data = []
+        for i, text in enumerate(inputs):
+            vector = hashed_embedding(text, self.dimensions)
+            # The SDK asks for base64 when numpy is installed
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(array("f", vector).tobytes()).decode("ascii")
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+        tokens = sum(_approximate_tokens(text) for text in inputs)
+        return httpx.Response(200, json={"object": "list", "data": data, "model": body.get("model", ""), "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+
+class StandInTranslator(Visitor):
+    """
+    Translate structured queries to the "$"-prefixed filter dictionaries StandInVectorStore evaluates.
+    """
+
+    def visit_operation(self, operation: Operation) -> Dict[str, Any]:
+        return {f"${operation.operator.value}": [argument.accept(self) for argument in operation.arguments]}
+
+    def visit_comparison(self, comparison: Comparison) -> Dict[str, Any]:
+        value = comparison.value
+        # Dates arrive as {"date": "YYYY-MM-DD", "type": "date"} and compare as ISO strings
+        if isinstance(value, dict) and "date" in value:
+            value = value["date"]
+        return {comparison.attribute: {f"${comparison.comparator.value}": value}}
+
+    def visit_structured_query(self, structured_query: StructuredQuery) -> Tuple[str, Dict[str, Any]]:
+        if structured_query.filter is None:
+            return structured_query.query, {}
+        return structured_query.query, {"filter": structured_query.filter.accept(self)}
+
+
+_ORDERING = {"$eq": operator.eq, "$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le}
+
+
+def _compare(value: Any, op: str, target: Any) -> bool:
+    if op == "$in":
+        return value is not None and str(value) in {str(item) for item in target}
+    if op == "$nin":
+        return value is None or str(value) not in {str(item) for item in target}
+    if op in ("$like", "$contain"):
+        return value is not None and str(target).strip("%").lower() in str(value).lower()
+    if op == "$ne":
+        return not _compare(value, "$eq", target)
+    if op not in _ORDERING:
+        raise ValueError(f"Unsupported filter operator: {op}")
+    if value is None:
+        return False
+    try:
+        left, right = float(value), float(target)
+    except (TypeError, ValueError):
+        left, right = str(value).lower(), str(target).lower()
+    return _ORDERING[op](left, right)
+
+
+def matches_filter(metadata: Dict[str, Any], condition: Dict[str, Any]) -> bool:
+    """
+    Evaluate a PGVector-style metadata filter ({"field": {"$op": value}}, "$and", "$or", "$not") in Python.
+    """
+    for key, value in condition.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, clause) for clause in value):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, clause) for clause in value):
+                return False
+        elif key == "$not":
+            if any(matches_filter(metadata, clause) for clause in value):
+                return False
+        else:
+            clauses = value if isinstance(value, dict) else {"$eq": value}
+            if not all(_compare(metadata.get(key), op, target) for op, target in clauses.items()):
+                return False
+    return True
+
+
+class StandInVectorStore(VectorStore):
+    """
+    In-process vector store with PGVector's cosine scoring and filter operators, for offline benchmarks.
+
+    Every search counts as one database round trip in round_trips, keyed by collection name.
+    """
+
+    def __init__(self, embedding: Embeddings, collection_name: str, round_trips: Optional[Counter] = None):
+        self.embedding = embedding
+        self.collection_name = collection_name
+        self.round_trips = round_trips if round_trips is not None else Counter()
+        # Picked up by Filtering.build_self_query_retriever
+        self.structured_query_translator = StandInTranslator()
+        self._documents: List[Document] = []
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas if metadatas is not None else [{} for _ in texts]
+        vectors = np.asarray(self.embedding.embed_documents(texts), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        with self._lock:
+            first = len(self._documents)
+            self._documents.extend(Document(page_content=text, metadata=dict(metadata)) for text, metadata in zip(texts, metadatas))
+            self._matrix = vectors if self._matrix.size == 0 else np.vstack([self._matrix, vectors])
+        return [str(first + i) for i in range(len(texts))]
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, collection_name: str = "stand_in", **kwargs: Any) -> "StandInVectorStore":
+        store = cls(embedding, collection_name)
+        store.add_texts(texts, metadatas)
+        return store
+
+    def _nearest(self, query: str, k: int, filter: Optional[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+        # Indices and cosine similarities of the k most similar documents passing the filter
+        with self._lock:
+            self.round_trips[self.collection_name] += 1
+        vector = np.asarray(self.embedding.embed_query(query), dtype=np.float32)
+        vector /= np.linalg.norm(vector)
+        if filter:
+            rows = np.array([i for i, doc in enumerate(self._documents) if matches_filter(doc.metadata, filter)], dtype=np.int64)
+        else:
+            rows = np.arange(len(self._documents))
+        if rows.size == 0:
+            return rows, np.empty(0, dtype=np.float32)
+        similarities = self._matrix[rows] @ vector
+        top = np.argsort(-similarities, kind="stable")[:k]
+        return rows[top], similarities[top]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        rows, similarities = self._nearest(query, k, filter)
+        # Scores are cosine distances, as PGVector returns them
+        return [(self._documents[i], float(1.0 - similarity)) for i, similarity in zip(rows, similarities)]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return lambda distance: 1.0 - distance
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5, filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        rows, similarities = self._nearest(query, fetch_k, filter)
+        candidates = self._matrix[rows]
+        selected: List[int] = []
+        while len(selected) < min(k, len(rows)):
+            redundancy = (candidates @ candidates[selected].T).max(axis=1) if selected else np.zeros(len(rows))
+            scores = lambda_mult * similarities - (1 - lambda_mult) * redundancy
+            scores[selected] = -np.inf
+            selected.append(int(np.argmax(scores)))
+        return [self._documents[rows[i]] for i in selected]
+
+
+def offline_environment(fake: FakeOpenAI) -> Dict[str, Any]:
+    """
+    Point every module at the stand-in OpenAI: offline config, in-memory caches, no rate limiting
+    and an approximate tokenizer, so nothing is downloaded. Must run before any chain or client is built.
+    """
+    config = {
+        "OPENAI_API_KEY": "offline-benchmark",
+        "RESPONSE_CACHE_PATH": ":memory:",
+        "RESPONSE_CACHE_BYPASS": "1",
+        "EMBEDDING_CACHE_PATH": ":memory:",
+        "RETRIEVAL_CACHE_PATH": ":memory:",
+        "RETRIEVAL_CACHE_BYPASS": "1",
+    }
+    set_config(config)
+    set_gateway(OpenAIGateway(
+        api_key=config["OPENAI_API_KEY"],
+        rate_limits={model: (1e9, 1e12) for model in DEFAULT_RATE_LIMITS},
+        async_transport=fake.async_transport(),
+    ))
+    # Same token counts on every machine, whether or not tiktoken has cl100k cached
+    set_encoding(ApproximateEncoding())
+    return config
+
+
+def build_stand_in_stores(calls: List[Dict[str, Any]], embedding_model: Embeddings, round_trips: Counter) -> Tuple[StandInVectorStore, StandInVectorStore]:
+    """
+    Load the synthetic corpus into in-process stand-ins for the two PGVector collections.
+    """
+    metadata_store = StandInVectorStore(embedding_model, "call_embeddings", round_trips)
+    metadata_store.add_texts([call["Rolewise Transcript"] for call in calls], calls)
+    chunk_store = StandInVectorStore(embedding_model, "call_embeddings_detailed", round_trips)
+    texts, metadatas = zip(*transcript_chunks(calls))
+    chunk_store.add_texts(list(texts), list(metadatas))
+    return metadata_store, chunk_store
+
+
+def build_postgres_stores(calls: List[Dict[str, Any]], embedding_model: Embeddings, connection_string: str, round_trips: Counter) -> Tuple[Any, Any]:
+    """
+    Seed the synthetic corpus into benchmark PGVector collections and the typed metadata table,
+    then count every SQL statement sent on any engine. Use a scratch database: the typed
+    metadata table is shared with production collections.
+    """
+    from langchain.vectorstores import PGVector
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from Metadata_Table import refresh_metadata_table
+
+    metadata_store = PGVector.from_texts(
+        [call["Rolewise Transcript"] for call in calls], embedding_model, calls,
+        collection_name="benchmark_call_embeddings", connection_string=connection_string, pre_delete_collection=True,
+    )
+    texts, metadatas = zip(*transcript_chunks(calls))
+    chunk_store = PGVector.from_texts(
+        list(texts), embedding_model, list(metadatas),
+        collection_name="benchmark_call_embeddings_detailed", connection_string=connection_string, pre_delete_collection=True,
+    )
+    refresh_metadata_table(connection_string, metadata_store.collection_name)
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def count_statement(*_args: Any) -> None:
+        round_trips["postgres"] += 1
+
+    return metadata_store, chunk_store
+
+
+def _timed(stage: str, func: Any, timings: Dict[str, List[float]]) -> Any:
+    async def node(*deps: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return await func(*deps)
+        finally:
+            timings[stage].append(time.perf_counter() - start)
+    return node
+
+
+async def timed_answer(question: str, stores: Tuple[Any, Any], timings: Dict[str, List[float]], max_concurrency: int = 4, connection_string: Optional[str] = None, counting: str = "sql", fused: bool = True) -> Optional[str]:
+    """
+    Answer a question like Pipeline.answer_question, recording the duration of every stage.
+
+    :param question: The user's question.
+    :param stores: (metadata store, transcript chunk store).
+    :param timings: Stage name -> durations in seconds, appended to in place. Stages are
+                    "planning", "metadata", "search", "analysis", "count", "report" and "total".
+    :param max_concurrency: Maximum LLM or database calls in flight for this question.
+    :param connection_string: Enables the SQL filtering and counting paths.
+    :param counting: "sql" or "assign", see Pipeline.build_execution_graph.
+    :param fused: Plan with one structured call instead of analyze_query and module_chooser.
+    :return: The final report.
+    """
+    start = time.perf_counter()
+    sub_queries, module, final_response_format = await plan_question(question, max_concurrency, fused)
+    timings["planning"].append(time.perf_counter() - start)
+
+    nodes = build_execution_graph(question, module, final_response_format, stores[0], stores[1], connection_string, counting)
+    for name, (func, deps) in nodes.items():
+        stage = name.partition(":")[0]
+        if stage != "report_inputs":
+            nodes[name] = (_timed(stage, func, timings), deps)
+    results = await run_dag(nodes, max_concurrency)
+    timings["total"].append(time.perf_counter() - start)
+    return results["report"]
+
+
+def summarize_latencies(values: List[float]) -> Dict[str, float]:
+    """
+    Mean and nearest-rank percentiles of durations, in milliseconds.
+    """
+    ordered = sorted(values)
+
+    def percentile(p: float) -> float:
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(1000 * sum(ordered) / len(ordered), 2),
+        "p50_ms": round(1000 * percentile(50), 2),
+        "p90_ms": round(1000 * percentile(90), 2),
+        "p99_ms": round(1000 * percentile(99), 2),
+        "max_ms": round(1000 * ordered[-1], 2),
+    }
+
+
+async def run_level(questions: List[str], stores: Tuple[Any, Any], concurrency: int, requests: int, fake: FakeOpenAI, round_trips: Counter, **options: Any) -> Dict[str, Any]:
+    """
+    Answer `requests` questions (cycling through the list) with `concurrency` questions in flight.
+
+    :return: Throughput, per-stage latency percentiles, and DB and OpenAI requests per question.
+    """
+    timings: Dict[str, List[float]] = defaultdict(list)
+    slots = asyncio.Semaphore(concurrency)
+    trips_before = sum(round_trips.values())
+    openai_before = fake.requests.copy()
+
+    async def one(question: str) -> None:
+        async with slots:
+            await timed_answer(question, stores, timings, **options)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(questions[i % len(questions)]) for i in range(requests)))
+    wall = time.perf_counter() - start
+
+    openai_requests = fake.requests - openai_before
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "wall_seconds": round(wall, 3),
+        "throughput_qps": round(requests / wall, 3),
+        "stages": {stage: summarize_latencies(values) for stage, values in sorted(timings.items())},
+        "db_round_trips_per_question": round((sum(round_trips.values()) - trips_before) / requests, 2),
+        "openai_requests_per_question": {key: round(count / requests, 2) for key, count in sorted(openai_requests.items())},
+    }
+
+
+def compare_to_baseline(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.2) -> List[str]:
+    """
+    List regressions against a previous report: slower stage p50s, lower throughput or more DB round trips.
+    """
+    regressions = []
+    baseline_levels = {level["concurrency"]: level for level in baseline["levels"]}
+    for level in report["levels"]:
+        base = baseline_levels.get(level["concurrency"])
+        if base is None:
+            continue
+        prefix = f"concurrency {level['concurrency']}"
+        for stage, stats in level["stages"].items():
+            base_p50 = base["stages"].get(stage, {}).get("p50_ms")
+            if base_p50 and stats["p50_ms"] > base_p50 * (1 + tolerance):
+                regressions.append(f"{prefix}: {stage} p50 {stats['p50_ms']}ms vs {base_p50}ms")
+        if level["throughput_qps"] < base["throughput_qps"] * (1 - tolerance):
+            regressions.append(f"{prefix}: throughput {level['throughput_qps']} vs {base['throughput_qps']} questions/s")
+        if level["db_round_trips_per_question"] > base["db_round_trips_per_question"] * (1 + tolerance):
+            regressions.append(f"{prefix}: {level['db_round_trips_per_question']} vs {base['db_round_trips_per_question']} DB round trips per question")
+    return regressions
+
+
+async def run_benchmark(
+    questions: List[str],
+    concurrency_levels: List[int],
+    requests: Optional[int] = None,
+    calls: int = 500,
+    latency: float = 0.2,
+    seconds_per_token: float = 0.0,
+    embedding_latency: float = 0.02,
+    max_concurrency: int = 4,
+    fused: bool = True,
+    connection_string: Optional[str] = None,
+    counting: str = "sql",
+    seed: int = 7,
+) -> Dict[str, Any]:
+    """
+    Run the full pipeline against the stand-in LLM on a seeded synthetic corpus at several concurrency levels.
+
+    :param questions: Questions to answer, cycled through at every level.
+    :param concurrency_levels: Numbers of questions in flight at once.
+    :param requests: Questions answered per level; twice the number of questions by default.
+    :param calls: Size of the synthetic corpus.
+    :param latency: Stand-in LLM latency per request in seconds.
+    :param seconds_per_token: Extra stand-in LLM latency per completion token.
+    :param embedding_latency: Stand-in embedding latency per request in seconds.
+    :param max_concurrency: Maximum LLM or database calls in flight per question.
+    :param fused: Plan with the single-call planner instead of analyze_query and module_chooser.
+    :param connection_string: Seed a local Postgres and use the SQL paths instead of the in-process store.
+    :param counting: "sql" or "assign" reason counting when using Postgres.
+    :param seed: Corpus seed.
+    :return: Report with one entry per concurrency level.
+    """
+    fake = FakeOpenAI(latency, seconds_per_token, embedding_latency)
+    config = offline_environment(fake)
+    embedding_model = build_embedding_model(config)
+    round_trips: Counter = Counter()
+
+    corpus = synthetic_calls(calls, seed)
+    if connection_string:
+        stores = await asyncio.to_thread(build_postgres_stores, corpus, embedding_model, connection_string, round_trips)
+    else:
+        stores = await asyncio.to_thread(build_stand_in_stores, corpus, embedding_model, round_trips)
+    options = {"max_concurrency": max_concurrency, "connection_string": connection_string, "counting": counting, "fused": fused}
+
+    # One unmeasured pass builds the chains and warms the embedding cache
+    for question in questions:
+        await timed_answer(question, stores, defaultdict(list), **options)
+
+    levels = []
+    for concurrency in concurrency_levels:
+        levels.append(await run_level(questions, stores, concurrency, requests or 2 * len(questions), fake, round_trips, **options))
+    return {
+        "store": "postgres" if connection_string else "stand-in",
+        "corpus_calls": calls,
+        "questions": len(questions),
+        "llm_latency_seconds": latency,
+        "planning": "fused" if fused else "chained",
+        "levels": levels,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline offline against a deterministic stand-in LLM and a synthetic corpus")
+    parser.add_argument("--questions", help="Text file with one question per line; built-in questions by default")
+    parser.add_argument("--concurrency", default="1,4,8", help="Comma-separated numbers of questions in flight")
+    parser.add_argument("--requests", type=int, help="Questions answered per concurrency level")
+    parser.add_argument("--calls", type=int, default=500, help="Synthetic corpus size")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--seconds-per-token", type=float, default=0.0)
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--planning", choices=["fused", "chained"], default="fused")
+    parser.add_argument("--connection-string", help="Scratch Postgres with pgvector to seed instead of the in-process store")
+    parser.add_argument("--counting", choices=["sql", "assign"], default="sql")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    parser.add_argument("--baseline", help="Previous JSON report; exit non-zero on regressions beyond --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions) as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    report = asyncio.run(run_benchmark(
+        questions,
+        [int(level) for level in args.concurrency.split(",")],
+        args.requests,
+        args.calls,
+        args.llm_latency,
+        args.seconds_per_token,
+        args.embedding_latency,
+        args.max_concurrency,
+        args.planning == "fused",
+        args.connection_string,
+        args.counting,
+        args.seed,
+    ))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,207 @@
+import contextvars
+import json
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from Settings import get_config
+
+# Degradation steps, taken in order as a question's projected usage approaches its budget
+NORMAL = 0
+FEWER_TRANSCRIPTS = 1
+CHEAPER_MODEL = 2
+TRUNCATED_SUMMARIES = 3
+
+# Fraction of the budget at which each step starts, overridable with BUDGET_DEGRADE_AT
+DEFAULT_DEGRADE_AT = (0.6, 0.8, 0.9)
+
+# Model used for intermediate analysis once CHEAPER_MODEL is reached, overridable with BUDGET_FALLBACK_MODEL
+DEFAULT_FALLBACK_MODEL = "gpt-4o-mini"
+
+# Default USD per million (prompt, completion) tokens, overridable with MODEL_PRICES
+DEFAULT_PRICES = {
+    "gpt-4o": (5.0, 15.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-3.5-turbo-0125": (0.5, 1.5),
+    "gpt-3.5-turbo-instruct": (1.5, 2.0),
+    "text-embedding-ada-002": (0.1, 0.0),
+}
+FALLBACK_PRICE = (5.0, 15.0)
+
+# Budget of the question being answered in this thread or task
+_current_budget: "contextvars.ContextVar[Optional[QueryBudget]]" = contextvars.ContextVar("current_budget", default=None)
+
+
+class QueryBudget:
+    """
+    Token and cost accounting for one question, with the degradation level for each planned call.
+
+    Either limit may be None; with neither set the budget only accounts.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, max_cost: Optional[float] = None, prices: Optional[Dict[str, Tuple[float, float]]] = None, degrade_at: Sequence[float] = DEFAULT_DEGRADE_AT, fallback_model: str = DEFAULT_FALLBACK_MODEL):
+        """
+        :param max_tokens: Total tokens (prompt plus completion, every model) the question may use.
+        :param max_cost: Total USD the question may cost.
+        :param prices: USD per million (prompt, completion) tokens per model.
+        :param degrade_at: Budget fractions at which FEWER_TRANSCRIPTS, CHEAPER_MODEL and TRUNCATED_SUMMARIES start.
+        :param fallback_model: Cheaper model for intermediate analysis.
+        """
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.prices = {**DEFAULT_PRICES, **(prices or {})}
+        self.degrade_at = tuple(degrade_at)
+        self.fallback_model = fallback_model
+        self.by_model: Dict[str, Dict[str, int]] = {}
+        self.degradations: List[str] = []
+        self._lock = threading.Lock()
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int = 0) -> float:
+        """
+        USD cost of the given token counts on a model.
+        """
+        prompt_price, completion_price = self.prices.get(model, FALLBACK_PRICE)
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+    @property
+    def tokens(self) -> int:
+        with self._lock:
+            return sum(usage["prompt_tokens"] + usage["completion_tokens"] for usage in self.by_model.values())
+
+    @property
+    def spent(self) -> float:
+        with self._lock:
+            return sum(self.cost(model, usage["prompt_tokens"], usage["completion_tokens"]) for model, usage in self.by_model.items())
+
+    def charge(self, model: str, usage: Any) -> None:
+        """
+        Add the actual usage of one call, from an OpenAI usage object or dictionary.
+        """
+        if usage is None:
+            return
+        get = usage.get if isinstance(usage, dict) else lambda key: getattr(usage, key, None)
+        prompt_tokens = get("prompt_tokens") or 0
+        completion_tokens = get("completion_tokens") or 0
+        with self._lock:
+            totals = self.by_model.setdefault(model, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+
+    def pressure(self, model: str, prompt_tokens: int, completion_tokens: int = 0) -> float:
+        """
+        Fraction of the tighter limit that would be used after a call of the given estimated size.
+        """
+        fractions = [0.0]
+        if self.max_tokens:
+            fractions.append((self.tokens + prompt_tokens + completion_tokens) / self.max_tokens)
+        if self.max_cost:
+            fractions.append((self.spent + self.cost(model, prompt_tokens, completion_tokens)) / self.max_cost)
+        return max(fractions)
+
+    def level(self, model: str, prompt_tokens: int, completion_tokens: int = 0) -> int:
+        """
+        Degradation step to apply to a planned call: NORMAL up to TRUNCATED_SUMMARIES.
+        """
+        pressure = self.pressure(model, prompt_tokens, completion_tokens)
+        return sum(1 for threshold in self.degrade_at if pressure >= threshold)
+
+    def headroom(self, model: str, completion_tokens: int, level: int = FEWER_TRANSCRIPTS) -> int:
+        """
+        Prompt tokens a call on the model can still send before reaching the given degradation step.
+        """
+        threshold = self.degrade_at[level - 1]
+        limits = []
+        if self.max_tokens:
+            limits.append(threshold * self.max_tokens - self.tokens - completion_tokens)
+        if self.max_cost:
+            prompt_price = self.prices.get(model, FALLBACK_PRICE)[0] or 1e-9
+            remaining = threshold * self.max_cost - self.spent - self.cost(model, 0, completion_tokens)
+            limits.append(remaining / prompt_price * 1e6)
+        return max(0, int(min(limits))) if limits else 2 ** 31
+
+    def degrade(self, step: str) -> None:
+        """
+        Note a degradation that was applied, for the question's accounting.
+        """
+        with self._lock:
+            self.degradations.append(step)
+
+    def accounting(self) -> Dict[str, Any]:
+        """
+        Tokens and cost per model and in total, the limits, and the degradations applied.
+        """
+        with self._lock:
+            by_model = {
+                model: {**usage, "cost_usd": round(self.cost(model, usage["prompt_tokens"], usage["completion_tokens"]), 6)}
+                for model, usage in self.by_model.items()
+            }
+            degradations = list(self.degradations)
+        return {
+            "prompt_tokens": sum(usage["prompt_tokens"] for usage in by_model.values()),
+            "completion_tokens": sum(usage["completion_tokens"] for usage in by_model.values()),
+            "total_tokens": sum(usage["prompt_tokens"] + usage["completion_tokens"] for usage in by_model.values()),
+            "cost_usd": round(sum(usage["cost_usd"] for usage in by_model.values()), 6),
+            "max_tokens": self.max_tokens,
+            "max_cost_usd": self.max_cost,
+            "by_model": by_model,
+            "degradations": degradations,
+        }
+
+
+def new_budget() -> QueryBudget:
+    """
+    Build a budget for one question from QUERY_TOKEN_BUDGET, QUERY_COST_BUDGET, MODEL_PRICES,
+    BUDGET_DEGRADE_AT and BUDGET_FALLBACK_MODEL.
+    """
+    config = get_config()
+
+    def setting(key: str) -> Any:
+        value = config.get(key)
+        return json.loads(value) if isinstance(value, str) and value[:1] in "[{" else value
+
+    prices = setting("MODEL_PRICES") or {}
+    max_tokens = config.get("QUERY_TOKEN_BUDGET")
+    max_cost = config.get("QUERY_COST_BUDGET")
+    return QueryBudget(
+        max_tokens=int(max_tokens) if max_tokens else None,
+        max_cost=float(max_cost) if max_cost else None,
+        prices={model: tuple(price) for model, price in prices.items()},
+        degrade_at=setting("BUDGET_DEGRADE_AT") or DEFAULT_DEGRADE_AT,
+        fallback_model=config.get("BUDGET_FALLBACK_MODEL") or DEFAULT_FALLBACK_MODEL,
+    )
+
+
+def current_budget() -> Optional[QueryBudget]:
+    """
+    Return the budget of the question being answered in this thread or task, if any.
+    """
+    return _current_budget.get()
+
+
+@contextmanager
+def query_budget(budget: Optional[QueryBudget] = None) -> Iterator[QueryBudget]:
+    """
+    Charge every OpenAI call made inside the block, including from worker threads started
+    with the current context, to one question's budget.
+
+    :param budget: The budget to use; by default a new one from the configuration.
+    """
+    budget = budget if budget is not None else new_budget()
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        try:
+            _current_budget.reset(token)
+        except ValueError:
+            # An async generator closed from another context; that context never saw the budget
+            pass
+
+
+def charge(model: str, usage: Any) -> None:
+    """
+    Charge the actual usage of one call to the current question's budget, if there is one.
+    """
+    budget = current_budget()
+    if budget is not None:
+        budget.charge(model, usage)
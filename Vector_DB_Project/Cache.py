@@ -0,0 +1,156 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+from Settings import get_config
+from Tracing import span
+
+
+def make_key(model: str, messages: List[Dict[str, str]], params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Build a cache key from everything that determines an LLM response.
+
+    :param model: The model name.
+    :param messages: The chat messages as role/content dictionaries.
+    :param params: Any other request parameters (max_tokens, temperature, tools, ...).
+    :return: Hex SHA-256 digest of the canonical JSON encoding.
+    """
+    payload = json.dumps({"model": model, "messages": messages, "params": params or {}}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def schema_digest(schema_model: Any) -> str:
+    """
+    Digest of a pydantic model's JSON schema, for the params of structured-output requests, so
+    responses cached for an older shape of the model are never parsed into the new one.
+    """
+    payload = json.dumps(schema_model.model_json_schema(), sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache of LLM responses with TTL expiry and LRU eviction.
+
+    Values are stored as JSON, so anything JSON-serializable can be cached.
+    """
+
+    def __init__(self, path: str, ttl_seconds: Optional[float] = None, max_entries: Optional[int] = None, bypass: bool = False):
+        """
+        :param path: SQLite database file, or ":memory:".
+        :param ttl_seconds: Entries older than this are treated as misses. None disables expiry.
+        :param max_entries: Least recently used entries beyond this count are evicted. None disables eviction.
+        :param bypass: When True every lookup misses and nothing is stored.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a cached value, returning None on a miss.
+        """
+        if self.bypass:
+            self.misses += 1
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl_seconds is not None and now - row[1] > self.ttl_seconds):
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Store a value, evicting the least recently used entries beyond max_entries.
+        """
+        if self.bypass:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            if self.max_entries is not None:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+    def get_or_compute(self, model: str, messages: List[Dict[str, str]], params: Optional[Dict[str, Any]], compute: Callable[[], Any], bypass: bool = False) -> Any:
+        """
+        Return the cached response for this request, calling compute and caching its result on a miss.
+
+        :param model: The model name.
+        :param messages: The chat messages as role/content dictionaries.
+        :param params: Any other request parameters.
+        :param compute: Zero-argument callable that performs the actual request.
+        :param bypass: Skip the cache for this call only.
+        :return: The cached or freshly computed value.
+        """
+        if bypass:
+            return compute()
+        with span("cache.lookup", "cache", model=model) as current:
+            key = make_key(model, messages, params)
+            value = self.get(key)
+            current.set(cache_hit=value is not None)
+            if value is None:
+                value = compute()
+                self.set(key, value)
+        return value
+
+    def clear(self) -> None:
+        """
+        Remove every entry and reset the counters.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+        self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return hit/miss counters, hit rate and current size.
+        """
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0, "entries": size}
+
+
+@lru_cache(maxsize=None)
+def get_response_cache() -> ResponseCache:
+    """
+    Return the cache shared by every module that calls an LLM, opening it on first use.
+    """
+    config = get_config()
+    return ResponseCache(
+        path=config.get("RESPONSE_CACHE_PATH", "response_cache.sqlite"),
+        ttl_seconds=float(config["RESPONSE_CACHE_TTL"]) if config.get("RESPONSE_CACHE_TTL") else None,
+        max_entries=int(config["RESPONSE_CACHE_MAX_ENTRIES"]) if config.get("RESPONSE_CACHE_MAX_ENTRIES") else None,
+        bypass=str(config.get("RESPONSE_CACHE_BYPASS", "")).lower() in ("1", "true", "yes"),
+    )
@@ -1,16 +1,12 @@
 from typing import Literal, List, Dict
-from pydantic import BaseModel, Field
-from langchain.output_parsers import PydanticToolsParser
-from langchain_core.prompts import ChatPromptTemplate
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import SystemMessage, HumanMessage
+from langchain_core.messages import SystemMessage, HumanMessage
 import json
-from config import load_config
+from Settings import get_config
+from Cache import get_response_cache
+from OpenAI_Client import get_gateway, openai_messages, INTERACTIVE
 
-config = load_config()
-
-# Initialize the OpenAI chat model
-llm = ChatOpenAI(openai_api_key=config["OPENAI_API_KEY"], model="gpt-3.5-turbo-0125", temperature=0)
+# OpenAI chat model used for routing, called through the shared gateway
+model = "gpt-3.5-turbo-0125"
 
 # Metadata and Transcript fields description
 metadata_fields = """
@@ -30,31 +26,47 @@ metadata_fields = """
 """
 transcript_fields = "Call transcripts Recordings where it records who has said what"
 
+def _choose(prompt: str, query: str, field: str, labels: List[str]) -> str:
+    """
+    Ask the routing model to pick one of labels for query, caching the choice.
+
+    :param prompt: System prompt asking for a JSON object with field set to the choice.
+    :param query: Sub-query being routed.
+    :param field: JSON key holding the choice in the response.
+    :param labels: Choices the prompt allows.
+    :return: The chosen label.
+    """
+    messages = openai_messages([SystemMessage(content=prompt), HumanMessage(content=query)])
+
+    def choose() -> str:
+        response = get_gateway().chat_completion(model=model, messages=messages, priority=INTERACTIVE, temperature=0)
+        content = response.choices[0].message.content
+        try:
+            choice = json.loads(content)[field]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            raise ValueError(f"Unexpected response format: {content}")
+        if choice not in labels:
+            raise ValueError(f"Unexpected {field}: {choice}")
+        return choice
+
+    # Only successfully parsed choices are cached
+    return get_response_cache().get_or_compute(model, messages, {"temperature": 0}, choose)
+
 # Define filtering function
 def choose_filtering_function(query: str) -> str:
-    filtering_messages = [
-        SystemMessage(content=f"""
+    return _choose("""
         You are an expert in selecting the filtering function.
         Choose "metadata_filtering" if the query is focused on metadata characteristics of a call recording( e.g. call duration, lead_source, etc), 
         and "transcript_filtering" if the query is focused on conversation happened during call.(like who said what, why in call)
         Respond in JSON format as:
-        {{
+        {
             "filtering_function": "<selected_function>"
-        }}
-        """),
-        HumanMessage(content=query)
-    ]
-    response = llm(filtering_messages)
-    try:
-        result = json.loads(response.content)
-        return result["filtering_function"]
-    except (json.JSONDecodeError, KeyError):
-        raise ValueError(f"Unexpected response format: {response.content}")
+        }
+        """, query, "filtering_function", ["metadata_filtering", "transcript_filtering"])
 
 # Define analysis function
 def choose_analysis_function(query: str) -> str:
-    analysis_messages = [
-        SystemMessage(content="""
+    return _choose("""
         You are an expert in selecting the analysis level required to answer the question.
         If the question is more analytical like find me count,etc around call characterestic,
         then Choose "metadata_analysis" for a numerical summary, If question is around who said what, why, reasoning kind of questions, then 
@@ -64,20 +76,11 @@ def choose_analysis_function(query: str) -> str:
         {
             "analysis_function": "<selected_function>"
         }
-        """),
-        HumanMessage(content=query)
-    ]
-    response = llm(analysis_messages)
-    try:
-        result = json.loads(response.content)
-        return result["analysis_function"]
-    except (json.JSONDecodeError, KeyError):
-        raise ValueError(f"Unexpected response format: {response.content}")
+        """, query, "analysis_function", ["metadata_analysis", "general_analysis", "detailed_analysis"])
 
 # Define reporting function
 def choose_reporting_function(query: str) -> str:
-    reporting_messages = [
-        SystemMessage(content="""
+    return _choose("""
         You are an expert in selecting the reporting format required to answer the question.
         Choose "Pointers" for a bullet-point response, 
         and "Summary" for a concise summary.
@@ -85,15 +88,20 @@ def choose_reporting_function(query: str) -> str:
         {
             "reporting_function": "<selected_function>"
         }
-        """),
-        HumanMessage(content=query)
-    ]
-    response = llm(reporting_messages)
-    try:
-        result = json.loads(response.content)
-        return result["reporting_function"]
-    except (json.JSONDecodeError, KeyError):
-        raise ValueError(f"Unexpected response format: {response.content}")
+        """, query, "reporting_function", ["Pointers", "Summary"])
+
+def log_routing(routed_functions: Dict[str, Dict[str, str]]) -> None:
+    """
+    Append routing decisions to ROUTING_LOG_PATH, if set, to train Router.EmbeddingRouter.
+
+    :param routed_functions: Sub-queries mapped to their filtering, analysis and reporting functions.
+    """
+    routing_log_path = get_config().get("ROUTING_LOG_PATH")
+    if not routing_log_path or not routed_functions:
+        return
+    with open(routing_log_path, "a") as f:
+        for query, functions in routed_functions.items():
+            f.write(json.dumps({"query": query, **functions}) + "\n")
 
 def module_chooser(sub_queries: List[str]) -> Dict[str, Dict[str, str]]:
     """
@@ -116,5 +124,7 @@ def module_chooser(sub_queries: List[str]) -> Dict[str, Dict[str, str]]:
             "analysis_function": analysis_function,
             "reporting_function": reporting_function
         }
-    
+
+    # Decisions are logged to train Router.EmbeddingRouter
+    log_routing(routed_functions)
     return routed_functions
@@ -0,0 +1,204 @@
+import hashlib
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables.config import run_in_executor
+from OpenAI_Client import estimate_tokens, get_gateway, split_tokens
+from Tracing import span
+
+# Longest input the OpenAI embedding models accept, in tokens
+EMBEDDING_CTX_LENGTH = 8191
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed embedding cache wrapping another LangChain embedding model.
+
+    Lookups go to an in-memory LRU first, then to a persistent SQLite store. All
+    texts missing from both are deduplicated and embedded in a single request, so
+    every distinct string is embedded once. A text already being embedded by another
+    thread is waited for rather than requested again.
+    """
+
+    def __init__(self, embedding_model: Embeddings, model_name: str, path: str = "embedding_cache.sqlite", max_memory_entries: int = 10000):
+        """
+        :param embedding_model: The underlying embedding model, e.g. OpenAIEmbeddings.
+        :param model_name: Model name mixed into the key so different models never share vectors.
+        :param path: SQLite database file for the persistent store, or ":memory:".
+        :param max_memory_entries: Size of the in-memory LRU.
+        """
+        self.embedding_model = embedding_model
+        self.model_name = model_name
+        self.max_memory_entries = max_memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        # Keys being embedded right now, each resolved by the thread that requested it
+        self._inflight: Dict[str, "Future[List[float]]"] = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        # Caller holds the lock
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            remaining = [key for key in keys if key not in found]
+            # SQLite limits bound parameters per statement, so look up in chunks
+            for start in range(0, len(remaining), 500):
+                chunk = remaining[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f", blob).tolist()
+                    found[key] = vector
+                    self._remember(key, vector)
+        return found
+
+    def _store(self, vectors: Dict[str, List[float]]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in vectors.items()],
+            )
+            self._conn.commit()
+            for key, vector in vectors.items():
+                self._remember(key, vector)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts, sending only distinct cache misses to the underlying model in one batch.
+        """
+        with span("embedding.cache", "cache", model=self.model_name, texts=len(texts)) as current:
+            keys = [self._key(text) for text in texts]
+            found = self._lookup(list(dict.fromkeys(keys)))
+
+            # Claim the misses nobody else is embedding; wait for the rest
+            missing: Dict[str, str] = {}
+            waiting: Dict[str, "Future[List[float]]"] = {}
+            with self._lock:
+                for key, text in zip(keys, texts):
+                    if key in found or key in missing or key in waiting:
+                        continue
+                    if key in self._memory:
+                        # Stored by another thread since the lookup
+                        found[key] = self._memory[key]
+                    elif key in self._inflight:
+                        waiting[key] = self._inflight[key]
+                    else:
+                        self._inflight[key] = Future()
+                        missing[key] = text
+            hits = sum(1 for key in keys if key not in missing)
+            self.hits += hits
+            self.misses += len(missing)
+            current.set(cache_hits=hits, cache_misses=len(missing), cache_waits=len(waiting))
+
+            if missing:
+                try:
+                    fresh = self.embedding_model.embed_documents(list(missing.values()))
+                    new_vectors = dict(zip(missing.keys(), fresh))
+                    self._store(new_vectors)
+                except BaseException as error:
+                    self._release(missing, error=error)
+                    raise
+                self._release(new_vectors)
+                found.update(new_vectors)
+            for key, future in waiting.items():
+                found[key] = future.result()
+        return [found[key] for key in keys]
+
+    def _release(self, keys: Dict[str, Any], error: Optional[BaseException] = None) -> None:
+        # Resolve the claimed keys for waiting threads: with the vectors, or with the request's error
+        with self._lock:
+            futures = [(key, self._inflight.pop(key)) for key in keys if key in self._inflight]
+        for key, future in futures:
+            if error is None:
+                future.set_result(keys[key])
+            else:
+                future.set_exception(error)
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a single query through the cache.
+        """
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await run_in_executor(None, self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await run_in_executor(None, self.embed_query, text)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Return hit/miss counters and hit rate.
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class GatewayEmbeddings(Embeddings):
+    """
+    OpenAI embeddings requested through the shared gateway, so they share its rate limits.
+
+    Texts longer than the model's context are embedded in pieces and the piece vectors
+    averaged by token count and renormalized, as OpenAIEmbeddings does.
+    """
+
+    def __init__(self, model: str = "text-embedding-ada-002", embedding_ctx_length: int = EMBEDDING_CTX_LENGTH):
+        self.model = model
+        self.embedding_ctx_length = embedding_ctx_length
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        pieces = [split_tokens(text, self.embedding_ctx_length) for text in texts]
+        if all(len(text_pieces) == 1 for text_pieces in pieces):
+            return get_gateway().embed(self.model, texts)
+
+        import numpy as np
+
+        vectors = get_gateway().embed(self.model, [piece for text_pieces in pieces for piece in text_pieces])
+        combined, start = [], 0
+        for text_pieces in pieces:
+            if len(text_pieces) == 1:
+                combined.append(vectors[start])
+            else:
+                weights = [estimate_tokens(piece) for piece in text_pieces]
+                average = np.average(vectors[start:start + len(text_pieces)], axis=0, weights=weights)
+                combined.append((average / max(np.linalg.norm(average), 1e-12)).tolist())
+            start += len(text_pieces)
+        return combined
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def build_embedding_model(config: Dict[str, str], model: str = "text-embedding-ada-002", path: Optional[str] = None) -> CachedEmbeddings:
+    """
+    Create the OpenAI embedding model shared by both vector stores, wrapped in the embedding cache.
+
+    :param config: Loaded configuration, optionally with EMBEDDING_CACHE_PATH.
+    :param model: OpenAI embedding model name.
+    :param path: Persistent store path, overriding EMBEDDING_CACHE_PATH.
+    :return: The cached embedding model.
+    """
+    return CachedEmbeddings(GatewayEmbeddings(model), model, path or config.get("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite"))
@@ -1,105 +1,126 @@
-from langchain.chains.query_constructor.base import AttributeInfo
-from langchain.retrievers.self_query.base import SelfQueryRetriever
-from langchain_openai import OpenAI
-from langchain.schema import Document
-from config import load_config
-from typing import List
-from langchain_core.documents import Document
-from langchain_postgres.vectorstores import PGVector
+from __future__ import annotations
+
+import asyncio
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+from Settings import get_config
+from OpenAI_Client import gateway_chat_model, INTERACTIVE
 from Analysis import execute_query_on_metadata
+from Tracing import span
+from Retrieval_Cache import fingerprint, get_retrieval_cache
 
-config = load_config()
+if TYPE_CHECKING:
+    from langchain.chains.query_constructor.base import AttributeInfo
+    from langchain.retrievers.self_query.base import SelfQueryRetriever
+    from langchain_core.documents import Document
+    from langchain_community.vectorstores.pgvector import PGVector
 
-def retrieve_serial_numbers(queries: List[str], vectorstore_metadata) -> List[str]:
+
+# Calls the self-query vector search returns at most; the SQL path has no cap
+SELF_QUERY_K = 1000
+
+# Model constructing the structured query of a metadata query
+SELF_QUERY_MODEL = "gpt-3.5-turbo-0125"
+
+
+@lru_cache(maxsize=None)
+def get_metadata_field_info() -> List[AttributeInfo]:
     """
-    Retrieve unique serial numbers from documents matching the given queries.
+    Describe the metadata fields the SelfQueryRetriever may filter on.
+    """
+    from langchain.chains.query_constructor.base import AttributeInfo
+
+    # Define metadata fields
+    return [
+        AttributeInfo(
+            name="Rolewise Transcript",
+            description="The transcript of the call including the roles of the speakers.",
+            type="string",
+        ),
+        AttributeInfo(
+            name="Call Length",
+            description="The duration of the call in seconds.",
+            type="float",
+        ),
+        AttributeInfo(
+            name="Lead Id",
+            description="Unique identifier for the lead.",
+            type="string",
+        ),
+        AttributeInfo(
+            name="Call DateTime",
+            description="The date and time when the call took place.",
+            type="datetime",
+        ),
+        AttributeInfo(
+            name="Language of the call",
+            description="The language in which the call was conducted. Valid Values are ['Hindi', 'Marathi']",
+            type="string",
+        ),
+        AttributeInfo(
+            name="Purpose",
+            description="The purpose of the call. Valid Values are ['Construction', 'Other Loans - Home Equity', 'Other Loans - MSME', 'Purchase', 'Purchase and Construction', 'Repair and Renovation Loan', 'Resale Property Purchase']",
+            type="string",
+        ),
+        AttributeInfo(
+            name="Product offered",
+            description="The product that was offered during the call. Valid Values are ['Construction', 'Other Loans - Home Equity', 'Other Loans - MSME', 'Purchase', 'Purchase and Construction', 'Repair and Renovation Loan', 'Resale Property Purchase']",
+            type="string",
+        ),
+        AttributeInfo(
+            name="Lead Source",
+            description="The source from which the lead/call was generated. Valid Values are ['Aavas Plus', 'BTLCanopy', 'BTLConstruction Visit', 'BTLMissed call', 'Chatbot', 'CustAppCrif', 'CustAppNew Lead', 'CustAppTop Up', 'Google Ads', 'MCVAN Activity', 'PhonePe', 'Reference', 'Self Sourced', 'Toll Free', 'Web_CRIF', 'Web_Sampark', 'Website', 'Whatsapp']",
+            type="string",
+        ),
+        AttributeInfo(
+            name="Location",
+            description="The location of the customer. Valid Values are listed locations.['Gurgaon']",
+            type="string",
+        ),
+        AttributeInfo(
+            name="Branch",
+            description="The branch associated with the lead. Valid Values are listed branches.",
+            type="string",
+        ),
+        AttributeInfo(
+            name="Opportunity Created",
+            description="Indicates whether an opportunity was created from the call. Valid Values are [True]",
+            type="boolean",
+        ),
+        AttributeInfo(
+            name="Business Created",
+            description="Indicates whether a business was created from the call. Valid Values are [True]",
+            type="boolean",
+        ),
+        AttributeInfo(
+            name="Agent Name",
+            description="The name of the agent who handled the call. Valid Values are listed agent names.",
+            type="string",
+        ),
+        AttributeInfo(
+            name="Agent ID",
+            description="Unique identifier for the agent.",
+            type="integer",
+        ),
+        AttributeInfo(
+            name="id",
+            description="Unique identifier for the record.",
+            type="integer",
+        ),
+    ]
+
+
+def build_self_query_retriever(vectorstore_metadata) -> SelfQueryRetriever:
+    """
+    Build the SelfQueryRetriever used for metadata filtering.
 
-    :param queries: List of queries to retrieve documents for.
-    :param openai_api_key: API key for OpenAI.
     :param vectorstore_metadata: Metadata vector store used in SelfQueryRetriever.
-    :return: List of unique serial numbers.
+    :return: The configured retriever.
     """
-    # Define metadata fields
-    metadata_field_info = [
-    AttributeInfo(
-        name="Rolewise Transcript",
-        description="The transcript of the call including the roles of the speakers.",
-        type="string",
-    ),
-    AttributeInfo(
-        name="Call Length",
-        description="The duration of the call in seconds.",
-        type="float",
-    ),
-    AttributeInfo(
-        name="Lead Id",
-        description="Unique identifier for the lead.",
-        type="string",
-    ),
-    AttributeInfo(
-        name="Call DateTime",
-        description="The date and time when the call took place.",
-        type="datetime",
-    ),
-    AttributeInfo(
-        name="Language of the call",
-        description="The language in which the call was conducted. Valid Values are ['Hindi', 'Marathi']",
-        type="string",
-    ),
-    AttributeInfo(
-        name="Purpose",
-        description="The purpose of the call. Valid Values are ['Construction', 'Other Loans - Home Equity', 'Other Loans - MSME', 'Purchase', 'Purchase and Construction', 'Repair and Renovation Loan', 'Resale Property Purchase']",
-        type="string",
-    ),
-    AttributeInfo(
-        name="Product offered",
-        description="The product that was offered during the call. Valid Values are ['Construction', 'Other Loans - Home Equity', 'Other Loans - MSME', 'Purchase', 'Purchase and Construction', 'Repair and Renovation Loan', 'Resale Property Purchase']",
-        type="string",
-    ),
-    AttributeInfo(
-        name="Lead Source",
-        description="The source from which the lead/call was generated. Valid Values are ['Aavas Plus', 'BTLCanopy', 'BTLConstruction Visit', 'BTLMissed call', 'Chatbot', 'CustAppCrif', 'CustAppNew Lead', 'CustAppTop Up', 'Google Ads', 'MCVAN Activity', 'PhonePe', 'Reference', 'Self Sourced', 'Toll Free', 'Web_CRIF', 'Web_Sampark', 'Website', 'Whatsapp']",
-        type="string",
-    ),
-    AttributeInfo(
-        name="Location",
-        description="The location of the customer. Valid Values are listed locations.['Gurgaon']",
-        type="string",
-    ),
-    AttributeInfo(
-        name="Branch",
-        description="The branch associated with the lead. Valid Values are listed branches.",
-        type="string",
-    ),
-    AttributeInfo(
-        name="Opportunity Created",
-        description="Indicates whether an opportunity was created from the call. Valid Values are [True]",
-        type="boolean",
-    ),
-    AttributeInfo(
-        name="Business Created",
-        description="Indicates whether a business was created from the call. Valid Values are [True]",
-        type="boolean",
-    ),
-    AttributeInfo(
-        name="Agent Name",
-        description="The name of the agent who handled the call. Valid Values are listed agent names.",
-        type="string",
-    ),
-    AttributeInfo(
-        name="Agent ID",
-        description="Unique identifier for the agent.",
-        type="integer",
-    ),
-    AttributeInfo(
-        name="id",
-        description="Unique identifier for the record.",
-        type="integer",
-    ),
-]
+    from langchain.retrievers.self_query.base import SelfQueryRetriever
 
-    # Initialize language model
-    llm = OpenAI(openai_api_key=config["OPENAI_API_KEY"], temperature=0)
+    # Initialize language model, sending every request through the shared gateway
+    llm = gateway_chat_model(SELF_QUERY_MODEL, INTERACTIVE, temperature=0)
 
     # Set up document content description for SelfQueryRetriever
     document_content_description = "Call Transcript of a telesales call."
@@ -109,88 +130,476 @@ def retrieve_serial_numbers(queries: List[str], vectorstore_metadata) -> List[st
         llm=llm,
         vectorstore=vectorstore_metadata,
         document_contents=None,
-        metadata_field_info=metadata_field_info,
+        metadata_field_info=get_metadata_field_info(),
+        # Stores without a built-in LangChain translator can provide their own
+        structured_query_translator=getattr(vectorstore_metadata, "structured_query_translator", None),
         enable_limit=True,
-        verbose=True,
-        search_kwargs={"k": 1000}
+        search_kwargs={"k": SELF_QUERY_K}
     )
 
-    # Set to collect unique documents
-    all_retrieved_documents = set()
+    return retriever
+
+def self_query_documents(retriever: SelfQueryRetriever, query: str, structured_query: Any) -> List[Document]:
+    """
+    Run the retriever's filtered vector search for a structured query it already constructed,
+    so falling back from SQL doesn't ask the LLM for the same query again.
+
+    :param retriever: Retriever from build_self_query_retriever.
+    :param query: The metadata query the structured query was constructed from.
+    :param structured_query: Output of the retriever's query constructor.
+    :return: Matching documents, as retriever.get_relevant_documents would return them.
+    """
+    new_query, new_kwargs = retriever.structured_query_translator.visit_structured_query(structured_query)
+    if structured_query.limit is not None:
+        new_kwargs["k"] = structured_query.limit
+    if retriever.use_original_query:
+        new_query = query
+    search_kwargs = {**retriever.search_kwargs, **new_kwargs}
+    with span("self_query", "retrieval", collection=getattr(retriever.vectorstore, "collection_name", None)) as current:
+        documents = retriever.vectorstore.search(new_query, retriever.search_type, **search_kwargs)
+        current.set(rows=len(documents), truncated=is_truncated(structured_query, documents, search_kwargs.get("k")))
+    return documents
+
+
+def is_truncated(structured_query: Any, documents: List[Document], k: Optional[int]) -> bool:
+    """
+    Whether a self-query search stopped at its k cap rather than at the last matching call.
+    A limit the query asked for ("the 10 longest calls") is not a truncation.
+    """
+    return structured_query.limit is None and k is not None and len(documents) >= k
+
+
+def self_query_summary(query: str, structured_query: Any, documents: List[Document]) -> str:
+    """
+    Summarize the metadata of a self-query search, saying so when the k cap cut the matches short.
+    """
+    summary = execute_query_on_metadata(query, documents)
+    if is_truncated(structured_query, documents, SELF_QUERY_K):
+        summary += f"\n\nOnly the {SELF_QUERY_K} closest calls were retrieved; more calls may match this filter."
+    return summary
+
+
+def sql_filterable(connection_string: Optional[str], structured_query: Any) -> bool:
+    """
+    Whether a structured query can run as SQL on the typed metadata table: it has a filter,
+    every field it filters on is a column, and the table exists and has been refreshed.
+    """
+    from Metadata_Table import SQLTranslator, metadata_table_ready
+
+    if not connection_string or structured_query.filter is None:
+        return False
+    try:
+        SQLTranslator().visit_structured_query(structured_query)
+    except ValueError:
+        return False
+    return metadata_table_ready(connection_string)
+
+
+def retrieve_serial_numbers(queries: List[str], vectorstore_metadata) -> List[str]:
+    """
+    Retrieve unique serial numbers from documents matching the given queries.
+
+    :param queries: List of queries to retrieve documents for.
+    :param openai_api_key: API key for OpenAI.
+    :param vectorstore_metadata: Metadata vector store used in SelfQueryRetriever.
+    :return: List of unique serial numbers.
+    """
+    retriever = build_self_query_retriever(vectorstore_metadata)
+    cache = get_retrieval_cache()
+    collection = getattr(vectorstore_metadata, "collection_name", None)
+
+    # Collect unique serial numbers, deduplicated on the serial number alone
+    serial_numbers = {}
     summary_overall={}
 
     # Retrieve and combine unique documents for each query
     for query in queries:
-        documents = retriever.get_relevant_documents(query)
-        for doc in documents:
-            all_retrieved_documents.add((doc.page_content, tuple(doc.metadata.items())))
-        summary = execute_query_on_metadata(query, documents)
-        summary_overall[query] = summary
+        key, cached = cache.get("self_query", query, [collection], {"k": SELF_QUERY_K})
+        if cached is None:
+            # Query construction (an LLM call) and the filtered vector search
+            structured_query = retriever.query_constructor.invoke({"query": query})
+            documents = self_query_documents(retriever, query, structured_query)
+            cached = {
+                "serial_numbers": list(dict.fromkeys(doc.metadata["Serial Number"] for doc in documents if "Serial Number" in doc.metadata)),
+                "summary": self_query_summary(query, structured_query, documents),
+            }
+            cache.set(key, cached)
+        serial_numbers.update(dict.fromkeys(cached["serial_numbers"]))
+        summary_overall[query] = cached["summary"]
+
+    # Return 'Serial Number' values in first-seen order
+    return list(serial_numbers), summary_overall
+
+def retrieve_serial_numbers_sql(queries: List[str], vectorstore_metadata, connection_string: str) -> List[str]:
+    """
+    Retrieve unique serial numbers by compiling the self-query filter straight to SQL on the typed metadata table.
 
-    # Convert to list of Document objects
-    unique_documents = [Document(page_content=content, metadata=dict(metadata)) for content, metadata in all_retrieved_documents]
+    Queries whose structured query has no filter or filters on a field the table doesn't
+    hold, and every query while the table is missing or not yet refreshed, fall back to
+    the self-query vector search of the same structured query.
 
-    # Extract and return 'Serial Number' values from metadata
-    serial_numbers = [doc.metadata.get("Serial Number") for doc in unique_documents if "Serial Number" in doc.metadata]
-    return serial_numbers, summary_overall
+    :param queries: List of queries to retrieve documents for.
+    :param vectorstore_metadata: Metadata vector store used in SelfQueryRetriever.
+    :param connection_string: PGVector connection string.
+    :return: List of unique serial numbers and the metadata summary per query.
+    """
+    from Metadata_Table import TABLE_NAME, summarize_structured_query
 
-from typing import List
-from langchain_community.vectorstores.pgvector import PGVector
+    retriever = build_self_query_retriever(vectorstore_metadata)
+    cache = get_retrieval_cache()
+    collection = getattr(vectorstore_metadata, "collection_name", None)
 
-from typing import List, Dict
+    def retrieve(query: str) -> Dict[str, Any]:
+        structured_query = retriever.query_constructor.invoke({"query": query})
+        if sql_filterable(connection_string, structured_query):
+            # Serial numbers are streamed page by page; the summary is aggregated in Postgres
+            query_serials = [serial for serial, _ in iter_serial_numbers(
+                [query], vectorstore_metadata, connection_string, columns=[], structured_queries=[structured_query]
+            )]
+            return {"serial_numbers": query_serials, "summary": summarize_structured_query(connection_string, structured_query, query)}
 
-async def search_serial_numbers(
+        documents = self_query_documents(retriever, query, structured_query)
+        return {
+            "serial_numbers": list(dict.fromkeys(doc.metadata["Serial Number"] for doc in documents if "Serial Number" in doc.metadata)),
+            "summary": self_query_summary(query, structured_query, documents),
+        }
+
+    serial_numbers = {}
+    summary_overall = {}
+    for query in queries:
+        # The typed table is refreshed after ingestion and has its own watermark
+        result = cache.get_or_compute("metadata_sql", query, [collection, TABLE_NAME], {}, lambda query=query: retrieve(query))
+        serial_numbers.update(dict.fromkeys(result["serial_numbers"]))
+        summary_overall[query] = result["summary"]
+
+    return list(serial_numbers), summary_overall
+
+def iter_serial_numbers(
+    queries: List[str],
+    vectorstore_metadata,
+    connection_string: str,
+    page_size: int = 5000,
+    columns: Optional[List[str]] = None,
+    structured_queries: Optional[List[Any]] = None,
+) -> Iterator[Tuple[str, dict]]:
+    """
+    Stream the calls matching the given queries as (serial number, metadata) pairs, without transcripts.
+
+    Filters are compiled to SQL on the typed metadata table and paged through with a
+    keyset cursor, so there is no k cap and memory stays flat apart from the set of
+    serial numbers already yielded. Queries without a usable filter, and every query while
+    the table isn't ready, fall back to the self-query search (capped at SELF_QUERY_K)
+    with the transcript dropped from the metadata.
+
+    :param queries: List of queries to retrieve calls for.
+    :param vectorstore_metadata: Metadata vector store used in SelfQueryRetriever.
+    :param connection_string: PGVector connection string.
+    :param page_size: Rows fetched per database round trip.
+    :param columns: Metadata fields to include on the SQL path; every typed column by default.
+    :param structured_queries: The queries' structured queries if already constructed, so
+                               the query-constructor LLM isn't called again.
+    :return: Iterator of (serial number, metadata) pairs, each serial number yielded once.
+    """
+    from Metadata_Table import COLUMNS, iter_structured_query
+
+    retriever = build_self_query_retriever(vectorstore_metadata)
+    metadata_columns = [field for field in COLUMNS if field != "Serial Number"] if columns is None else columns
+    seen = set()
+
+    for i, query in enumerate(queries):
+        structured_query = structured_queries[i] if structured_queries else retriever.query_constructor.invoke({"query": query})
+        if sql_filterable(connection_string, structured_query):
+            for row in iter_structured_query(connection_string, structured_query, metadata_columns, page_size):
+                if row["Serial Number"] not in seen:
+                    seen.add(row["Serial Number"])
+                    yield row["Serial Number"], row
+            continue
+
+        for doc in self_query_documents(retriever, query, structured_query):
+            serial_number = doc.metadata.get("Serial Number")
+            if serial_number is not None and serial_number not in seen:
+                seen.add(serial_number)
+                yield serial_number, {key: value for key, value in doc.metadata.items() if key != "Rolewise Transcript"}
+
+# MMR settings of the two searches per transcript query: calls (or chunks) near the query
+# within the shortlist, then the chunks of the calls found
+CALL_SEARCH = {"k": 4, "fetch_k": 20, "lambda_mult": 0.25}
+CHUNK_SEARCH = {"k": 70, "fetch_k": 20, "lambda_mult": 0.5}
+
+# Both searches as one statement. Candidates for the first MMR come with the nearest chunks of
+# every candidate call, so the second MMR can run on whichever calls the first one keeps.
+# The candidate search is written in the form the collection's ANN index can serve (see Vector_Index.nearest_sql).
+TRANSCRIPT_SEARCH_SQL = """
+    WITH query AS (
+        SELECT CAST(:vector AS vector) AS embedding
+    ),
+    candidates AS (
+        {candidates}
+    ),
+    chunks AS (
+        SELECT e.document, e.cmetadata, e.embedding, e.embedding <=> q.embedding AS distance,
+               e.cmetadata->>'Serial Number' AS serial_number,
+               row_number() OVER (PARTITION BY e.cmetadata->>'Serial Number' ORDER BY e.embedding <=> q.embedding) AS call_rank
+        FROM langchain_pg_embedding e
+        JOIN langchain_pg_collection c ON e.collection_id = c.uuid
+        CROSS JOIN query q
+        WHERE c.name = :chunk_collection
+          AND e.cmetadata->>'Serial Number' IN (SELECT serial_number FROM candidates)
+    )
+    SELECT 'call' AS kind, serial_number, NULL AS document, NULL AS cmetadata, embedding::text AS embedding, distance
+    FROM candidates
+    UNION ALL
+    SELECT 'chunk', serial_number, document, cmetadata, embedding::text, distance
+    FROM chunks
+    WHERE call_rank <= :chunk_fetch_k
+"""
+
+
+# Shortlisted rows of both collections, for exact in-process scoring
+SHORTLIST_ROWS_SQL = """
+    SELECT CASE WHEN e.collection_id = :call_collection_id THEN 'call' ELSE 'chunk' END AS kind,
+           e.cmetadata->>'Serial Number' AS serial_number, e.document, e.cmetadata, e.embedding::text AS embedding
+    FROM langchain_pg_embedding e
+    WHERE e.collection_id IN (:call_collection_id, :chunk_collection_id)
+      AND e.cmetadata->>'Serial Number' = ANY(:serial_numbers)
+"""
+
+# Shortlists of up to this many calls are scored exactly in-process, overridable with EXACT_SEARCH_MAX_SHORTLIST
+EXACT_SEARCH_MAX_SHORTLIST = 50
+
+
+def plan_transcript_search(serial_numbers: Optional[List[str]], max_exact: Optional[int] = None) -> str:
+    """
+    Choose how to search under a shortlist: "exact" fetches just the shortlisted calls' rows
+    and scores them in NumPy, "ann" uses the collection's ANN index with the shortlist as a
+    post-filter. A small shortlist filters out most ANN candidates, so the ANN path would come
+    back incomplete; a large one is cheaper to search through the index.
+
+    :param serial_numbers: The shortlist, if any.
+    :param max_exact: Largest shortlist searched exactly; EXACT_SEARCH_MAX_SHORTLIST by default.
+    :return: "exact" or "ann".
+    """
+    if max_exact is None:
+        max_exact = int(get_config().get("EXACT_SEARCH_MAX_SHORTLIST", EXACT_SEARCH_MAX_SHORTLIST))
+    return "exact" if serial_numbers and len(set(serial_numbers)) <= max_exact else "ann"
+
+
+def _cosine_distances(query_array: Any, matrix: Any) -> Any:
+    import numpy as np
+
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_array)
+    return 1 - (matrix @ query_array) / np.maximum(norms, 1e-12)
+
+
+def search_transcripts_sql(connection_string: str, call_collection: str, chunk_collection: str, query_vector: List[float], serial_numbers: Optional[List[str]] = None, ef_search: Optional[int] = None, probes: Optional[int] = None, plan: Optional[str] = None) -> List[Document]:
+    """
+    Find the transcript chunks for one query in a single database round trip.
+
+    Equivalent to the two MMR searches of search_serial_documents: calls near the query in
+    call_collection (restricted to the shortlist, if any), then the chunks of the calls found
+    in chunk_collection. Both candidate sets come back from one statement and the MMR
+    re-ranking runs here. The statement depends on the plan (see plan_transcript_search),
+    which is recorded on the search's span.
+
+    :param connection_string: PGVector connection string.
+    :param call_collection: Collection searched first for serial numbers.
+    :param chunk_collection: Collection the returned chunks come from.
+    :param query_vector: Embedding of the query.
+    :param serial_numbers: Optional shortlist restricting the first search.
+    :param ef_search: HNSW ef_search for the first search; VECTOR_EF_SEARCH by default.
+    :param probes: IVFFlat probes for the first search; VECTOR_PROBES by default.
+    :param plan: Force "exact" or "ann" instead of planning from the shortlist size. The ANN plan
+                 searches the VECTOR_QUANTIZATION index, if set, rescoring with full vectors.
+    :return: Retrieved chunks in MMR order.
+    """
+    import numpy as np
+    from sqlalchemy import text
+    from langchain_core.documents import Document
+    from langchain_community.vectorstores.utils import maximal_marginal_relevance
+    from Vector_Index import DEFAULT_EF_SEARCH, DEFAULT_PROBES, collection_info, nearest_sql, search_session
+
+    config = get_config()
+    plan = plan or plan_transcript_search(serial_numbers)
+    params: Dict[str, Any] = {"vector": "[" + ",".join(map(str, query_vector)) + "]"}
+    if serial_numbers:
+        params["serial_numbers"] = list(serial_numbers)
+
+    # A missing or empty collection raises ValueError, which the caller sees rather than an empty result
+    if plan == "exact":
+        params["call_collection_id"] = collection_info(connection_string, call_collection)[0]
+        params["chunk_collection_id"] = collection_info(connection_string, chunk_collection)[0]
+        statement = text(SHORTLIST_ROWS_SQL)
+        session = search_session(connection_string)
+    else:
+        shortlist = "AND e.cmetadata->>'Serial Number' = ANY(:serial_numbers)" if serial_numbers else ""
+        candidates = nearest_sql(
+            connection_string, call_collection, "e.cmetadata->>'Serial Number' AS serial_number, e.embedding",
+            shortlist, ":call_fetch_k", config.get("VECTOR_QUANTIZATION") or None,
+        )
+        params.update({"chunk_collection": chunk_collection, "call_fetch_k": CALL_SEARCH["fetch_k"], "chunk_fetch_k": CHUNK_SEARCH["fetch_k"]})
+        statement = text(TRANSCRIPT_SEARCH_SQL.format(candidates=candidates))
+        session = search_session(
+            connection_string,
+            ef_search=ef_search or config.get("VECTOR_EF_SEARCH", DEFAULT_EF_SEARCH),
+            probes=probes or config.get("VECTOR_PROBES", DEFAULT_PROBES),
+        )
+
+    with span("pgvector.transcript_search", "db", collection=chunk_collection, plan=plan, filter_size=len(serial_numbers or [])) as current, session as conn:
+        rows = conn.execute(statement, params).fetchall()
+        current.set(rows=len(rows))
+
+    def vectors(selected: list) -> np.ndarray:
+        if not selected:
+            return np.empty((0, len(query_vector)), dtype=np.float32)
+        return np.array([row.embedding[1:-1].split(",") for row in selected], dtype=np.float32)
+
+    query_array = np.asarray(query_vector, dtype=np.float32)
+    calls = [row for row in rows if row.kind == "call"]
+    chunks = [row for row in rows if row.kind == "chunk"]
+    if not calls or not chunks:
+        return []
+    call_vectors, chunk_vectors = vectors(calls), vectors(chunks)
+    if plan == "exact":
+        # Keep the nearest shortlisted rows, as the ANN statement's LIMIT does
+        nearest = np.argsort(_cosine_distances(query_array, call_vectors), kind="stable")[:CALL_SEARCH["fetch_k"]]
+        calls, call_vectors = [calls[i] for i in nearest], call_vectors[nearest]
+        chunk_distances = _cosine_distances(query_array, chunk_vectors)
+    else:
+        chunk_distances = np.array([row.distance for row in chunks])
+
+    kept = maximal_marginal_relevance(query_array, call_vectors, k=CALL_SEARCH["k"], lambda_mult=CALL_SEARCH["lambda_mult"])
+    serials = {calls[i].serial_number for i in kept}
+
+    candidates = [i for i in np.argsort(chunk_distances, kind="stable") if chunks[i].serial_number in serials][:CHUNK_SEARCH["fetch_k"]]
+    if not candidates:
+        return []
+    order = maximal_marginal_relevance(query_array, chunk_vectors[candidates], k=CHUNK_SEARCH["k"], lambda_mult=CHUNK_SEARCH["lambda_mult"])
+    return [Document(page_content=chunks[candidates[i]].document, metadata=chunks[candidates[i]].cmetadata) for i in order]
+
+
+async def search_serial_documents(
     vectorstore: PGVector,
     vectorstore2: PGVector,
     queries: List[str],
-    serial_numbers: List[str]
-) -> Dict[str, str]:
+    serial_numbers: List[str],
+    connection_string: Optional[str] = None,
+) -> Dict[str, List[Document]]:
     """
     Perform an asynchronous maximal marginal relevance (MMR) search on each query,
-    filtering results by serial numbers and returning unique serial numbers and
-    transcripts for each query.
+    filtering results by serial numbers and returning the retrieved transcript
+    chunks for each query.
+
+    Queries run concurrently, and the serial numbers found by one query only scope
+    that query's second search.
 
     :param vectorstore: The PGVector vector store instance.
     :param vectorstore2: The second PGVector vector store instance for content retrieval.
     :param queries: List of queries for the MMR search.
     :param serial_numbers: List of serial numbers to filter results.
-    :return: Dictionary of query strings as keys and concatenated page content as values.
+    :param connection_string: When given, each query is one SQL statement over both
+                              collections (see search_transcripts_sql) instead of two searches.
+    :return: Dictionary of query strings as keys and retrieved chunks as values.
     """
-    unique_serial_numbers = set()  # Set to collect unique serial numbers
-    transcripts = {}  # Dictionary to store concatenated page content for each query
+    from langchain_core.documents import Document
 
-    # Iterate over each query in the list
-    for query in queries:
-        # Define search arguments, including MMR strategy and optional filtering by serial numbers
-        search_kwargs = {
-            "search_type": "mmr",
-            "lambda_mult": 0.25,  # Adjust diversity if needed
+    cache = get_retrieval_cache()
+    collections = [getattr(vectorstore, "collection_name", None), getattr(vectorstore2, "collection_name", None)]
+    params = _search_cache_params(serial_numbers, connection_string)
+    # Cache lookups may read the watermark from Postgres, so they stay off the event loop
+    lookups = await asyncio.to_thread(lambda: {query: cache.get("transcripts", query, collections, params) for query in queries})
+    documents = {
+        query: [Document(page_content=item["page_content"], metadata=item["metadata"]) for item in cached]
+        for query, (_, cached) in lookups.items() if cached is not None
+    }
+    missing = [query for query in lookups if query not in documents]
+    if not missing:
+        return {query: documents[query] for query in queries}
+
+    if connection_string:
+        # One embedding request for every query, then one round trip per query
+        vectors = await asyncio.to_thread(vectorstore.embeddings.embed_documents, missing)
+        results = await asyncio.gather(*(
+            asyncio.to_thread(
+                search_transcripts_sql, connection_string, vectorstore.collection_name, vectorstore2.collection_name, vector, serial_numbers
+            )
+            for vector in vectors
+        ))
+    else:
+        results = await asyncio.gather(*(_search_mmr(vectorstore, vectorstore2, query, serial_numbers) for query in missing))
+
+    def store() -> None:
+        for query, found in zip(missing, results):
+            cache.set(lookups[query][0], [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in found])
+
+    await asyncio.to_thread(store)
+    documents.update(zip(missing, results))
+    return {query: documents[query] for query in queries}
+
+
+def _search_cache_params(serial_numbers: List[str], connection_string: Optional[str]) -> Dict[str, Any]:
+    # Everything besides the query that decides which chunks a transcript search returns
+    params: Dict[str, Any] = {"call_search": CALL_SEARCH, "chunk_search": CHUNK_SEARCH, "shortlist": fingerprint(serial_numbers or [])}
+    if connection_string:
+        config = get_config()
+        params["sql"] = {
+            key: config.get(key)
+            for key in ("VECTOR_EF_SEARCH", "VECTOR_PROBES", "VECTOR_QUANTIZATION", "EXACT_SEARCH_MAX_SHORTLIST")
         }
+    return params
+
+
+async def _search_mmr(vectorstore: PGVector, vectorstore2: PGVector, query: str, serial_numbers: List[str]) -> List[Document]:
+    # Define search arguments, including MMR strategy and optional filtering by serial numbers
+    search_kwargs: Dict[str, Any] = {
+        "search_type": "mmr",
+        "lambda_mult": CALL_SEARCH["lambda_mult"],  # Adjust diversity if needed
+    }
 
-        # Apply filter by serial numbers if provided
-        if serial_numbers:
-            search_kwargs["filter"] = {"Serial Number": {"$in": serial_numbers}}
+    # Apply filter by serial numbers if provided
+    if serial_numbers:
+        search_kwargs["filter"] = {"Serial Number": {"$in": serial_numbers}}
 
-        # Perform MMR search for the current query on vectorstore
+    # Perform MMR search for the current query on vectorstore
+    with span("pgvector.mmr", "db", collection=getattr(vectorstore, "collection_name", None), filter_size=len(serial_numbers)) as current:
         results = await vectorstore.asearch(query, **search_kwargs)
+        current.set(rows=len(results))
 
-        # Collect unique serial numbers from metadata
-        for result in results:
-            serial_number = result.metadata.get("Serial Number")
-            if serial_number:
-                unique_serial_numbers.add(serial_number)
-
-        # Perform a second search on vectorstore2 based on unique serial numbers collected
-        filter_kwargs = {
-            "search_type": "mmr",
-            "filter": {"Serial Number": {"$in": list(unique_serial_numbers)}},
-            "k": 70  # Retrieve up to 70 results
-        }
-        vectorstore2_results = await vectorstore2.asearch(query, **filter_kwargs)
+    # Collect the unique serial numbers this query found
+    unique_serial_numbers = list(dict.fromkeys(
+        result.metadata["Serial Number"] for result in results if result.metadata.get("Serial Number")
+    ))
 
-        # Concatenate page content for each unique serial number under the current query
-        page_content = " ".join([res.page_content for res in vectorstore2_results])
-        transcripts[query] = page_content
+    # Perform a second search on vectorstore2 scoped to those serial numbers
+    filter_kwargs = {
+        "search_type": "mmr",
+        "filter": {"Serial Number": {"$in": unique_serial_numbers}},
+        "k": CHUNK_SEARCH["k"]  # Retrieve up to 70 results
+    }
+    with span("pgvector.mmr", "db", collection=getattr(vectorstore2, "collection_name", None), filter_size=len(unique_serial_numbers)) as current:
+        documents = await vectorstore2.asearch(query, **filter_kwargs)
+        current.set(rows=len(documents))
+    return documents
 
-    return transcripts
+async def search_serial_numbers(
+    vectorstore: PGVector,
+    vectorstore2: PGVector,
+    queries: List[str],
+    serial_numbers: List[str],
+    connection_string: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    Perform an asynchronous maximal marginal relevance (MMR) search on each query,
+    filtering results by serial numbers and returning unique serial numbers and
+    transcripts for each query.
+
+    :param vectorstore: The PGVector vector store instance.
+    :param vectorstore2: The second PGVector vector store instance for content retrieval.
+    :param queries: List of queries for the MMR search.
+    :param serial_numbers: List of serial numbers to filter results.
+    :param connection_string: Optional PGVector connection string for the single-statement search.
+    :return: Dictionary of query strings as keys and concatenated page content as values.
+    """
+    documents = await search_serial_documents(vectorstore, vectorstore2, queries, serial_numbers, connection_string)
 
+    # Concatenate page content for each unique serial number under each query
+    return {query: " ".join([res.page_content for res in results]) for query, results in documents.items()}
@@ -0,0 +1,96 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+# Packages that must only be imported when a request actually needs them
+DEFERRED_PACKAGES = [
+    "openai",
+    "httpx",
+    "tiktoken",
+    "langchain",
+    "langchain_openai",
+    "langchain_community",
+    "langchain_postgres",
+    "pandas",
+    "numpy",
+    "sqlalchemy",
+    "config",
+]
+
+# Environment variables a cold import must not depend on
+CREDENTIALS = ["OPENAI_API_KEY", "PGVECTOR_CONNECTION_STRING"]
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _run(module: str, *flags: str) -> Tuple[float, str, str]:
+    # Fresh interpreter per run, so every import is cold
+    env = {key: value for key, value in os.environ.items() if key not in CREDENTIALS}
+    code = f"import json, sys; import {module}; print(json.dumps(sorted(sys.modules)))"
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, *flags, "-c", code], cwd=PROJECT_DIR, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    return elapsed, result.stdout, result.stderr
+
+
+def _slowest_imports(importtime_log: str, top: int) -> List[Tuple[str, int]]:
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    cumulative: Dict[str, int] = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, _, package = line.rsplit("|", 2)
+        cumulative[package.strip()] = int(line.split("|")[1])
+    return sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def benchmark_import(module: str = "main", runs: int = 5, top: int = 15) -> Dict[str, object]:
+    """
+    Time cold imports of a module in fresh interpreters, without credentials in the environment.
+
+    :param module: The module to import, e.g. "main" or "Pipeline".
+    :param runs: Number of fresh interpreters to time.
+    :param top: Number of slowest imports (by cumulative time) to report.
+    :return: Median and max wall time, deferred packages that were imported anyway, and the slowest imports.
+    """
+    baseline = statistics.median(_run("sys")[0] for _ in range(runs))
+    timings = [_run(module)[0] - baseline for _ in range(runs)]
+    _, modules, importtime_log = _run(module, "-X", "importtime")
+    loaded = set(json.loads(modules))
+    return {
+        "module": module,
+        "median_seconds": round(statistics.median(timings), 3),
+        "max_seconds": round(max(timings), 3),
+        "eager_imports": [package for package in DEFERRED_PACKAGES if package in loaded],
+        "slowest_imports_us": _slowest_imports(importtime_log, top),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fail if a cold import of the pipeline exceeds the time budget or eagerly loads clients")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--budget", type=float, default=1.0, help="Maximum median cold import time in seconds")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    report = benchmark_import(args.module, args.runs, args.top)
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if report["median_seconds"] > args.budget:
+        failures.append(f"median cold import {report['median_seconds']}s exceeds budget {args.budget}s")
+    if report["eager_imports"]:
+        failures.append(f"imported at module load: {', '.join(report['eager_imports'])}")
+    if failures:
+        print("FAIL: " + "; ".join(failures), file=sys.stderr)
+        sys.exit(1)
+    print(f"OK: import {args.module} within {args.budget}s")
@@ -0,0 +1,329 @@
+import csv
+import hashlib
+import io
+import json
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from sqlalchemy import text
+from Settings import get_config
+from OpenAI_Client import estimate_tokens, truncate_tokens
+from Retrieve import get_engine
+from Tracing import in_current_context, span
+from Retrieval_Cache import bump_watermark, create_watermark_table, watermarks_changed
+
+# Tokens per chunk of the detailed collection; turns are kept whole unless one alone is longer
+CHUNK_TOKENS = 300
+
+# Longest text the embedding model accepts
+MAX_EMBEDDING_TOKENS = 8000
+
+# Metadata field -> type for CSV values, which arrive as strings
+FIELD_TYPES = {
+    "Call Length": float,
+    "Agent ID": int,
+    "Opportunity Created": bool,
+    "Business Created": bool,
+}
+
+EMBEDDING_COLUMNS = ["id", "collection_id", "embedding", "document", "cmetadata"]
+
+
+def _coerce(field: str, value: Any) -> Any:
+    kind = FIELD_TYPES.get(field)
+    if kind is None or not isinstance(value, str):
+        return value
+    if value.strip() == "":
+        return None
+    if kind is bool:
+        return value.strip().lower() in ("true", "1", "yes")
+    if kind is int:
+        return int(float(value))
+    return kind(value)
+
+
+def read_records(path: str, file_format: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Stream call records from a CSV or JSON lines file, one dictionary per call.
+
+    :param path: The file; "-" is not supported since the format comes from the extension.
+    :param file_format: "csv" or "jsonl"; by default taken from the file extension.
+    :return: Iterator of records with CSV values converted to the stored types.
+    """
+    file_format = file_format or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, newline="" if file_format == "csv" else None, encoding="utf-8") as f:
+        if file_format == "csv":
+            for row in csv.DictReader(f):
+                yield {field: _coerce(field, value) for field, value in row.items()}
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def content_hash(record: Dict[str, Any]) -> str:
+    """
+    Hash everything stored for a call, so a re-run can tell unchanged calls from changed ones.
+    """
+    payload = json.dumps(record, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def chunk_transcript(transcript: str, max_tokens: int = CHUNK_TOKENS) -> List[str]:
+    """
+    Split a role-wise transcript into chunks of whole turns (lines) of up to max_tokens.
+    A single turn longer than that is split on its own.
+    """
+    chunks, current, current_tokens = [], [], 0
+    for turn in (line for line in transcript.split("\n") if line.strip()):
+        tokens = estimate_tokens(turn)
+        while tokens > max_tokens:
+            # A token cut can end mid-character; keep the head an exact prefix of the turn
+            head = truncate_tokens(turn, max_tokens).rstrip("\ufffd")
+            if current:
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            chunks.append(head)
+            turn = turn[len(head):].lstrip()
+            tokens = estimate_tokens(turn)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        if turn:
+            current.append(turn)
+            current_tokens += tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def batched(records: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ensure_collection(connection_string: str, collection_name: str) -> str:
+    """
+    Create the PGVector tables and the collection if needed, returning the collection id.
+    """
+    with get_engine(connection_string).begin() as conn:
+        row = conn.execute(text("SELECT uuid::text FROM langchain_pg_collection WHERE name = :name"), {"name": collection_name}).one_or_none()
+    if row is not None:
+        return row[0]
+
+    # Let LangChain create its schema the way the search side expects it
+    from langchain_community.vectorstores.pgvector import PGVector
+    from Embeddings import GatewayEmbeddings
+
+    PGVector(embedding_function=GatewayEmbeddings(), connection_string=connection_string, collection_name=collection_name)
+    with get_engine(connection_string).begin() as conn:
+        return conn.execute(text("SELECT uuid::text FROM langchain_pg_collection WHERE name = :name"), {"name": collection_name}).one()[0]
+
+
+def _copy_field(value: Optional[str]) -> str:
+    # COPY text format: tab-separated, backslash escapes, \N for NULL
+    if value is None:
+        return "\\N"
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def write_rows(conn: Any, rows: List[Tuple[str, str, str, str, str]]) -> None:
+    """
+    Write embedding rows with COPY when the driver supports it, else with multi-row inserts.
+
+    :param conn: SQLAlchemy connection inside the batch's transaction.
+    :param rows: (id, collection_id, embedding literal, document, JSON metadata) tuples.
+    """
+    if not rows:
+        return
+    cursor = conn.connection.cursor()
+    if hasattr(cursor, "copy_expert"):
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write("\t".join(_copy_field(value) for value in row) + "\n")
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY langchain_pg_embedding ({', '.join(EMBEDDING_COLUMNS)}) FROM STDIN", buffer)
+        return
+    # SQLAlchemy batches executemany into multi-row VALUES statements
+    conn.execute(
+        text("INSERT INTO langchain_pg_embedding (id, collection_id, embedding, document, cmetadata) "
+             "VALUES (:id, CAST(:collection_id AS uuid), :embedding, :document, :cmetadata)"),
+        [dict(zip(EMBEDDING_COLUMNS, row)) for row in rows],
+    )
+
+
+class Ingestor:
+    """
+    Loads call records into the call-level and chunk-level collections in batches.
+
+    A call is skipped when a row with the same serial number and content hash already
+    exists; a changed call has its old rows replaced. Each batch is one transaction, which
+    also refreshes the batch's rows of the typed metadata table.
+    """
+
+    def __init__(self, connection_string: str, call_collection: str = "call_embeddings", chunk_collection: str = "call_embeddings_detailed", model: str = "text-embedding-ada-002", chunk_tokens: int = CHUNK_TOKENS):
+        from Embeddings import GatewayEmbeddings
+        from Metadata_Table import create_metadata_table
+
+        self.connection_string = connection_string
+        self.call_collection = call_collection
+        self.chunk_collection = chunk_collection
+        self.call_collection_id = ensure_collection(connection_string, call_collection)
+        self.chunk_collection_id = ensure_collection(connection_string, chunk_collection)
+        create_watermark_table(connection_string)
+        create_metadata_table(connection_string)
+        self.chunk_tokens = chunk_tokens
+        # Straight to the gateway: caching every ingested vector locally would only cost disk
+        self.embeddings = GatewayEmbeddings(model)
+
+    def _stored_hashes(self, conn: Any, serial_numbers: List[str]) -> Dict[str, str]:
+        rows = conn.execute(text("""
+            SELECT cmetadata->>'Serial Number', cmetadata->>'Content Hash'
+            FROM langchain_pg_embedding
+            WHERE collection_id = CAST(:collection_id AS uuid) AND cmetadata->>'Serial Number' = ANY(:serial_numbers)
+        """), {"collection_id": self.call_collection_id, "serial_numbers": serial_numbers})
+        return {serial: stored for serial, stored in rows}
+
+    def ingest_batch(self, records: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Ingest one batch of records: skip unchanged calls, embed the rest in one pass, replace their rows.
+
+        :return: Counts of new, changed, unchanged and invalid calls and of chunks written.
+        """
+        from Metadata_Table import upsert_metadata_rows
+
+        counts = {"new": 0, "changed": 0, "unchanged": 0, "invalid": 0, "chunks": 0}
+        # The last record for a serial number within a batch wins
+        calls: Dict[str, Tuple[Dict[str, Any], str]] = {}
+        for record in records:
+            serial_number = record.get("Serial Number")
+            if serial_number in (None, "") or not str(record.get("Rolewise Transcript") or "").strip():
+                counts["invalid"] += 1
+                continue
+            record = {**record, "Serial Number": str(serial_number)}
+            calls[record["Serial Number"]] = (record, content_hash(record))
+
+        with span("ingest.batch", "stage", calls=len(calls)) as current:
+            with get_engine(self.connection_string).connect() as conn:
+                stored = self._stored_hashes(conn, list(calls))
+            pending = {serial: call for serial, call in calls.items() if stored.get(serial) != call[1]}
+            counts["unchanged"] = len(calls) - len(pending)
+            counts["changed"] = sum(1 for serial in pending if serial in stored)
+            counts["new"] = len(pending) - counts["changed"]
+            if not pending:
+                return counts
+
+            # One embedding pass for every call transcript and chunk in the batch
+            texts, rows = [], []
+            for serial, (record, digest) in pending.items():
+                transcript = record["Rolewise Transcript"]
+                texts.append(truncate_tokens(transcript, MAX_EMBEDDING_TOKENS))
+                rows.append((self.call_collection_id, transcript, {**record, "Content Hash": digest}))
+                for index, chunk in enumerate(chunk_transcript(transcript, self.chunk_tokens)):
+                    texts.append(chunk)
+                    rows.append((self.chunk_collection_id, chunk, {"Serial Number": serial, "Chunk": index, "Content Hash": digest}))
+            vectors = self.embeddings.embed_documents(texts)
+            counts["chunks"] = sum(1 for collection_id, _, _ in rows if collection_id == self.chunk_collection_id)
+
+            embedding_rows = [
+                (str(uuid.uuid4()), collection_id, "[" + ",".join(map(str, vector)) + "]", document, json.dumps(metadata, ensure_ascii=False, default=str))
+                for (collection_id, document, metadata), vector in zip(rows, vectors)
+            ]
+            with get_engine(self.connection_string).begin() as conn:
+                # Changed calls lose their old call and chunk rows in the same transaction
+                changed = [serial for serial in pending if serial in stored]
+                if changed:
+                    conn.execute(text("""
+                        DELETE FROM langchain_pg_embedding
+                        WHERE collection_id IN (CAST(:call_collection_id AS uuid), CAST(:chunk_collection_id AS uuid))
+                          AND cmetadata->>'Serial Number' = ANY(:serial_numbers)
+                    """), {"call_collection_id": self.call_collection_id, "chunk_collection_id": self.chunk_collection_id, "serial_numbers": changed})
+                write_rows(conn, embedding_rows)
+                # The typed metadata table never disagrees with the committed calls
+                upsert_metadata_rows(conn, self.call_collection, list(pending))
+                # Cached retrieval results for these collections stop matching once this commits
+                bump_watermark(conn, [self.call_collection, self.chunk_collection])
+            watermarks_changed()
+            current.set(rows=len(embedding_rows), **{key: value for key, value in counts.items() if key != "chunks"})
+        return counts
+
+    def ingest(self, records: Iterable[Dict[str, Any]], batch_size: int = 200, concurrency: int = 4, progress_every: float = 10.0) -> Dict[str, Any]:
+        """
+        Ingest a stream of records with up to `concurrency` batches embedding or writing at once.
+
+        A batch holding a serial number that an earlier batch still in flight also holds waits
+        for that batch, so a call is never inserted twice and its last record in the stream wins.
+
+        :param records: Call records, e.g. from read_records.
+        :param batch_size: Calls per batch (one hash lookup, one embedding pass, one transaction).
+        :param concurrency: Batches in flight; the gateway still enforces the embedding rate limits.
+        :param progress_every: Seconds between progress lines; 0 disables them.
+        :return: Totals and throughput in calls per second.
+        """
+        totals = {"new": 0, "changed": 0, "unchanged": 0, "invalid": 0, "chunks": 0}
+        start = last_report = time.perf_counter()
+        in_flight: Set[Future] = set()
+        # Serial numbers of the batches in flight
+        in_flight_serials: Dict[Future, Set[str]] = {}
+
+        def collect(done: Iterable[Future]) -> None:
+            for future in done:
+                in_flight_serials.pop(future, None)
+                for key, value in future.result().items():
+                    totals[key] += value
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for batch in batched(records, batch_size):
+                serials = {str(record.get("Serial Number")) for record in batch if record.get("Serial Number") not in (None, "")}
+                conflicting = {future for future, held in in_flight_serials.items() if held & serials}
+                if conflicting:
+                    collect(wait(conflicting).done)
+                    in_flight -= conflicting
+                # Bounded read-ahead keeps memory flat on large inputs
+                if len(in_flight) >= concurrency:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                future = executor.submit(in_current_context(self.ingest_batch), batch)
+                in_flight.add(future)
+                in_flight_serials[future] = serials
+                if progress_every and time.perf_counter() - last_report >= progress_every:
+                    last_report = time.perf_counter()
+                    print(json.dumps(_throughput(totals, last_report - start)), flush=True)
+            collect(wait(in_flight).done)
+
+        return _throughput(totals, time.perf_counter() - start)
+
+
+def _throughput(totals: Dict[str, int], elapsed: float) -> Dict[str, Any]:
+    processed = sum(totals[key] for key in ("new", "changed", "unchanged", "invalid"))
+    return {
+        **totals,
+        "elapsed_seconds": round(elapsed, 2),
+        "calls_per_second": round(processed / elapsed, 1) if elapsed else 0.0,
+        "embedded_calls_per_second": round((totals["new"] + totals["changed"]) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load call transcripts and metadata into the PGVector collections, skipping unchanged calls")
+    parser.add_argument("paths", nargs="+", help="CSV or JSON lines files with one call per row")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Input format; by default from each file's extension")
+    parser.add_argument("--call-collection", default="call_embeddings")
+    parser.add_argument("--chunk-collection", default="call_embeddings_detailed")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS)
+    args = parser.parse_args()
+
+    ingestor = Ingestor(get_config()["PGVECTOR_CONNECTION_STRING"], args.call_collection, args.chunk_collection, chunk_tokens=args.chunk_tokens)
+    records = (record for path in args.paths for record in read_records(path, args.format))
+    print(json.dumps(ingestor.ingest(records, args.batch_size, args.concurrency), indent=2))
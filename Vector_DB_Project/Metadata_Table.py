@@ -0,0 +1,332 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from langchain_core.structured_query import Comparator, Comparison, Operation, Operator, StructuredQuery, Visitor
+from sqlalchemy import text
+import pandas as pd
+from Retrieve import get_engine
+from Analysis import PERCENTILES, aggregation_plan, format_metadata_summary
+from Tracing import span
+from Retrieval_Cache import bump_watermark, create_watermark_table, watermarks_changed
+
+# Metadata field -> (column, SQL type) of the typed side table
+COLUMNS = {
+    "Serial Number": ("serial_number", "text"),
+    "Call Length": ("call_length", "double precision"),
+    "Lead Id": ("lead_id", "text"),
+    "Call DateTime": ("call_datetime", "timestamp"),
+    "Language of the call": ("language", "text"),
+    "Purpose": ("purpose", "text"),
+    "Product offered": ("product_offered", "text"),
+    "Lead Source": ("lead_source", "text"),
+    "Location": ("location", "text"),
+    "Branch": ("branch", "text"),
+    "Opportunity Created": ("opportunity_created", "boolean"),
+    "Business Created": ("business_created", "boolean"),
+    "Agent Name": ("agent_name", "text"),
+    "Agent ID": ("agent_id", "bigint"),
+}
+
+# Columns that get a B-tree index
+INDEXED_COLUMNS = ["call_length", "call_datetime", "language", "lead_source", "branch", "agent_name", "agent_id"]
+
+TABLE_NAME = "call_metadata"
+
+
+def _cast(field: str, sql_type: str) -> str:
+    value = f"NULLIF(e.cmetadata->>'{field}', '')"
+    # Integer ids are sometimes stored as floats ("123.0")
+    if sql_type == "bigint":
+        return f"{value}::numeric::bigint"
+    return f"{value}::{sql_type}"
+
+
+def create_metadata_table(connection_string: str) -> None:
+    """
+    Create the typed metadata table and its B-tree indexes if they don't exist.
+
+    :param connection_string: PGVector connection string.
+    """
+    columns = ",\n".join(
+        f"{column} {sql_type}{' PRIMARY KEY' if column == 'serial_number' else ''}"
+        for column, sql_type in COLUMNS.values()
+    )
+    with get_engine(connection_string).begin() as conn:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {TABLE_NAME} ({columns})"))
+        for column in INDEXED_COLUMNS:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {TABLE_NAME}_{column}_idx ON {TABLE_NAME} ({column})"))
+
+
+# Connection strings whose metadata table is known to be populated; anything else is checked again next time
+_ready_tables = set()
+
+
+def metadata_table_ready(connection_string: str) -> bool:
+    """
+    Whether the typed metadata table exists and has been refreshed at least once, so filters
+    compiled against it can be trusted. Once it is, the answer is remembered for the process.
+
+    :param connection_string: PGVector connection string.
+    :return: False while the table is missing or empty.
+    """
+    if connection_string in _ready_tables:
+        return True
+    with span("sql.metadata_table_ready", "db", table=TABLE_NAME) as current, get_engine(connection_string).connect() as conn:
+        ready = bool(conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": TABLE_NAME}).scalar())
+        if ready:
+            ready = bool(conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {TABLE_NAME})")).scalar())
+        current.set(ready=ready)
+    if ready:
+        _ready_tables.add(connection_string)
+    return ready
+
+
+def _upsert_sql(restrict: str = "") -> Any:
+    # Materialize the collection's JSON metadata into the typed table, upserting on serial number
+    columns = [column for column, _ in COLUMNS.values()]
+    selects = ", ".join(_cast(field, sql_type) for field, (_, sql_type) in COLUMNS.items())
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns if column != "serial_number")
+    return text(f"""
+        INSERT INTO {TABLE_NAME} ({", ".join(columns)})
+        SELECT DISTINCT ON (e.cmetadata->>'Serial Number') {selects}
+        FROM langchain_pg_embedding e
+        JOIN langchain_pg_collection c ON e.collection_id = c.uuid
+        WHERE c.name = :collection_name AND e.cmetadata->>'Serial Number' IS NOT NULL {restrict}
+        ON CONFLICT (serial_number) DO UPDATE SET {updates}
+    """)
+
+
+def refresh_metadata_table(connection_string: str, collection_name: str = "call_embeddings") -> int:
+    """
+    Materialize the JSON metadata of a collection into the typed table, upserting on serial number.
+
+    :param connection_string: PGVector connection string.
+    :param collection_name: Collection holding one document per call.
+    :return: Number of rows written.
+    """
+    create_metadata_table(connection_string)
+    create_watermark_table(connection_string)
+    with get_engine(connection_string).begin() as conn:
+        result = conn.execute(_upsert_sql(), {"collection_name": collection_name})
+        # Metadata filters cached against the old table contents no longer match
+        bump_watermark(conn, [TABLE_NAME])
+    watermarks_changed()
+    return result.rowcount
+
+
+def upsert_metadata_rows(conn: Any, collection_name: str, serial_numbers: List[str]) -> int:
+    """
+    Refresh the typed rows of just these calls, inside the caller's write transaction, so the
+    table changes together with the collection. The table must already exist.
+
+    :param conn: SQLAlchemy connection of the transaction that wrote the calls.
+    :param collection_name: Collection holding one document per call.
+    :param serial_numbers: Calls whose metadata was written.
+    :return: Number of rows written.
+    """
+    result = conn.execute(
+        _upsert_sql("AND e.cmetadata->>'Serial Number' = ANY(:serial_numbers)"),
+        {"collection_name": collection_name, "serial_numbers": serial_numbers},
+    )
+    bump_watermark(conn, [TABLE_NAME])
+    return result.rowcount
+
+
+class SQLTranslator(Visitor):
+    """
+    Compile the self-query LLM's structured query into a WHERE clause on the typed metadata table.
+
+    Visiting returns (sql, params); parameter names are unique within one translator.
+    """
+
+    allowed_comparators = [
+        Comparator.EQ, Comparator.NE, Comparator.GT, Comparator.GTE, Comparator.LT,
+        Comparator.LTE, Comparator.IN, Comparator.NIN, Comparator.LIKE, Comparator.CONTAIN,
+    ]
+    allowed_operators = [Operator.AND, Operator.OR, Operator.NOT]
+
+    _sql_comparators = {
+        Comparator.EQ: "=", Comparator.NE: "<>", Comparator.GT: ">",
+        Comparator.GTE: ">=", Comparator.LT: "<", Comparator.LTE: "<=",
+    }
+
+    def __init__(self):
+        self._counter = 0
+
+    def _param(self, params: Dict[str, Any], value: Any) -> str:
+        name = f"p{self._counter}"
+        self._counter += 1
+        params[name] = value
+        return f":{name}"
+
+    def visit_operation(self, operation: Operation) -> Tuple[str, Dict[str, Any]]:
+        self._validate_func(operation.operator)
+        params: Dict[str, Any] = {}
+        parts = []
+        for argument in operation.arguments:
+            sql, argument_params = argument.accept(self)
+            params.update(argument_params)
+            parts.append(f"({sql})")
+        if operation.operator == Operator.NOT:
+            return f"NOT ({' AND '.join(parts)})", params
+        return f" {operation.operator.value.upper()} ".join(parts), params
+
+    def visit_comparison(self, comparison: Comparison) -> Tuple[str, Dict[str, Any]]:
+        self._validate_func(comparison.comparator)
+        if comparison.attribute not in COLUMNS:
+            raise ValueError(f"Attribute '{comparison.attribute}' is not in the typed metadata table")
+        column = COLUMNS[comparison.attribute][0]
+        value = comparison.value
+        # Date values arrive as {"date": "YYYY-MM-DD", "type": "date"}
+        if isinstance(value, dict) and value.get("type") == "date":
+            value = value["date"]
+
+        params: Dict[str, Any] = {}
+        if comparison.comparator in (Comparator.IN, Comparator.NIN):
+            values = value if isinstance(value, list) else [value]
+            placeholder = self._param(params, values)
+            negate = "NOT " if comparison.comparator == Comparator.NIN else ""
+            return f"{negate}({column} = ANY({placeholder}))", params
+        if comparison.comparator in (Comparator.LIKE, Comparator.CONTAIN):
+            placeholder = self._param(params, f"%{value}%")
+            return f"{column}::text ILIKE {placeholder}", params
+        placeholder = self._param(params, value)
+        return f"{column} {self._sql_comparators[comparison.comparator]} {placeholder}", params
+
+    def visit_structured_query(self, structured_query: StructuredQuery) -> Tuple[str, Dict[str, Any]]:
+        if structured_query.filter is None:
+            return "TRUE", {}
+        return structured_query.filter.accept(self)
+
+
+def compile_structured_query(structured_query: StructuredQuery, columns: Optional[List[str]] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Compile a structured query into an indexed SELECT on the typed metadata table.
+
+    :param structured_query: Output of the self-query retriever's query constructor.
+    :param columns: Metadata fields to project; only "Serial Number" by default.
+    :return: Tuple of (SQL, bind parameters).
+    """
+    columns = columns or ["Serial Number"]
+    projection = ", ".join(f'{COLUMNS[field][0]} AS "{field}"' for field in columns)
+    where, params = SQLTranslator().visit_structured_query(structured_query)
+    sql = f"SELECT {projection} FROM {TABLE_NAME} WHERE {where}"
+    if structured_query.limit:
+        sql += f" LIMIT {int(structured_query.limit)}"
+    return sql, params
+
+
+def run_structured_query(connection_string: str, structured_query: StructuredQuery, columns: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Run a compiled structured query and return the projected rows as dictionaries keyed by metadata field.
+    """
+    sql, params = compile_structured_query(structured_query, columns)
+    with span("sql.metadata_filter", "db", table=TABLE_NAME) as current, get_engine(connection_string).connect() as conn:
+        rows = [dict(row._mapping) for row in conn.execute(text(sql), params)]
+        current.set(rows=len(rows))
+    return rows
+
+
+def iter_structured_query(connection_string: str, structured_query: StructuredQuery, columns: Optional[List[str]] = None, page_size: int = 5000) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the rows matching a structured query page by page with a keyset cursor on serial number.
+
+    Each page is a separate indexed query resuming after the last serial number seen,
+    so memory stays bounded by page_size however many calls match. Serial number is
+    the table's primary key, so rows are unique.
+
+    :param connection_string: PGVector connection string.
+    :param structured_query: Output of the self-query retriever's query constructor.
+    :param columns: Metadata fields to project; "Serial Number" is always included.
+    :param page_size: Rows fetched per round trip.
+    :return: Iterator of rows keyed by metadata field.
+    """
+    columns = list(dict.fromkeys(["Serial Number"] + (columns or [])))
+    projection = ", ".join(f'{COLUMNS[field][0]} AS "{field}"' for field in columns)
+    where, params = SQLTranslator().visit_structured_query(structured_query)
+    remaining = int(structured_query.limit) if structured_query.limit else None
+    sql = text(f"""
+        SELECT {projection} FROM {TABLE_NAME}
+        WHERE ({where}) AND (CAST(:after AS text) IS NULL OR serial_number > :after)
+        ORDER BY serial_number
+        LIMIT :page_size
+    """)
+
+    after = None
+    engine = get_engine(connection_string)
+    while remaining is None or remaining > 0:
+        limit = page_size if remaining is None else min(page_size, remaining)
+        with span("sql.metadata_page", "db", table=TABLE_NAME) as current, engine.connect() as conn:
+            rows = conn.execute(sql, {**params, "after": after, "page_size": limit}).fetchall()
+            current.set(rows=len(rows))
+        for row in rows:
+            yield dict(row._mapping)
+        if len(rows) < limit:
+            return
+        after = rows[-1]._mapping["Serial Number"]
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+def summarize_structured_query(connection_string: str, structured_query: StructuredQuery, query: str) -> str:
+    """
+    Push the metadata summary down to Postgres: totals, percentiles, group-bys and time buckets
+    are computed by aggregate queries over the rows matching the filter, so no rows are transferred.
+
+    :param connection_string: PGVector connection string.
+    :param structured_query: Output of the self-query retriever's query constructor.
+    :param query: The metadata query, used to choose the aggregations.
+    :return: The metadata summary in the same format as Analysis.execute_query_on_metadata.
+    """
+    plan = aggregation_plan(query)
+    where, params = SQLTranslator().visit_structured_query(structured_query)
+    percentiles = ", ".join(
+        f'percentile_cont({percentile}) WITHIN GROUP (ORDER BY call_length) AS "P{int(percentile * 100)} Call Length"'
+        for percentile in PERCENTILES
+    )
+    statements = {
+        "Overall": f"""
+            SELECT count(*) AS "Calls", avg(call_length) AS "Mean Call Length",
+                   min(call_length) AS "Min Call Length", max(call_length) AS "Max Call Length",
+                   count(*) FILTER (WHERE opportunity_created) AS "Opportunities Created",
+                   count(*) FILTER (WHERE business_created) AS "Businesses Created",
+                   min(call_datetime) AS "First Call", max(call_datetime) AS "Last Call", {percentiles}
+            FROM {TABLE_NAME} WHERE {where}
+        """,
+    }
+    for field in plan["group_by"]:
+        column = COLUMNS[field][0]
+        statements[f"By {field}"] = f"""
+            SELECT {column} AS "{field}", count(*) AS "Calls", avg(call_length) AS "Mean_Call_Length",
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY call_length) AS "Median_Call_Length",
+                   count(*) FILTER (WHERE opportunity_created) AS "Opportunities_Created"
+            FROM {TABLE_NAME} WHERE {where}
+            GROUP BY {column} ORDER BY "Calls" DESC
+        """
+    if plan["time_bucket"]:
+        statements[f"By {plan['time_bucket']}"] = f"""
+            SELECT date_trunc('{plan['time_bucket']}', call_datetime) AS "Call DateTime",
+                   count(*) AS "Calls", avg(call_length) AS "Mean_Call_Length"
+            FROM {TABLE_NAME} WHERE ({where}) AND call_datetime IS NOT NULL
+            GROUP BY 1 ORDER BY 1
+        """
+
+    sections = {}
+    with get_engine(connection_string).connect() as conn:
+        for title, statement in statements.items():
+            with span("sql.metadata_summary", "db", table=TABLE_NAME, section=title) as current:
+                result = conn.execute(text(statement), params)
+                table = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+                current.set(rows=len(table))
+            sections[title] = table if title == "Overall" else table.set_index(table.columns[0])
+    return format_metadata_summary(query, sections)
+
+
+if __name__ == "__main__":
+    import argparse
+    from Settings import get_config
+
+    parser = argparse.ArgumentParser(description="Create or refresh the typed call metadata table")
+    parser.add_argument("--collection", default="call_embeddings")
+    args = parser.parse_args()
+
+    config = get_config()
+    print(f"Rows written: {refresh_metadata_table(config['PGVECTOR_CONNECTION_STRING'], args.collection)}")
@@ -0,0 +1,451 @@
+import asyncio
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Coroutine, Dict, List, Optional, Tuple
+from Settings import get_config
+from Tracing import record_usage, span, start_span
+from Budget import charge
+
+if TYPE_CHECKING:
+    import httpx
+    from openai import AsyncOpenAI
+    from langchain_core.language_models import BaseChatModel
+
+# Priority classes; lower values are scheduled first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Default (requests per minute, tokens per minute) per model, overridable with OPENAI_RATE_LIMITS
+DEFAULT_RATE_LIMITS = {
+    "gpt-4o": (500, 30000),
+    "gpt-4o-mini": (500, 200000),
+    "gpt-3.5-turbo-0125": (3500, 200000),
+    "gpt-3.5-turbo-instruct": (3500, 90000),
+    "text-embedding-ada-002": (3000, 1000000),
+}
+FALLBACK_RATE_LIMIT = (500, 30000)
+
+@lru_cache(maxsize=None)
+def retryable_errors() -> Tuple[type, ...]:
+    """
+    Errors worth retrying with backoff; the openai package is imported on first use.
+    """
+    import openai
+
+    return (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+
+# Set by set_encoding to count tokens without tiktoken's cl100k files
+_stand_in_encoding: Optional[Any] = None
+
+
+@lru_cache(maxsize=None)
+def _cl100k():
+    import tiktoken
+
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def _encoding():
+    return _stand_in_encoding if _stand_in_encoding is not None else _cl100k()
+
+
+def set_encoding(encoding: Optional[Any]) -> None:
+    """
+    Count and cut tokens with the given encoding instead of cl100k, which tiktoken downloads
+    on first use; anything with encode(text, disallowed_special=()) and decode(tokens) will do.
+    None restores cl100k.
+    """
+    global _stand_in_encoding
+    _stand_in_encoding = encoding
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the token count of a prompt with the cl100k tokenizer.
+    """
+    return len(_encoding().encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut a text to at most max_tokens cl100k tokens.
+    """
+    tokens = _encoding().encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else _encoding().decode(tokens[:max_tokens])
+
+
+def split_tokens(text: str, max_tokens: int) -> List[str]:
+    """
+    Cut a text into consecutive pieces of at most max_tokens cl100k tokens.
+    """
+    tokens = _encoding().encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return [text]
+    return [_encoding().decode(tokens[start:start + max_tokens]) for start in range(0, len(tokens), max_tokens)]
+
+
+def openai_messages(messages: List[Any]) -> List[Dict[str, str]]:
+    """
+    Convert LangChain message objects to OpenAI chat messages.
+    """
+    roles = {"human": "user", "ai": "assistant", "system": "system"}
+    return [{"role": roles.get(message.type, message.type), "content": message.content} for message in messages]
+
+
+class TokenBucket:
+    """
+    Continuously refilling bucket holding up to one minute's allowance.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until amount is available; requests above capacity wait for a full bucket.
+        """
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        """
+        Remove amount from the bucket; a negative amount refunds an overestimate.
+        """
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+
+class ModelScheduler:
+    """
+    Admits requests for one model when both its RPM and TPM buckets allow, highest priority first.
+
+    Only used from the gateway's event loop.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._waiters: List[Tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, tokens: int, priority: int = BACKGROUND) -> None:
+        """
+        Wait until this request is at the head of the queue and both buckets have room.
+
+        :param tokens: Estimated tokens of the request (prompt plus completion).
+        :param priority: INTERACTIVE or BACKGROUND.
+        """
+        entry = (priority, next(self._sequence))
+        async with self._condition:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    timeout = None
+                    if self._waiters[0] == entry:
+                        timeout = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                        if timeout <= 0:
+                            break
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                heapq.heappop(self._waiters)
+                self.requests.take(1)
+                self.tokens.take(tokens)
+            except BaseException:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                raise
+            finally:
+                # The head of the queue may have changed
+                self._condition.notify_all()
+
+    def reconcile(self, estimated: int, actual: int) -> None:
+        """
+        Correct the token bucket once the actual usage of a request is known.
+        """
+        self.tokens.take(actual - estimated)
+
+
+class OpenAIGateway:
+    """
+    Shared OpenAI access for every module: one pooled async client on a dedicated event
+    loop, per-model RPM/TPM scheduling with priority classes, and jittered exponential
+    backoff. Sync callers block on the result; async callers from any loop await it.
+    """
+
+    def __init__(self, api_key: str, rate_limits: Optional[Dict[str, Tuple[float, float]]] = None, max_connections: int = 64, max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 60.0, async_transport: Optional["httpx.AsyncBaseTransport"] = None):
+        """
+        :param api_key: OpenAI API key.
+        :param rate_limits: (requests per minute, tokens per minute) per model.
+        :param max_connections: Size of the HTTP connection pools.
+        :param max_retries: Retries after a rate limit, timeout, connection or server error.
+        :param base_delay: First backoff delay in seconds, doubled on every retry.
+        :param max_delay: Upper bound on a single backoff delay.
+        :param async_transport: Optional httpx transport for the client, e.g. a stand-in OpenAI.
+        """
+        self.api_key = api_key
+        self.rate_limits = {**DEFAULT_RATE_LIMITS, **(rate_limits or {})}
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.async_transport = async_transport
+        self._schedulers: Dict[str, ModelScheduler] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional["AsyncOpenAI"] = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                import httpx
+                from openai import AsyncOpenAI
+
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="openai-gateway", daemon=True).start()
+                self._client = AsyncOpenAI(
+                    api_key=self.api_key,
+                    max_retries=0,  # retries are handled here, after rescheduling
+                    http_client=httpx.AsyncClient(
+                        limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                        transport=self.async_transport,
+                    ),
+                )
+                self._loop = loop
+            return self._loop
+
+    def _submit(self, coroutine: Coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop())
+
+    def _scheduler(self, model: str) -> ModelScheduler:
+        if model not in self._schedulers:
+            self._schedulers[model] = ModelScheduler(*self.rate_limits.get(model, FALLBACK_RATE_LIMIT))
+        return self._schedulers[model]
+
+    async def _call(self, model: str, estimated_tokens: int, priority: int, request: Any) -> Any:
+        # Runs on the gateway loop: schedule, send, back off and reschedule on retryable errors
+        scheduler = self._scheduler(model)
+        retryable = retryable_errors()
+        for attempt in range(self.max_retries + 1):
+            await scheduler.acquire(estimated_tokens, priority)
+            try:
+                response = await request()
+            except retryable as error:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+                response_headers = getattr(getattr(error, "response", None), "headers", None) or {}
+                try:
+                    delay = max(delay, float(response_headers.get("retry-after", 0)))
+                except ValueError:
+                    pass
+                await asyncio.sleep(delay)
+                continue
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                scheduler.reconcile(estimated_tokens, usage.total_tokens)
+            return response
+
+    def _chat_request(self, model: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> Tuple[int, Any]:
+        estimated = estimate_tokens(json.dumps(messages)) + int(params.get("max_tokens") or 500)
+        return estimated, lambda: self._client.chat.completions.create(model=model, messages=messages, **params)
+
+    def chat_completion(self, model: str, messages: List[Dict[str, str]], priority: int = BACKGROUND, **params: Any) -> Any:
+        """
+        Create a chat completion through the scheduler, blocking until it returns.
+
+        :param model: The model name.
+        :param messages: OpenAI chat messages.
+        :param priority: INTERACTIVE or BACKGROUND.
+        :param params: Any other chat completion parameters.
+        :return: The ChatCompletion response.
+        """
+        self._ensure_loop()
+        estimated, request = self._chat_request(model, messages, params)
+        with span("openai.chat", "llm", model=model, priority=priority, estimated_tokens=estimated) as current:
+            response = self._submit(self._call(model, estimated, priority, request)).result()
+            record_usage(current, response.usage)
+            charge(model, response.usage)
+        return response
+
+    async def achat_completion(self, model: str, messages: List[Dict[str, str]], priority: int = BACKGROUND, **params: Any) -> Any:
+        """
+        Async variant of chat_completion, usable from any event loop.
+        """
+        self._ensure_loop()
+        estimated, request = self._chat_request(model, messages, params)
+        with span("openai.chat", "llm", model=model, priority=priority, estimated_tokens=estimated) as current:
+            response = await asyncio.wrap_future(self._submit(self._call(model, estimated, priority, request)))
+            record_usage(current, response.usage)
+            charge(model, response.usage)
+        return response
+
+    async def _stream(self, model: str, messages: List[Dict[str, str]], priority: int, params: Dict[str, Any], put: Callable[[Tuple[str, Any]], None]) -> None:
+        # Runs on the gateway loop and hands ("token" | "done" | "error", value) items to the consumer;
+        # the "done" value is the usage, if the API reported it
+        estimated, _ = self._chat_request(model, messages, params)
+
+        def request() -> Any:
+            return self._client.chat.completions.create(
+                model=model, messages=messages, stream=True, stream_options={"include_usage": True}, **params
+            )
+
+        try:
+            stream = await self._call(model, estimated, priority, request)
+            usage = None
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    put(("token", chunk.choices[0].delta.content))
+            if usage is not None:
+                self._scheduler(model).reconcile(estimated, usage.total_tokens)
+            put(("done", usage))
+        except BaseException as error:
+            put(("error", error))
+            raise
+
+    async def astream_chat_completion(self, model: str, messages: List[Dict[str, str]], priority: int = BACKGROUND, **params: Any) -> AsyncIterator[str]:
+        """
+        Stream a chat completion's content tokens as they arrive, usable from any event loop.
+
+        :param model: The model name.
+        :param messages: OpenAI chat messages.
+        :param priority: INTERACTIVE or BACKGROUND.
+        :param params: Any other chat completion parameters.
+        :return: Async iterator of content deltas.
+        """
+        self._ensure_loop()
+        caller_loop = asyncio.get_running_loop()
+        items: asyncio.Queue = asyncio.Queue()
+        # Not made current: the span stays open across yields to the consumer
+        current = start_span("openai.chat", "llm", model=model, priority=priority, stream=True)
+        future = self._submit(self._stream(model, messages, priority, params, lambda item: caller_loop.call_soon_threadsafe(items.put_nowait, item)))
+        try:
+            while True:
+                kind, value = await items.get()
+                if kind == "token":
+                    yield value
+                elif kind == "error":
+                    current.finish(value)
+                    raise value
+                else:
+                    record_usage(current, value)
+                    charge(model, value)
+                    return
+        finally:
+            # Stop generating if the consumer goes away early
+            future.cancel()
+            current.finish()
+
+    def embed(self, model: str, texts: List[str], priority: int = BACKGROUND) -> List[List[float]]:
+        """
+        Embed texts through the scheduler, in one request per 1000 inputs.
+        """
+        self._ensure_loop()
+        vectors = []
+        for start in range(0, len(texts), 1000):
+            batch = texts[start:start + 1000]
+            estimated = sum(estimate_tokens(text) for text in batch)
+            request = lambda batch=batch: self._client.embeddings.create(model=model, input=batch)
+            with span("openai.embeddings", "embedding", model=model, texts=len(batch)) as current:
+                response = self._submit(self._call(model, estimated, priority, request)).result()
+                record_usage(current, response.usage)
+                charge(model, response.usage)
+            vectors.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        return vectors
+
+
+@lru_cache(maxsize=None)
+def _gateway_chat_class() -> type:
+    # Defined on first use so langchain_openai is only imported by callers that need it
+    from langchain_openai import ChatOpenAI
+
+    class GatewayChatOpenAI(ChatOpenAI):
+        """
+        ChatOpenAI that sends its requests through the shared gateway instead of its own
+        client, so LangChain chains get the gateway's scheduling, backoff, usage
+        reconciliation and budget charging. Tool binding and structured output work as
+        in ChatOpenAI, which builds the request payload.
+        """
+
+        priority: int = BACKGROUND
+
+        def _gateway_payload(self, messages: List[Any], stop: Optional[List[str]], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+            payload = self._get_request_payload(messages, stop=stop, **kwargs)
+            payload.pop("stream", None)
+            return payload
+
+        def _generate(self, messages: List[Any], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Any:
+            response = get_gateway().chat_completion(priority=self.priority, **self._gateway_payload(messages, stop, kwargs))
+            return self._create_chat_result(response)
+
+        async def _agenerate(self, messages: List[Any], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Any:
+            response = await get_gateway().achat_completion(priority=self.priority, **self._gateway_payload(messages, stop, kwargs))
+            return self._create_chat_result(response)
+
+    return GatewayChatOpenAI
+
+
+def gateway_chat_model(model: str, priority: int = BACKGROUND, **params: Any) -> "BaseChatModel":
+    """
+    LangChain chat model whose every request goes through the shared gateway.
+
+    :param model: The model name.
+    :param priority: INTERACTIVE or BACKGROUND.
+    :param params: Any other ChatOpenAI parameters, e.g. temperature.
+    :return: The chat model, usable in any chain in place of ChatOpenAI.
+    """
+    # Streaming would bypass the gateway, so stream() falls back to a single request
+    return _gateway_chat_class()(openai_api_key=get_gateway().api_key, model=model, priority=priority, disable_streaming=True, **params)
+
+
+_gateway: Optional[OpenAIGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> OpenAIGateway:
+    """
+    Return the gateway shared by every module that calls OpenAI, created on first use.
+    """
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            config = get_config()
+            rate_limits = config.get("OPENAI_RATE_LIMITS") or {}
+            if isinstance(rate_limits, str):
+                rate_limits = json.loads(rate_limits)
+            _gateway = OpenAIGateway(
+                api_key=config["OPENAI_API_KEY"],
+                rate_limits={model: tuple(limits) for model, limits in rate_limits.items()},
+            )
+        return _gateway
+
+
+def set_gateway(gateway: OpenAIGateway) -> None:
+    """
+    Use the given gateway for every later OpenAI call, e.g. one with a stand-in transport.
+    LangChain models from gateway_chat_model look the gateway up on every request.
+    """
+    global _gateway
+    with _gateway_lock:
+        _gateway = gateway
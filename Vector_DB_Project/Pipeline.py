@@ -0,0 +1,646 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from Query_Analysis import analyze_query
+from Filtering import retrieve_serial_numbers, retrieve_serial_numbers_sql, search_serial_documents
+from Retrieve import counter_documents, counter_documents_sql, assign_reasons
+from Decider import module_chooser
+from Analysis import map_reduce_analysis
+from Reporting import pointers, summary, astream_pointers, astream_summary, report_analysis
+from Planner import plan_query, aplan_queries
+from Tracing import span
+from Budget import QueryBudget, new_budget, query_budget
+from Retrieval_Cache import canonical_query, get_retrieval_cache
+
+# A DAG node is an async callable plus the names of the nodes whose results it receives
+Node = Tuple[Callable[..., Awaitable[Any]], List[str]]
+
+# Batch mode merges sub-queries with the same routing whose embeddings are at least this similar
+DEFAULT_MERGE_THRESHOLD = 0.97
+
+
+def build_vector_stores(config: Dict[str, str]) -> Tuple[Any, Any]:
+    """
+    Create the two PGVector stores, sharing one cached embedding model.
+
+    :param config: Loaded configuration with PGVECTOR_CONNECTION_STRING.
+    :return: Tuple of (call_embeddings store, call_embeddings_detailed store).
+    """
+    from langchain.vectorstores import PGVector
+    from Embeddings import build_embedding_model
+
+    # Both stores share one cached embedding model, so each distinct text is embedded once
+    embedding_model = build_embedding_model(config)
+
+    vectorstore_metadata = PGVector(
+        embedding_function=embedding_model,
+        connection_string=config['PGVECTOR_CONNECTION_STRING'],
+        collection_name="call_embeddings"
+    )
+
+    vectorstore_embeddings = PGVector(
+        embedding_function=embedding_model,
+        connection_string=config['PGVECTOR_CONNECTION_STRING'],
+        collection_name="call_embeddings_detailed"
+    )
+    return vectorstore_metadata, vectorstore_embeddings
+
+
+def group_by_function(module: Dict[str, Dict[str, str]], key: str) -> Dict[str, List[str]]:
+    """
+    Group routed sub-queries by the function chosen for one module.
+
+    :param module: Output of module_chooser, mapping each query to its selected functions.
+    :param key: Which routing decision to group on, e.g. "filtering_function".
+    :return: Dictionary with function names as keys and lists of queries as values.
+    """
+    grouped = {}
+    for query, functions in module.items():
+        grouped.setdefault(functions[key], []).append(query)
+    return grouped
+
+
+def _check_acyclic(nodes: Dict[str, Node]) -> None:
+    # Kahn's algorithm; a cycle would otherwise deadlock the awaiting tasks
+    remaining = {name: set(deps) for name, (_, deps) in nodes.items()}
+    for name, deps in remaining.items():
+        missing = deps - nodes.keys()
+        if missing:
+            raise ValueError(f"Node '{name}' depends on unknown nodes: {sorted(missing)}")
+    ready = [name for name, deps in remaining.items() if not deps]
+    visited = 0
+    while ready:
+        done = ready.pop()
+        visited += 1
+        for name, deps in remaining.items():
+            if done in deps:
+                deps.discard(done)
+                if not deps:
+                    ready.append(name)
+    if visited != len(nodes):
+        raise ValueError("Dependency graph contains a cycle")
+
+
+async def run_dag(nodes: Dict[str, Node], max_concurrency: int = 4, on_complete: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+    """
+    Execute a dependency graph of async callables, running independent nodes concurrently.
+
+    :param nodes: Dictionary mapping node names to (callable, dependency names). Each callable
+                  is awaited with the results of its dependencies as positional arguments.
+    :param max_concurrency: Maximum number of nodes doing work at the same time.
+    :param on_complete: Optional callback invoked with (node name, result) as each node finishes.
+    :return: Dictionary mapping node names to their results.
+    """
+    _check_acyclic(nodes)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run_node(name: str) -> Any:
+        func, deps = nodes[name]
+        # Wait on dependencies outside the semaphore so blocked nodes don't hold a slot
+        dep_results = [await tasks[dep] for dep in deps]
+        async with semaphore:
+            with span(name.partition(":")[0], "stage", node=name):
+                result = await func(*dep_results)
+        if on_complete is not None:
+            on_complete(name, result)
+        return result
+
+    # All tasks are created before any of them runs, so every dependency lookup succeeds
+    for name in nodes:
+        tasks[name] = asyncio.create_task(run_node(name))
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+    return {name: task.result() for name, task in tasks.items()}
+
+
+def _in_thread(func: Callable[..., Any], *args: Any) -> Callable[..., Awaitable[Any]]:
+    # Wrap a blocking pipeline call as a DAG node, ignoring dependency results
+    async def node(*_deps: Any) -> Any:
+        return await asyncio.to_thread(func, *args)
+    return node
+
+
+async def plan_question(question: str, max_concurrency: int = 4, fused: Optional[bool] = None, router: Any = None) -> Tuple[List[str], Dict[str, Dict[str, str]], Dict[str, Dict[str, str]]]:
+    """
+    Decompose the question and route its sub-queries.
+
+    :param question: The user's question.
+    :param max_concurrency: Maximum number of LLM calls in flight when not fused.
+    :param fused: Use the single-call planner. Otherwise call analyze_query and route with the
+                  router or module_chooser, routing the question itself in parallel with the
+                  decomposition. By default fused unless a router is given or configured.
+    :param router: Router.EmbeddingRouter used instead of module_chooser when not fused; by
+                   default the one at ROUTER_PATH, if configured.
+    :return: Tuple of (sub-queries, routing per sub-query, routing for the whole question).
+    """
+    if router is None and fused is not True:
+        from Router import get_router
+
+        router = get_router()
+    if fused is None:
+        fused = router is None
+    with span("planning", "stage", fused=fused, router=router is not None and not fused):
+        if fused:
+            return await asyncio.to_thread(plan_query, question)
+        return await _plan_unfused(question, max_concurrency, router)
+
+
+async def _plan_unfused(question: str, max_concurrency: int, router: Any) -> Tuple[List[str], Dict[str, Dict[str, str]], Dict[str, Dict[str, str]]]:
+    chooser = router.route if router is not None else module_chooser
+
+    async def route(sub_queries: List[str]) -> Dict[str, Dict[str, str]]:
+        return await asyncio.to_thread(chooser, sub_queries)
+
+    nodes = {
+        "decompose": (_in_thread(analyze_query, question), []),
+        "route": (route, ["decompose"]),
+        "route_final": (_in_thread(chooser, [question]), []),
+    }
+    results = await run_dag(nodes, max_concurrency)
+    return results["decompose"], results["route"], results["route_final"]
+
+
+def _metadata_node(query: str, vectorstore_metadata: Any, connection_string: Optional[str]) -> Callable[..., Awaitable[Any]]:
+    if connection_string:
+        return _in_thread(retrieve_serial_numbers_sql, [query], vectorstore_metadata, connection_string)
+    return _in_thread(retrieve_serial_numbers, [query], vectorstore_metadata)
+
+
+def _search_node(query: str, vectorstore_metadata: Any, vectorstore_embeddings: Any, connection_string: Optional[str]) -> Callable[..., Awaitable[Any]]:
+    # Scoped to the union of the metadata shortlists it receives
+    async def search(*metadata_results: Tuple[List[str], Dict[str, str]]) -> list:
+        shortlisted = list(dict.fromkeys(
+            serial for serials, _ in metadata_results for serial in serials
+        ))
+        documents = await search_serial_documents(
+            vectorstore_embeddings, vectorstore_metadata, [query], shortlisted, connection_string
+        )
+        return documents[query]
+    return search
+
+
+def _analysis_node(query: str, detailed: bool) -> Callable[..., Awaitable[Any]]:
+    # Transcripts are analysed in token-budgeted batches concurrently, then merged
+    async def analysis(*relevant_docs: list) -> str:
+        return await asyncio.to_thread(map_reduce_analysis, query, relevant_docs[0] if relevant_docs else [], detailed)
+    return analysis
+
+
+def count_reasons(analysis_output: str, vectorstore_metadata: Any, connection_string: Optional[str] = None, counting: str = "sql", serial_numbers: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Count the calls behind each reason of an analysis.
+
+    :param analysis_output: The analysis listing the reasons.
+    :param vectorstore_metadata: The call_embeddings store.
+    :param connection_string: PGVector connection string; without it the counts come from similarity searches.
+    :param counting: "sql" for per-reason threshold counts, "assign" for exclusive best-reason assignment.
+    :param serial_numbers: Metadata shortlist the assignment is scoped to, or None for every call.
+    :return: Dictionary of reasons and their counts.
+    """
+    if connection_string and counting == "assign":
+        assignment = assign_reasons(analysis_output, vectorstore_metadata, connection_string, serial_numbers=serial_numbers)
+        reason_counts = {reason: count or "less evidence" for reason, count in assignment["counts"].items()}
+        reason_counts["Calls matched to a reason"] = f"{assignment['assigned']} of {assignment['total_calls']}"
+        return reason_counts
+    if connection_string:
+        return counter_documents_sql(analysis_output, vectorstore_metadata, connection_string)
+    return counter_documents(analysis_output, vectorstore_metadata)
+
+
+def _count_node(vectorstore_metadata: Any, connection_string: Optional[str], counting: str) -> Callable[..., Awaitable[Any]]:
+    # Receives the analysis, then the metadata results its search was scoped to, if any
+    async def count(analysis_output: str, *metadata_results: Tuple[List[str], Dict[str, str]]) -> Dict[str, Any]:
+        shortlisted = list(dict.fromkeys(
+            serial for serials, _ in metadata_results for serial in serials
+        )) if metadata_results else None
+        return await asyncio.to_thread(count_reasons, analysis_output, vectorstore_metadata, connection_string, counting, shortlisted)
+    return count
+
+
+def _report_nodes(question: str, final_response_format: Dict[str, Dict[str, str]], metadata_count: int, analysed_queries: List[str]) -> Tuple[Callable[..., Awaitable[Any]], Callable[..., Awaitable[Any]]]:
+    # report_inputs receives the metadata results, then the analyses, then the reason counts
+    reporting_function_final = group_by_function(final_response_format, "reporting_function")
+
+    async def report_inputs(*results: Any) -> Tuple[Optional[str], str, Dict[str, Any]]:
+        metadata_results = results[:metadata_count]
+        analyses = results[metadata_count:metadata_count + len(analysed_queries)]
+        reason_counts = results[metadata_count + len(analysed_queries):]
+
+        metadata_summary = {}
+        for _, query_summary in metadata_results:
+            metadata_summary.update(query_summary)
+        for query in analysed_queries:
+            metadata_summary.pop(query, None)
+
+        counts = {}
+        for query_counts in reason_counts:
+            counts.update(query_counts)
+        analysis_collection = report_analysis("".join(analyses), list(metadata_summary.values()))
+
+        # Pointers wins when both formats were chosen
+        report_format = None
+        if reporting_function_final.get("Summary"):
+            report_format = "Summary"
+        if reporting_function_final.get("Pointers"):
+            report_format = "Pointers"
+        return report_format, analysis_collection, counts
+
+    async def report(inputs: Tuple[Optional[str], str, Dict[str, Any]]) -> Optional[str]:
+        report_format, analysis_collection, counts = inputs
+        if report_format is None:
+            return None
+        reporter = pointers if report_format == "Pointers" else summary
+        return await asyncio.to_thread(reporter, question, analysis_collection, counts, 70)
+
+    return report_inputs, report
+
+
+def build_execution_graph(
+    question: str,
+    module: Dict[str, Dict[str, str]],
+    final_response_format: Dict[str, Dict[str, str]],
+    vectorstore_metadata: Any,
+    vectorstore_embeddings: Any,
+    connection_string: Optional[str] = None,
+    counting: str = "sql",
+) -> Dict[str, Node]:
+    """
+    Build the dependency graph for answering a routed question.
+
+    Metadata filtering runs once per metadata query. Each transcript query searches
+    once every shortlist is known, each analysed query waits only on its own search,
+    and each reason count waits only on its own analysis and the shortlists that search
+    was scoped to. The final report waits on everything.
+
+    :param question: The user's question.
+    :param module: Routing for each sub-query, as returned by module_chooser.
+    :param final_response_format: Routing for the whole question, used to pick the report format.
+    :param vectorstore_metadata: PGVector store of call-level embeddings and metadata.
+    :param vectorstore_embeddings: PGVector store of detailed transcript chunks.
+    :param connection_string: When given, metadata filters are compiled to SQL on the typed
+                              metadata table, each transcript search is a single statement over
+                              both collections, and reasons are counted server-side instead of
+                              with repeated similarity searches.
+    :param counting: With a connection string, "sql" for per-reason threshold sweeps or
+                     "assign" for exclusive counts where each call goes to its best reason.
+    :return: Dictionary of DAG nodes ready for run_dag.
+    """
+    filtering_function = group_by_function(module, "filtering_function")
+    analysis_function = group_by_function(module, "analysis_function")
+
+    nodes: Dict[str, Node] = {}
+
+    # Metadata filtering: one independent node per query
+    metadata_nodes = []
+    for query in filtering_function.get("metadata_filtering", []):
+        nodes[f"metadata:{query}"] = (_metadata_node(query, vectorstore_metadata, connection_string), [])
+        metadata_nodes.append(f"metadata:{query}")
+
+    # Transcript search: one node per query, scoped to the union of metadata shortlists
+    for query in filtering_function.get("transcript_filtering", []):
+        nodes[f"search:{query}"] = (_search_node(query, vectorstore_metadata, vectorstore_embeddings, connection_string), list(metadata_nodes))
+
+    # Analysis and reason counting: one chain per analysed query
+    analysed_queries = []
+    for analysis_key, detailed in (("general_analysis", False), ("detailed_analysis", True)):
+        for query in analysis_function.get(analysis_key, []):
+            search_node = f"search:{query}"
+            deps = [search_node] if search_node in nodes else []
+            nodes[f"analysis:{query}"] = (_analysis_node(query, detailed), deps)
+            scope = list(metadata_nodes) if deps else []
+            nodes[f"count:{query}"] = (_count_node(vectorstore_metadata, connection_string, counting), [f"analysis:{query}"] + scope)
+            analysed_queries.append(query)
+
+    # Reporting: the only nodes that wait on every branch
+    report_deps = metadata_nodes + [f"analysis:{q}" for q in analysed_queries] + [f"count:{q}" for q in analysed_queries]
+    report_inputs, report = _report_nodes(question, final_response_format, len(metadata_nodes), analysed_queries)
+    nodes["report_inputs"] = (report_inputs, report_deps)
+    nodes["report"] = (report, ["report_inputs"])
+    return nodes
+
+
+async def answer_question(question: str, vectorstore_metadata: Any, vectorstore_embeddings: Any, max_concurrency: int = 4, connection_string: Optional[str] = None, counting: str = "sql", budget: Optional[QueryBudget] = None) -> str:
+    """
+    Answer a question by running its routed sub-queries as a concurrent dependency graph.
+
+    :param question: The user's question.
+    :param vectorstore_metadata: PGVector store of call-level embeddings and metadata.
+    :param vectorstore_embeddings: PGVector store of detailed transcript chunks.
+    :param max_concurrency: Maximum number of LLM or database calls in flight at once.
+    :param connection_string: PGVector connection string enabling server-side reason counting.
+    :param counting: "sql" or "assign", see build_execution_graph.
+    :param budget: Token and cost budget charged with every OpenAI call for this question; by
+                   default a new one from the configuration. Read its accounting() afterwards.
+    :return: The final report produced by summary or pointers.
+    """
+    with query_budget(budget), span("answer", "stage", question=question):
+        sub_queries, module, final_response_format = await plan_question(question, max_concurrency)
+        nodes = build_execution_graph(question, module, final_response_format, vectorstore_metadata, vectorstore_embeddings, connection_string, counting)
+        results = await run_dag(nodes, max_concurrency)
+        return results["report"]
+
+
+def _progress_event(name: str, result: Any) -> Optional[Dict[str, Any]]:
+    # Translate a finished DAG node into a progress event for streaming consumers
+    stage, _, query = name.partition(":")
+    if stage == "metadata":
+        return {"event": "shortlisted", "query": query, "calls": len(result[0])}
+    if stage == "search":
+        return {"event": "transcripts_retrieved", "query": query, "chunks": len(result)}
+    if stage == "analysis":
+        return {"event": "analysis_done", "query": query}
+    if stage == "count":
+        return {"event": "counting_done", "query": query, "reasons": len(result)}
+    return None
+
+
+async def astream_answer(question: str, vectorstore_metadata: Any, vectorstore_embeddings: Any, max_concurrency: int = 4, connection_string: Optional[str] = None, counting: str = "sql", budget: Optional[QueryBudget] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Answer a question as a stream of events: progress for each stage, then the report token by token.
+
+    Events are dictionaries with an "event" key: "planning_done", "shortlisted",
+    "transcripts_retrieved", "analysis_done", "counting_done", "report_started",
+    "token" (with "text") and finally "done" (with the full "report", the "trace_id"
+    of the spans recorded for this question and its token and cost "usage").
+
+    :param question: The user's question.
+    :param vectorstore_metadata: PGVector store of call-level embeddings and metadata.
+    :param vectorstore_embeddings: PGVector store of detailed transcript chunks.
+    :param max_concurrency: Maximum number of LLM or database calls in flight at once.
+    :param connection_string: PGVector connection string enabling server-side filtering and counting.
+    :param counting: "sql" or "assign", see build_execution_graph.
+    :param budget: Token and cost budget for this question; by default a new one from the configuration.
+    :return: Async iterator of event dictionaries.
+    """
+    with query_budget(budget) as budget, span("answer", "stage", question=question, stream=True) as root:
+        sub_queries, module, final_response_format = await plan_question(question, max_concurrency)
+        yield {"event": "planning_done", "sub_queries": sub_queries, "routing": module}
+
+        nodes = build_execution_graph(question, module, final_response_format, vectorstore_metadata, vectorstore_embeddings, connection_string, counting)
+        # The report is streamed below instead of being produced by the graph
+        nodes.pop("report")
+
+        events: asyncio.Queue = asyncio.Queue()
+
+        def on_complete(name: str, result: Any) -> None:
+            event = _progress_event(name, result)
+            if event is not None:
+                events.put_nowait(event)
+
+        graph = asyncio.create_task(run_dag(nodes, max_concurrency, on_complete))
+        try:
+            while not graph.done() or not events.empty():
+                getter = asyncio.ensure_future(events.get())
+                await asyncio.wait({getter, graph}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+            results = graph.result()
+        finally:
+            graph.cancel()
+
+        report_format, analysis_collection, counts = results["report_inputs"]
+        yield {"event": "report_started", "format": report_format}
+        tokens = []
+        if report_format is not None:
+            stream = astream_pointers if report_format == "Pointers" else astream_summary
+            async for token in stream(question, analysis_collection, counts, 70):
+                tokens.append(token)
+                yield {"event": "token", "text": token}
+        yield {"event": "done", "report": "".join(tokens).strip() if tokens else None, "trace_id": root.trace_id, "usage": budget.accounting()}
+
+
+def _execution_routing(routing: Dict[str, str]) -> Tuple[str, str]:
+    # The reporting choice of a sub-query does not change what runs for it
+    return routing["filtering_function"], routing["analysis_function"]
+
+
+def merge_sub_queries(routed: Dict[str, Dict[str, str]], embedding_model: Any = None, threshold: float = DEFAULT_MERGE_THRESHOLD) -> Dict[str, str]:
+    """
+    Map every sub-query of a batch to the sub-query that runs in its place.
+
+    Sub-queries with the same filtering and analysis routing merge when their canonical
+    forms are equal or, given an embedding model, when their cosine similarity reaches the
+    threshold. The first sub-query of each group represents it.
+
+    :param routed: Routing for each sub-query across all questions, in first-seen order.
+    :param embedding_model: Optional LangChain embeddings used to find near-identical sub-queries.
+    :param threshold: Cosine similarity at which two sub-queries count as the same.
+    :return: Dictionary mapping each sub-query to its representative.
+    """
+    representatives: Dict[Tuple[str, Tuple[str, str]], str] = {}
+    merged = {}
+    for query, routing in routed.items():
+        merged[query] = representatives.setdefault((canonical_query(query), _execution_routing(routing)), query)
+    distinct = list(dict.fromkeys(merged.values()))
+    if embedding_model is None or len(distinct) < 2:
+        return merged
+
+    import numpy as np
+
+    vectors = np.asarray(embedding_model.embed_documents(distinct), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    kept: List[int] = []
+    replacement = {}
+    for i, query in enumerate(distinct):
+        match = next((
+            j for j in kept
+            if _execution_routing(routed[distinct[j]]) == _execution_routing(routed[query]) and float(vectors[i] @ vectors[j]) >= threshold
+        ), None)
+        if match is None:
+            kept.append(i)
+        else:
+            replacement[query] = distinct[match]
+    return {query: replacement.get(representative, representative) for query, representative in merged.items()}
+
+
+def build_batch_graph(
+    questions: List[str],
+    plans: List[Tuple[List[str], Dict[str, Dict[str, str]], Dict[str, Dict[str, str]]]],
+    merged: Dict[str, str],
+    routed: Dict[str, Dict[str, str]],
+    vectorstore_metadata: Any,
+    vectorstore_embeddings: Any,
+    connection_string: Optional[str] = None,
+    counting: str = "sql",
+) -> Dict[str, Node]:
+    """
+    Build one dependency graph answering several questions, sharing work between them.
+
+    Each distinct metadata sub-query is filtered once for the whole batch. A transcript
+    search runs once per sub-query and set of metadata shortlists it is scoped to, and an
+    analysis with its reason count once per sub-query, depth and search. Every question
+    gets its own "report_inputs:<i>" and "report:<i>" nodes.
+
+    :param questions: The questions, in order.
+    :param plans: plan_query results for each question.
+    :param merged: Representative of each sub-query, as returned by merge_sub_queries.
+    :param routed: Routing of each representative sub-query.
+    :param vectorstore_metadata: PGVector store of call-level embeddings and metadata.
+    :param vectorstore_embeddings: PGVector store of detailed transcript chunks.
+    :param connection_string: Enables the SQL filtering, search and counting paths, see build_execution_graph.
+    :param counting: "sql" or "assign", see build_execution_graph.
+    :return: Dictionary of DAG nodes ready for run_dag.
+    """
+    nodes: Dict[str, Node] = {}
+    search_names: Dict[Tuple[str, Tuple[str, ...]], str] = {}
+    analysis_names: Dict[Tuple[str, bool, Optional[str]], str] = {}
+
+    def unique(name: str) -> str:
+        # The same sub-query can need differently scoped searches in different questions
+        candidate, n = name, 1
+        while candidate in nodes:
+            n += 1
+            candidate = f"{name} #{n}"
+        return candidate
+
+    for i, (question, (_, module, final_response_format)) in enumerate(zip(questions, plans)):
+        own = {merged[query]: routed[merged[query]] for query in module}
+        filtering_function = group_by_function(own, "filtering_function")
+        analysis_function = group_by_function(own, "analysis_function")
+
+        metadata_nodes = []
+        for query in filtering_function.get("metadata_filtering", []):
+            name = f"metadata:{query}"
+            if name not in nodes:
+                nodes[name] = (_metadata_node(query, vectorstore_metadata, connection_string), [])
+            metadata_nodes.append(name)
+
+        searches = {}
+        for query in filtering_function.get("transcript_filtering", []):
+            key = (query, tuple(sorted(metadata_nodes)))
+            if key not in search_names:
+                search_names[key] = unique(f"search:{query}")
+                nodes[search_names[key]] = (_search_node(query, vectorstore_metadata, vectorstore_embeddings, connection_string), list(key[1]))
+            searches[query] = search_names[key]
+
+        analysed_queries, analysis_nodes = [], []
+        for analysis_key, detailed in (("general_analysis", False), ("detailed_analysis", True)):
+            for query in analysis_function.get(analysis_key, []):
+                key = (query, detailed, searches.get(query))
+                if key not in analysis_names:
+                    analysis_names[key] = unique(f"analysis:{query}")
+                    nodes[analysis_names[key]] = (_analysis_node(query, detailed), [key[2]] if key[2] else [])
+                    scope = list(nodes[key[2]][1]) if key[2] else []
+                    nodes["count" + analysis_names[key][len("analysis"):]] = (_count_node(vectorstore_metadata, connection_string, counting), [analysis_names[key]] + scope)
+                analysed_queries.append(query)
+                analysis_nodes.append(analysis_names[key])
+
+        count_nodes = ["count" + name[len("analysis"):] for name in analysis_nodes]
+        report_inputs, report = _report_nodes(question, final_response_format, len(metadata_nodes), analysed_queries)
+        nodes[f"report_inputs:{i}"] = (report_inputs, metadata_nodes + analysis_nodes + count_nodes)
+        nodes[f"report:{i}"] = (report, [f"report_inputs:{i}"])
+    return nodes
+
+
+def _ancestors(nodes: Dict[str, Node], name: str) -> List[str]:
+    # A node and everything it transitively waits on, in graph order
+    seen, stack = set(), [name]
+    while stack:
+        current = stack.pop()
+        if current not in seen:
+            seen.add(current)
+            stack.extend(nodes[current][1])
+    return [node for node in nodes if node in seen]
+
+
+async def answer_batch(questions: List[str], vectorstore_metadata: Any, vectorstore_embeddings: Any, max_concurrency: int = 4, connection_string: Optional[str] = None, counting: str = "sql", merge_threshold: Optional[float] = DEFAULT_MERGE_THRESHOLD, budget: Optional[QueryBudget] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Answer several questions together: plan them in one concurrent batch, merge identical or
+    near-identical sub-queries, and run one shared dependency graph.
+
+    :param questions: The questions to answer.
+    :param vectorstore_metadata: PGVector store of call-level embeddings and metadata.
+    :param vectorstore_embeddings: PGVector store of detailed transcript chunks.
+    :param max_concurrency: Maximum number of LLM or database calls in flight at once.
+    :param connection_string: PGVector connection string enabling server-side filtering and counting.
+    :param counting: "sql" or "assign", see build_execution_graph.
+    :param merge_threshold: Embedding similarity for merging near-identical sub-queries; None merges
+                            only sub-queries that are equal after canonical_query.
+    :param budget: Budget shared by the whole batch; by default the configured per-question limits
+                   times the number of questions.
+    :return: Tuple of (one record per question with its "report", "sub_queries", the sub-queries
+             "merged" into others and its "timings", batch summary with sharing, "trace_id", "usage"
+             and "retrieval_cache" hit rates).
+    """
+    if budget is None:
+        budget = new_budget()
+        budget.max_tokens = budget.max_tokens * len(questions) if budget.max_tokens else None
+        budget.max_cost = budget.max_cost * len(questions) if budget.max_cost else None
+
+    with query_budget(budget), span("batch", "stage", questions=len(questions)) as root:
+        start = time.perf_counter()
+        from Router import get_router
+
+        if get_router() is not None:
+            # A configured router plans each question with analyze_query and local routing
+            plans = list(await asyncio.gather(*(plan_question(question, max_concurrency) for question in questions)))
+        else:
+            with span("planning", "stage", fused=True, questions=len(questions)):
+                plans = await aplan_queries(questions, max_concurrency)
+        planning_seconds = time.perf_counter() - start
+
+        # A sub-query routed differently by two questions keeps its first routing
+        routed: Dict[str, Dict[str, str]] = {}
+        for _, module, _ in plans:
+            for query, routing in module.items():
+                routed.setdefault(query, routing)
+        embedding_model = getattr(vectorstore_metadata, "embedding_function", None) if merge_threshold is not None else None
+        merged = await asyncio.to_thread(merge_sub_queries, routed, embedding_model, merge_threshold or DEFAULT_MERGE_THRESHOLD)
+        nodes = build_batch_graph(questions, plans, merged, routed, vectorstore_metadata, vectorstore_embeddings, connection_string, counting)
+
+        # (start, end) of each node in seconds since the batch started
+        timings: Dict[str, Tuple[float, float]] = {}
+
+        def timed(name: str, func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+            async def node(*deps: Any) -> Any:
+                began = time.perf_counter() - start
+                try:
+                    return await func(*deps)
+                finally:
+                    timings[name] = (began, time.perf_counter() - start)
+            return node
+
+        results = await run_dag({name: (timed(name, func), deps) for name, (func, deps) in nodes.items()}, max_concurrency)
+
+        needed = [_ancestors(nodes, f"report:{i}") for i in range(len(questions))]
+        users: Dict[str, int] = {}
+        for names in needed:
+            for name in names:
+                users[name] = users.get(name, 0) + 1
+
+        records = []
+        for i, question in enumerate(questions):
+            sub_queries, module, _ = plans[i]
+            records.append({
+                "question": question,
+                "report": results[f"report:{i}"],
+                "sub_queries": sub_queries,
+                "merged": {query: merged[query] for query in module if merged[query] != query},
+                "timings": {
+                    "planning_seconds": round(planning_seconds, 3),
+                    "completed_seconds": round(timings[f"report:{i}"][1], 3),
+                    "stages": {
+                        name: {"seconds": round(timings[name][1] - timings[name][0], 3), "shared": users[name] > 1}
+                        for name in needed[i]
+                    },
+                },
+            })
+        batch = {
+            "questions": len(questions),
+            "sub_queries": len(routed),
+            "distinct_sub_queries": len(set(merged.values())),
+            "nodes": len(nodes),
+            "shared_nodes": sum(1 for count in users.values() if count > 1),
+            "seconds": round(time.perf_counter() - start, 3),
+            "trace_id": root.trace_id,
+            "usage": budget.accounting(),
+            "retrieval_cache": get_retrieval_cache().stats(),
+        }
+        return records, batch
@@ -0,0 +1,169 @@
+from functools import lru_cache
+from typing import TYPE_CHECKING, Literal, List, Dict, Tuple
+from pydantic import BaseModel, Field
+from Decider import log_routing, metadata_fields, transcript_fields
+from Cache import get_response_cache, make_key, schema_digest
+from OpenAI_Client import gateway_chat_model, INTERACTIVE
+
+if TYPE_CHECKING:
+    from langchain_core.runnables import Runnable
+
+# OpenAI chat model used for planning
+model = "gpt-3.5-turbo-0125"
+
+# Define the routed sub-query model; Literal fields restrict each decision to a valid function
+class RoutedSubQuery(BaseModel):
+    """A very specific sub question together with the functions that should answer it."""
+    sub_query: str = Field(
+        ...,
+        description="A very specific sub question.",
+    )
+    filtering_function: Literal["metadata_filtering", "transcript_filtering"] = Field(
+        ...,
+        description="metadata_filtering for call characteristics, transcript_filtering for what was said in the call.",
+    )
+    analysis_function: Literal["metadata_analysis", "general_analysis", "detailed_analysis"] = Field(
+        ...,
+        description="metadata_analysis for numerical summaries, general_analysis for broad summaries, detailed_analysis for in-depth reasoning.",
+    )
+    reporting_function: Literal["Pointers", "Summary"] = Field(
+        ...,
+        description="Pointers for a bullet-point response, Summary for a concise summary.",
+    )
+
+
+# Define the full plan returned by a single tool call
+class QueryPlan(BaseModel):
+    """Decomposition of a user question into routed sub questions."""
+    sub_queries: List[RoutedSubQuery] = Field(
+        ...,
+        description="The distinct sub questions needed to answer the original question.",
+    )
+    reporting_function: Literal["Pointers", "Summary"] = Field(
+        ...,
+        description="Reporting format for the answer to the original question as a whole.",
+    )
+
+
+# System prompt combining query decomposition with the Decider routing instructions
+system_prompt = f"""You are an expert at converting user questions into smaller sub questions and routing each of them. \
+
+Perform query decomposition. Given a user question, break it down into distinct sub questions that \
+you need to answer in order to answer the original question.
+
+If there are acronyms or words you are not familiar with, do not try to rephrase them.
+
+For every sub question choose:
+1. filtering_function: "metadata_filtering" if the sub question is focused on metadata characteristics of a call recording \
+(e.g. call duration, lead_source, etc), and "transcript_filtering" if it is focused on the conversation that happened during the call \
+(like who said what, why in call).
+2. analysis_function: "metadata_analysis" for a numerical summary when the question is analytical (counts, etc. around call characteristics), \
+"general_analysis" for a broad summary of who said what or why, and "detailed_analysis" for an in-depth detailed question.
+3. reporting_function: "Pointers" for a bullet-point response and "Summary" for a concise summary.
+
+Finally choose the reporting_function for the original question as a whole.
+
+Metadata fields:
+{metadata_fields}
+Transcript fields: {transcript_fields}"""
+
+
+@lru_cache(maxsize=None)
+def get_query_planner() -> "Runnable":
+    """
+    Build the planner chain on first use.
+    """
+    from langchain_core.prompts import ChatPromptTemplate
+
+    # Set up the ChatPromptTemplate
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system_prompt),
+            ("human", "{question}"),
+        ]
+    )
+
+    # Initialize the language model with schema-validated structured output (one strict tool call),
+    # sending every request through the gateway
+    llm = gateway_chat_model(model, INTERACTIVE, temperature=0)
+    structured_llm = llm.with_structured_output(QueryPlan, method="function_calling", strict=True)
+
+    # Combine prompt and structured LLM into a planner
+    return prompt | structured_llm
+
+
+# Request parameters that, with the messages, determine the plan; the schema digest retires
+# cached plans whenever QueryPlan or RoutedSubQuery changes shape
+_plan_params = {
+    "temperature": 0,
+    "tools": ["QueryPlan"],
+    "strict": True,
+    "schema": schema_digest(QueryPlan),
+}
+
+
+def _plan_messages(question: str) -> List[Dict[str, str]]:
+    return [{"role": "system", "content": system_prompt}, {"role": "human", "content": question}]
+
+
+def _to_routing(question: str, plan: QueryPlan) -> Tuple[List[str], Dict[str, Dict[str, str]], Dict[str, Dict[str, str]]]:
+    # Convert the plan into the same shapes analyze_query and module_chooser return
+    sub_queries = [routed.sub_query for routed in plan.sub_queries]
+    module = {
+        routed.sub_query: {
+            "filtering_function": routed.filtering_function,
+            "analysis_function": routed.analysis_function,
+            "reporting_function": routed.reporting_function,
+        }
+        for routed in plan.sub_queries
+    }
+    final_response_format = {question: {"reporting_function": plan.reporting_function}}
+    return sub_queries, module, final_response_format
+
+
+def _log_plan(question: str, plan: QueryPlan) -> None:
+    # Fresh plans feed the same routing log as module_chooser, so Router.EmbeddingRouter can be trained from either
+    _, module, final_response_format = _to_routing(question, plan)
+    log_routing({**module, **final_response_format})
+
+
+def plan_query(question: str) -> Tuple[List[str], Dict[str, Dict[str, str]], Dict[str, Dict[str, str]]]:
+    """
+    Decomposes and routes a question in a single LLM call, replacing analyze_query followed by module_chooser.
+
+    :param question: The main question to be analyzed.
+    :return: Tuple of (sub-queries, routing per sub-query, routing for the whole question).
+    """
+    def plan() -> dict:
+        fresh = get_query_planner().invoke({"question": question})
+        _log_plan(question, fresh)
+        return fresh.model_dump()
+
+    cached = get_response_cache().get_or_compute(model, _plan_messages(question), _plan_params, plan)
+    return _to_routing(question, QueryPlan.model_validate(cached))
+
+
+async def aplan_queries(questions: List[str], max_concurrency: int = 8) -> List[Tuple[List[str], Dict[str, Dict[str, str]], Dict[str, Dict[str, str]]]]:
+    """
+    Plans many questions concurrently, one structured LLM call per question.
+
+    :param questions: The questions to be analyzed.
+    :param max_concurrency: Maximum number of planning calls in flight.
+    :return: List of plan_query results in the same order as the questions.
+    """
+    keys = [make_key(model, _plan_messages(question), _plan_params) for question in questions]
+    response_cache = get_response_cache()
+    plans = [response_cache.get(key) for key in keys]
+
+    # Only questions missing from the cache are sent, in one concurrent batch
+    missing = [i for i, cached in enumerate(plans) if cached is None]
+    if missing:
+        fresh = await get_query_planner().abatch(
+            [{"question": questions[i]} for i in missing],
+            config={"max_concurrency": max_concurrency},
+        )
+        for i, plan in zip(missing, fresh):
+            _log_plan(questions[i], plan)
+            plans[i] = plan.model_dump()
+            response_cache.set(keys[i], plans[i])
+    return [_to_routing(question, QueryPlan.model_validate(plan)) for question, plan in zip(questions, plans)]
@@ -1,11 +1,15 @@
-from langchain.output_parsers import PydanticToolsParser
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_core.pydantic_v1 import BaseModel, Field
-from config import load_config
-from typing import Literal, List, Dict
-
-config = load_config()
+from functools import lru_cache
+from typing import TYPE_CHECKING, Literal, List, Dict
+from pydantic import BaseModel, Field
+from Cache import get_response_cache, schema_digest
+from OpenAI_Client import gateway_chat_model, INTERACTIVE
+
+if TYPE_CHECKING:
+    from langchain_core.runnables import Runnable
+
+# OpenAI chat model used for query decomposition
+model = "gpt-3.5-turbo-0125"
+
 # Define the SubQuery model for individual sub-questions
 class SubQuery(BaseModel):
     """Represents a very specific query against the database."""
@@ -23,23 +27,32 @@ you need to answer in order to answer the original question.
 
 If there are acronyms or words you are not familiar with, do not try to rephrase them."""
 
-# Set up the ChatPromptTemplate
-prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", system_prompt),
-        ("human", "{question}"),
-    ]
-)
 
-# Initialize the language model and bind it with the SubQuery tool
-llm = ChatOpenAI(openai_api_key=config["OPENAI_API_KEY"], model="gpt-3.5-turbo-0125", temperature=0)
-llm_with_tools = llm.bind_tools([SubQuery])
+@lru_cache(maxsize=None)
+def get_query_analyzer() -> "Runnable":
+    """
+    Build the query analyzer chain on first use.
+    """
+    from langchain.output_parsers import PydanticToolsParser
+    from langchain_core.prompts import ChatPromptTemplate
+
+    # Set up the ChatPromptTemplate
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system_prompt),
+            ("human", "{question}"),
+        ]
+    )
+
+    # Initialize the language model, sending every request through the gateway, and bind it with the SubQuery tool
+    llm = gateway_chat_model(model, INTERACTIVE, temperature=0)
+    llm_with_tools = llm.bind_tools([SubQuery])
 
-# Set up the parser to handle SubQuery output
-parser = PydanticToolsParser(tools=[SubQuery])
+    # Set up the parser to handle SubQuery output
+    parser = PydanticToolsParser(tools=[SubQuery])
 
-# Combine prompt, LLM with tools, and parser into a query analyzer
-query_analyzer = prompt | llm_with_tools | parser
+    # Combine prompt, LLM with tools, and parser into a query analyzer
+    return prompt | llm_with_tools | parser
 
 # Define the function to analyze the query
 def analyze_query(question: str) -> List[str]:
@@ -49,11 +62,15 @@ def analyze_query(question: str) -> List[str]:
     :param question: The main question to be analyzed.
     :return: A list of sub-queries generated to answer the main question.
     """
-    # Invoke the query analyzer with the input question
-    output = query_analyzer.invoke({"question": question})
+    def decompose() -> List[str]:
+        # Invoke the query analyzer with the input question
+        output = get_query_analyzer().invoke({"question": question})
+
+        # Extract and return the sub-queries
+        return [subquery.sub_query for subquery in output]
 
-    # Extract and return the sub-queries
-    return [subquery.sub_query for subquery in output]
+    messages = [{"role": "system", "content": system_prompt}, {"role": "human", "content": question}]
+    return get_response_cache().get_or_compute(model, messages, {"temperature": 0, "tools": ["SubQuery"], "schema": schema_digest(SubQuery)}, decompose)
 
 # # Define RouteQuery model
 # class RouteQuery(BaseModel):
@@ -1,14 +1,46 @@
-from openai import OpenAI
-from typing import List, Dict
-from config import load_config
+from OpenAI_Client import get_gateway, INTERACTIVE, estimate_tokens, truncate_tokens
+from typing import AsyncIterator, List, Dict
+from Cache import get_response_cache, make_key
+from Budget import TRUNCATED_SUMMARIES, current_budget
 
-# Load configuration
-config = load_config()
-client = OpenAI(api_key=config["OPENAI_API_KEY"])
+# Estimated tokens of a report prompt besides the analysis, and of its completion
+REPORT_PROMPT_TOKENS = 300
+REPORT_COMPLETION_TOKENS = 500
 
-def pointers(query: str, initial_analysis: str, reason_counts: Dict[str, int], total_transcripts: 70) -> str:
+# Each metadata summary is cut to this many tokens once the question's budget is nearly spent
+METADATA_SUMMARY_TOKENS = 300
+
+def report_analysis(analyses: str, metadata_summaries: List[str]) -> str:
     """
-    Generate a bullet-point response for the final analysis.
+    Join the analyses and metadata summaries passed to the final report, truncating every
+    metadata summary when the report would take the question close to its budget.
+    """
+    metadata = "".join(metadata_summaries)
+    budget = current_budget()
+    if budget is not None and metadata:
+        prompt_tokens = estimate_tokens(analyses + metadata) + REPORT_PROMPT_TOKENS
+        if budget.level("gpt-4o", prompt_tokens, REPORT_COMPLETION_TOKENS) >= TRUNCATED_SUMMARIES:
+            metadata = "".join(truncate_tokens(summary, METADATA_SUMMARY_TOKENS) for summary in metadata_summaries)
+            budget.degrade(f"truncated {len(metadata_summaries)} metadata summaries to {METADATA_SUMMARY_TOKENS} tokens each")
+    return analyses + metadata
+
+async def _astream_report(messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+    # Shares cache entries with the non-streaming reporters; a cached report arrives as one chunk
+    key = make_key("gpt-4o", messages, {"max_tokens": 500})
+    cached = get_response_cache().get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    tokens = []
+    async for token in get_gateway().astream_chat_completion(model="gpt-4o", messages=messages, priority=INTERACTIVE, max_tokens=500):
+        tokens.append(token)
+        yield token
+    get_response_cache().set(key, "".join(tokens).strip())
+
+def pointers_messages(query: str, initial_analysis: str, reason_counts: Dict[str, int], total_transcripts: 70) -> List[Dict[str, str]]:
+    """
+    Build the chat messages for the bullet-point final analysis.
     """
     system_instruction = """You are an assistant for providing analysis of call transcripts in bullets. Your task is to:
     1. Summarize the findings based on the initial analysis and the metadata summary if provided.
@@ -32,19 +64,37 @@ Please provide a final analysis that answers the user's query, ensuring all conc
         {"role": "user", "content": prompt}
     ]
 
-    # Generate response with OpenAI
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        max_tokens=500
-    )
+    return messages
 
-    # Return the response content
-    return response.choices[0].message.content.strip()
+def pointers(query: str, initial_analysis: str, reason_counts: Dict[str, int], total_transcripts: 70) -> str:
+    """
+    Generate a bullet-point response for the final analysis.
+    """
+    messages = pointers_messages(query, initial_analysis, reason_counts, total_transcripts)
 
-def summary(query: str, initial_analysis: str, reason_counts: Dict[str, int], total_transcripts: 70) -> str:
+    # Generate response with OpenAI
+    def generate() -> str:
+        response = get_gateway().chat_completion(
+            model="gpt-4o",
+            messages=messages,
+            priority=INTERACTIVE,
+            max_tokens=500
+        )
+        return response.choices[0].message.content.strip()
+
+    # Return the cached response for an identical prompt, generating it on a miss
+    return get_response_cache().get_or_compute("gpt-4o", messages, {"max_tokens": 500}, generate)
+
+async def astream_pointers(query: str, initial_analysis: str, reason_counts: Dict[str, int], total_transcripts: 70) -> AsyncIterator[str]:
     """
-    Generate a summary-style response for the final analysis.
+    Stream a bullet-point response for the final analysis token by token.
+    """
+    async for token in _astream_report(pointers_messages(query, initial_analysis, reason_counts, total_transcripts)):
+        yield token
+
+def summary_messages(query: str, initial_analysis: str, reason_counts: Dict[str, int], total_transcripts: 70) -> List[Dict[str, str]]:
+    """
+    Build the chat messages for the summary-style final analysis.
     """
     system_instruction = """You are an assistant for providing analysis of call transcripts in summary. Your task is to:
     1. Summarize the findings based on the initial analysis, the count data and metadata summary provided.
@@ -68,15 +118,33 @@ Please provide a summary of the final analysis that answers the user's query, en
         {"role": "user", "content": prompt}
     ]
 
+    return messages
+
+def summary(query: str, initial_analysis: str, reason_counts: Dict[str, int], total_transcripts: 70) -> str:
+    """
+    Generate a summary-style response for the final analysis.
+    """
+    messages = summary_messages(query, initial_analysis, reason_counts, total_transcripts)
+
     # Generate response with OpenAI
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        max_tokens=500
-    )
-
-    # Return the response content
-    return response.choices[0].message.content.strip()
+    def generate() -> str:
+        response = get_gateway().chat_completion(
+            model="gpt-4o",
+            messages=messages,
+            priority=INTERACTIVE,
+            max_tokens=500
+        )
+        return response.choices[0].message.content.strip()
+
+    # Return the cached response for an identical prompt, generating it on a miss
+    return get_response_cache().get_or_compute("gpt-4o", messages, {"max_tokens": 500}, generate)
+
+async def astream_summary(query: str, initial_analysis: str, reason_counts: Dict[str, int], total_transcripts: 70) -> AsyncIterator[str]:
+    """
+    Stream a summary-style response for the final analysis token by token.
+    """
+    async for token in _astream_report(summary_messages(query, initial_analysis, reason_counts, total_transcripts)):
+        yield token
 
 
 
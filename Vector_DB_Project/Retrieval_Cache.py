@@ -0,0 +1,260 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from Settings import get_config
+from Cache import ResponseCache
+from Tracing import span
+
+# Per-collection version, advanced in the same transaction as every ingestion write
+WATERMARK_TABLE = "ingestion_watermark"
+
+# Seconds a watermark read is reused before asking Postgres again, overridable with RETRIEVAL_CACHE_WATERMARK_SECONDS;
+# also how long results from before another process's ingestion can still be served
+DEFAULT_WATERMARK_SECONDS = 30.0
+
+
+def canonical_query(query: str) -> str:
+    """
+    Lower-case a sub-query and drop punctuation and repeated whitespace, so trivially different spellings compare equal.
+    """
+    return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+
+def fingerprint(values: Iterable[Any]) -> str:
+    """
+    Order-independent digest of a set of values, e.g. a serial number shortlist.
+    """
+    payload = "\n".join(sorted({str(value) for value in values}))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def create_watermark_table(connection_string: str) -> None:
+    """
+    Create the ingestion watermark table if it doesn't exist yet. Only the ingestion tooling
+    calls this; readers treat a missing table as every collection at version 0.
+    """
+    from sqlalchemy import text
+    from Retrieve import get_engine
+
+    with get_engine(connection_string).begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+                collection_name text PRIMARY KEY,
+                version bigint NOT NULL,
+                updated_at timestamptz NOT NULL DEFAULT now()
+            )
+        """))
+
+
+def bump_watermark(conn: Any, collection_names: List[str]) -> None:
+    """
+    Advance the watermark of each collection, inside the caller's write transaction.
+
+    :param conn: SQLAlchemy connection of the transaction that changes the collections.
+    :param collection_names: Collections (or derived tables) whose contents changed.
+    """
+    from sqlalchemy import text
+
+    conn.execute(text(f"""
+        INSERT INTO {WATERMARK_TABLE} (collection_name, version) VALUES (:name, 1)
+        ON CONFLICT (collection_name) DO UPDATE SET version = {WATERMARK_TABLE}.version + 1, updated_at = now()
+    """), [{"name": name} for name in collection_names])
+
+
+def read_watermark(connection_string: str, collection_names: Iterable[str]) -> str:
+    """
+    Read the current watermark of the given collections in one round trip.
+
+    Besides the versions advanced by ingestion, it includes Postgres' write counters of the
+    embedding table, so rows added through LangChain directly also change it. Those counters
+    are approximate, kept per node and cleared by a statistics reset, so on a replica or after
+    a reset they can go backwards; should they return to an earlier total, a result cached
+    before such direct writes could be served again. Writes through Ingest or
+    refresh_metadata_table advance the explicit versions and are never missed.
+
+    Needs only SELECT privileges; a missing watermark table reads as version 0.
+
+    :param connection_string: PGVector connection string.
+    :param collection_names: Collections whose changes invalidate a cached result.
+    :return: Opaque string that changes whenever any of the collections may have changed.
+    """
+    from sqlalchemy import text
+    from sqlalchemy.exc import ProgrammingError
+    from Retrieve import get_engine
+
+    names = sorted(set(collection_names))
+    with span("sql.watermark", "db"), get_engine(connection_string).connect() as conn:
+        writes = conn.execute(text("""
+            SELECT coalesce(sum(n_tup_ins + n_tup_upd + n_tup_del), 0)
+            FROM pg_stat_user_tables WHERE relname = 'langchain_pg_embedding'
+        """)).scalar()
+        try:
+            versions = dict(conn.execute(text(
+                f"SELECT collection_name, version FROM {WATERMARK_TABLE} WHERE collection_name = ANY(:names)"
+            ), {"names": names}).all())
+        except ProgrammingError:
+            # Nothing has been ingested through the tooling yet
+            versions = {}
+    return json.dumps({"versions": {name: versions.get(name, 0) for name in names}, "writes": int(writes)}, sort_keys=True)
+
+
+class RetrievalCache:
+    """
+    Cache of retrieval results keyed by canonical query, collections, search parameters and
+    the collections' ingestion watermark.
+
+    When the watermark moves, every key computed from it changes, so results from before
+    an ingestion stop being served and age out of the store by LRU eviction. Watermark reads
+    are reused for watermark_seconds, so after another process commits an ingestion the old
+    results can still be served for up to that long; writers in this process call
+    watermarks_changed after committing and are seen by the next lookup. Without a
+    connection string there is no watermark and only the store's TTL expires entries.
+    """
+
+    def __init__(self, store: ResponseCache, connection_string: Optional[str] = None, watermark_seconds: float = DEFAULT_WATERMARK_SECONDS):
+        """
+        :param store: SQLite store holding the results as JSON.
+        :param connection_string: PGVector connection string the watermark is read from.
+        :param watermark_seconds: How long a watermark read is reused; hot queries touch no
+                                  database at all within this window, and other processes'
+                                  ingestions go unnoticed for as long.
+        """
+        self.store = store
+        self.connection_string = connection_string
+        self.watermark_seconds = watermark_seconds
+        self.by_kind: Dict[str, Dict[str, int]] = {}
+        self._watermarks: Dict[Tuple[str, ...], Tuple[float, str]] = {}
+        # Advanced by forget_watermarks, so a read that raced with it isn't remembered
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def watermark(self, collection_names: Iterable[str]) -> Optional[str]:
+        """
+        Return the watermark of the collections, read from Postgres at most once per watermark_seconds.
+        """
+        if not self.connection_string:
+            return None
+        names = tuple(sorted({name for name in collection_names if name}))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._watermarks.get(names)
+            generation = self._generation
+        if cached is not None and now - cached[0] < self.watermark_seconds:
+            return cached[1]
+        value = read_watermark(self.connection_string, names)
+        with self._lock:
+            if generation == self._generation:
+                self._watermarks[names] = (now, value)
+        return value
+
+    def forget_watermarks(self) -> None:
+        """
+        Drop the remembered watermarks, so the next lookup reads them from Postgres again.
+        """
+        with self._lock:
+            self._watermarks.clear()
+            self._generation += 1
+
+    def key(self, kind: str, query: str, collection_names: List[str], params: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Build the cache key of one retrieval at the collections' current watermark.
+        """
+        payload = json.dumps({
+            "kind": kind,
+            "query": canonical_query(query),
+            "collections": sorted({name for name in collection_names if name}),
+            "params": params or {},
+            "watermark": self.watermark(collection_names),
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, kind: str, query: str, collection_names: List[str], params: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[Any]]:
+        """
+        Look up a retrieval result.
+
+        :param kind: What was retrieved, e.g. "self_query" or "transcripts"; metrics are kept per kind.
+        :param query: The sub-query or reason the result is for.
+        :param collection_names: Collections the result was read from.
+        :param params: Everything else that determines the result (filters, k, shortlist fingerprint, ...).
+        :return: Tuple of (key to store a fresh result under, cached result or None).
+        """
+        with span("retrieval_cache.lookup", "cache", retrieval=kind) as current:
+            if self.store.bypass:
+                key, value = "", None
+            else:
+                key = self.key(kind, query, collection_names, params)
+                value = self.store.get(key)
+            current.set(cache_hit=value is not None)
+        with self._lock:
+            counts = self.by_kind.setdefault(kind, {"hits": 0, "misses": 0})
+            counts["hits" if value is not None else "misses"] += 1
+        return key, value
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Store a fresh result under the key returned by get.
+        """
+        if key:
+            self.store.set(key, value)
+
+    def get_or_compute(self, kind: str, query: str, collection_names: List[str], params: Optional[Dict[str, Any]], compute: Callable[[], Any]) -> Any:
+        """
+        Return the cached result of a retrieval, calling compute and caching its result on a miss.
+        """
+        key, value = self.get(kind, query, collection_names, params)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return hit/miss counters and hit rate overall and per kind, and the current size.
+        """
+        with self._lock:
+            by_kind = {
+                kind: {**counts, "hit_rate": counts["hits"] / (counts["hits"] + counts["misses"])}
+                for kind, counts in self.by_kind.items()
+            }
+        hits = sum(counts["hits"] for counts in by_kind.values())
+        misses = sum(counts["misses"] for counts in by_kind.values())
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "entries": self.store.stats()["entries"],
+            "by_kind": by_kind,
+        }
+
+
+@lru_cache(maxsize=None)
+def get_retrieval_cache() -> RetrievalCache:
+    """
+    Return the retrieval cache shared by every filtering, search and counting function, opening it on first use.
+    """
+    config = get_config()
+    store = ResponseCache(
+        path=config.get("RETRIEVAL_CACHE_PATH", "retrieval_cache.sqlite"),
+        ttl_seconds=float(config["RETRIEVAL_CACHE_TTL"]) if config.get("RETRIEVAL_CACHE_TTL") else None,
+        max_entries=int(config["RETRIEVAL_CACHE_MAX_ENTRIES"]) if config.get("RETRIEVAL_CACHE_MAX_ENTRIES") else 100000,
+        bypass=str(config.get("RETRIEVAL_CACHE_BYPASS", "")).lower() in ("1", "true", "yes"),
+    )
+    watermark_seconds = config.get("RETRIEVAL_CACHE_WATERMARK_SECONDS")
+    return RetrievalCache(
+        store,
+        connection_string=config.get("PGVECTOR_CONNECTION_STRING"),
+        watermark_seconds=float(watermark_seconds) if watermark_seconds is not None else DEFAULT_WATERMARK_SECONDS,
+    )
+
+
+def watermarks_changed() -> None:
+    """
+    Tell this process's retrieval cache that a transaction calling bump_watermark has committed,
+    so its own writes are never hidden by the watermark reuse window. A no-op until the cache is opened.
+    """
+    if get_retrieval_cache.cache_info().currsize:
+        get_retrieval_cache().forget_watermarks()
@@ -1,6 +1,18 @@
-from langchain_postgres.vectorstores import PGVector
-from config import load_config
-from typing import List, Tuple, Any, Dict
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, List, Tuple, Any, Dict, Optional, Union
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from Tracing import in_current_context, span
+from Retrieval_Cache import get_retrieval_cache
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Normalized embedding matrix of each whole collection, with the ingestion watermark it was read at
+_call_matrices: Dict[Tuple[str, str], Tuple[str, List[str], "np.ndarray"]] = {}
+_call_matrices_lock = threading.Lock()
 
 
 def retrieve_documents_by_serial_numbers(vectorstore, serial_numbers,query):
@@ -28,6 +40,12 @@ def retrieve_documents_by_serial_numbers(vectorstore, serial_numbers,query):
 
     return results
 
+def extract_reasons(llm_output: str) -> List[str]:
+    """
+    Extract the numbered reasons ("1. ...", "2. ...") from an analysis output.
+    """
+    return [line.split('. ', 1)[1] for line in llm_output.split('\n') if line.strip() and line.split()[0].rstrip('.').isdigit()]
+
 def counter_documents(llm_output: str, vector_store: Any, score_threshold: float = 0.8) -> Dict[str, int]:
     """
     Analyzes LLM output, extracts reasons, and searches documents in a vector store for each reason.
@@ -42,12 +60,20 @@ def counter_documents(llm_output: str, vector_store: Any, score_threshold: float
       If no relevant documents are found down to a threshold of 0.4, "less evidence" is assigned.
     """
     # Extract reasons from the LLM output (supports any number of reasons)
-    reasons = [line.split('. ', 1)[1] for line in llm_output.split('\n') if line.strip() and line.split()[0].rstrip('.').isdigit()]
+    reasons = extract_reasons(llm_output)
     
     # Initialize dictionary to store counts for each reason
     reason_counts = {}
+    cache = get_retrieval_cache()
+    collection = getattr(vector_store, "collection_name", None)
 
     for reason in reasons:
+        # The same reasons come back across analyses; their sweeps are cached per ingestion watermark
+        key, cached = cache.get("reason_count", reason, [collection], {"score_threshold": score_threshold, "k": 300})
+        if cached is not None:
+            reason_counts[reason] = cached
+            continue
+
         # Start with the initial threshold
         current_threshold = score_threshold
         count = 0
@@ -55,11 +81,13 @@ def counter_documents(llm_output: str, vector_store: Any, score_threshold: float
         # Attempt to retrieve documents with progressively lower thresholds
         while current_threshold >= 0.4:
             # Perform similarity search for each reason with the specified threshold
-            results = vector_store.similarity_search_with_relevance_scores(
-                query=reason,
-                k=300,
-                score_threshold=current_threshold
-            )
+            with span("pgvector.similarity", "db", collection=getattr(vector_store, "collection_name", None), threshold=round(current_threshold, 2)) as current:
+                results = vector_store.similarity_search_with_relevance_scores(
+                    query=reason,
+                    k=300,
+                    score_threshold=current_threshold
+                )
+                current.set(rows=len(results))
             
             # Count the number of documents with a score above the threshold
             count = sum(1 for _, score in results if score >= current_threshold)
@@ -73,9 +101,256 @@ def counter_documents(llm_output: str, vector_store: Any, score_threshold: float
 
         # If no documents are found after lowering threshold to 0.4, set as "less evidence"
         reason_counts[reason] = count if count > 0 else "less evidence"
+        cache.set(key, reason_counts[reason])
+
+    return reason_counts
+
+
+@lru_cache(maxsize=None)
+def get_engine(connection_string: str):
+    """
+    Return a pooled SQLAlchemy engine, shared by every caller using the same connection string.
+    """
+    from sqlalchemy import create_engine
+
+    return create_engine(connection_string, pool_size=10, max_overflow=10, pool_pre_ping=True)
+
+
+def sweep_thresholds(score_threshold: float = 0.8, min_threshold: float = 0.4, step: float = 0.1) -> List[float]:
+    """
+    Thresholds visited by counter_documents, from score_threshold down to min_threshold.
+    """
+    count = int(round((score_threshold - min_threshold) / step)) + 1
+    return [round(score_threshold - i * step, 4) for i in range(count)]
+
+
+def reason_histogram(connection_string: str, collection_name: str, vector: List[float], thresholds: List[float]) -> Dict[float, int]:
+    """
+    Count documents in a collection at every relevance threshold with a single SQL aggregate.
+
+    Relevance follows PGVector's cosine scoring (1 - cosine distance). Only counts
+    are returned, so there is no k cap and no document payload on the wire.
+
+    Parameters:
+    - connection_string (str): PGVector connection string.
+    - collection_name (str): Name of the LangChain PGVector collection.
+    - vector (List[float]): Embedding of the reason.
+    - thresholds (List[float]): Relevance thresholds to count at.
+
+    Returns:
+    - Dict[float, int]: Number of documents with relevance >= each threshold.
+    """
+    from sqlalchemy import text
+
+    buckets = ", ".join(
+        f"count(*) FILTER (WHERE distance <= :max_distance_{i}) AS bucket_{i}" for i in range(len(thresholds))
+    )
+    query = text(f"""
+        WITH scored AS (
+            SELECT e.embedding <=> CAST(:vector AS vector) AS distance
+            FROM langchain_pg_embedding e
+            JOIN langchain_pg_collection c ON e.collection_id = c.uuid
+            WHERE c.name = :collection_name
+        )
+        SELECT {buckets} FROM scored WHERE distance <= :max_distance
+    """)
+    params = {
+        "vector": "[" + ",".join(map(str, vector)) + "]",
+        "collection_name": collection_name,
+        "max_distance": 1 - min(thresholds),
+    }
+    params.update({f"max_distance_{i}": 1 - threshold for i, threshold in enumerate(thresholds)})
+
+    with span("sql.reason_histogram", "db", collection=collection_name), get_engine(connection_string).connect() as conn:
+        row = conn.execute(query, params).one()
+    return {threshold: int(row[i]) for i, threshold in enumerate(thresholds)}
+
+
+def reason_histograms(reasons: List[str], vector_store: Any, connection_string: str, thresholds: List[float], max_workers: int = 8) -> Dict[str, Dict[float, int]]:
+    """
+    Embed all reasons in one batch and run their histogram queries concurrently.
+
+    Parameters:
+    - reasons (List[str]): Reasons to count.
+    - vector_store (Any): The PGVector store; its embedding model and collection name are used.
+    - connection_string (str): PGVector connection string.
+    - thresholds (List[float]): Relevance thresholds to count at.
+    - max_workers (int): Maximum number of concurrent database queries.
+
+    Returns:
+    - Dict[str, Dict[float, int]]: Histogram per reason.
+    """
+    if not reasons:
+        return {}
+    cache = get_retrieval_cache()
+    lookups = {reason: cache.get("reason_histogram", reason, [vector_store.collection_name], {"thresholds": thresholds}) for reason in reasons}
+    # Counts are cached in threshold order, since JSON would turn the float keys into strings
+    histograms = {reason: dict(zip(thresholds, cached)) for reason, (_, cached) in lookups.items() if cached is not None}
+    missing = [reason for reason in lookups if reason not in histograms]
+    if missing:
+        vectors = vector_store.embeddings.embed_documents(missing)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+            fresh = executor.map(
+                in_current_context(lambda vector: reason_histogram(connection_string, vector_store.collection_name, vector, thresholds)),
+                vectors,
+            )
+            for reason, histogram in zip(missing, fresh):
+                cache.set(lookups[reason][0], [histogram[threshold] for threshold in thresholds])
+                histograms[reason] = histogram
+    return {reason: histograms[reason] for reason in reasons}
+
+
+def counter_documents_sql(llm_output: str, vector_store: Any, connection_string: str, score_threshold: float = 0.8, max_workers: int = 8) -> Dict[str, Union[int, str]]:
+    """
+    Server-side equivalent of counter_documents: one SQL aggregate per reason, reasons queried concurrently.
+
+    Parameters:
+    - llm_output (str): The output text from the LLM containing numbered reasons.
+    - vector_store (Any): The PGVector store to count in.
+    - connection_string (str): PGVector connection string.
+    - score_threshold (float): Highest relevance threshold of the sweep. Defaults to 0.8.
+    - max_workers (int): Maximum number of concurrent database queries.
+
+    Returns:
+    - Dict[str, Union[int, str]]: For each reason, the uncapped count at the highest threshold
+      with any match, or "less evidence" if nothing matches down to 0.4.
+    """
+    thresholds = sweep_thresholds(score_threshold)
+    histograms = reason_histograms(extract_reasons(llm_output), vector_store, connection_string, thresholds, max_workers)
 
+    reason_counts = {}
+    for reason, histogram in histograms.items():
+        count = next((histogram[threshold] for threshold in thresholds if histogram[threshold] > 0), 0)
+        reason_counts[reason] = count if count > 0 else "less evidence"
     return reason_counts
 
 
+def load_call_embeddings(connection_string: str, collection_name: str, serial_numbers: Optional[List[str]] = None) -> Tuple[List[str], np.ndarray]:
+    """
+    Load the serial numbers and embeddings of the calls in a collection, without transcripts.
+
+    Parameters:
+    - connection_string (str): PGVector connection string.
+    - collection_name (str): Name of the LangChain PGVector collection.
+    - serial_numbers (Optional[List[str]]): Restrict to these calls; all calls if None.
+
+    Returns:
+    - Tuple[List[str], np.ndarray]: Serial numbers and the matching (n, d) float32 embedding matrix.
+    """
+    import numpy as np
+    from sqlalchemy import text
+
+    query = """
+        SELECT e.cmetadata->>'Serial Number', e.embedding::text
+        FROM langchain_pg_embedding e
+        JOIN langchain_pg_collection c ON e.collection_id = c.uuid
+        WHERE c.name = :collection_name
+    """
+    params: Dict[str, Any] = {"collection_name": collection_name}
+    if serial_numbers is not None:
+        query += " AND e.cmetadata->>'Serial Number' = ANY(:serial_numbers)"
+        params["serial_numbers"] = [str(serial) for serial in serial_numbers]
+
+    with span("sql.call_embeddings", "db", collection=collection_name) as current, get_engine(connection_string).connect() as conn:
+        rows = conn.execute(text(query), params).fetchall()
+        current.set(rows=len(rows))
+    if not rows:
+        return [], np.empty((0, 0), dtype=np.float32)
+    ids = [row[0] for row in rows]
+    matrix = np.array([row[1][1:-1].split(",") for row in rows], dtype=np.float32)
+    return ids, matrix
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    Scale each row to unit length; all-zero rows stay zero instead of becoming NaN.
+    """
+    import numpy as np
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def normalized_call_embeddings(connection_string: str, collection_name: str, serial_numbers: Optional[List[str]] = None) -> Tuple[List[str], np.ndarray]:
+    """
+    Return load_call_embeddings' serial numbers with unit-length rows, reusing the whole
+    collection's matrix until the collection's ingestion watermark moves.
+
+    A shortlist is sliced out of the cached matrix when there is one and loaded on its own
+    otherwise, so counting under a metadata filter never reads the whole collection.
+    The returned matrix is read-only.
+
+    Parameters:
+    - connection_string (str): PGVector connection string.
+    - collection_name (str): Name of the LangChain PGVector collection.
+    - serial_numbers (Optional[List[str]]): Restrict to these calls; all calls if None.
+
+    Returns:
+    - Tuple[List[str], np.ndarray]: Serial numbers and the matching normalized (n, d) matrix.
+    """
+    watermark = get_retrieval_cache().watermark([collection_name])
+    key = (connection_string, collection_name)
+    with _call_matrices_lock:
+        cached = _call_matrices.get(key)
+    if watermark is None or cached is None or cached[0] != watermark:
+        cached = None
+
+    if cached is not None and serial_numbers is not None:
+        wanted = {str(serial) for serial in serial_numbers}
+        rows = [i for i, serial in enumerate(cached[1]) if serial in wanted]
+        return [cached[1][i] for i in rows], cached[2][rows]
+    if cached is not None:
+        return cached[1], cached[2]
+
+    ids, matrix = load_call_embeddings(connection_string, collection_name, serial_numbers)
+    matrix = normalize_rows(matrix) if ids else matrix
+    matrix.setflags(write=False)
+    if serial_numbers is None and watermark is not None:
+        with _call_matrices_lock:
+            _call_matrices[key] = (watermark, ids, matrix)
+    return ids, matrix
+
+
+def assign_reasons(llm_output: str, vector_store: Any, connection_string: str, score_threshold: float = 0.8, serial_numbers: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Assign every call to its single best-matching reason in one vectorized pass.
+
+    Reasons are embedded in one batch and scored against all candidate call
+    embeddings with one matrix product. A call counts towards the reason with the
+    highest relevance if that relevance reaches score_threshold, so counts are
+    exclusive and sum to the number of covered calls.
+
+    Parameters:
+    - llm_output (str): The output text from the LLM containing numbered reasons.
+    - vector_store (Any): The PGVector store whose embedding model and collection are used.
+    - connection_string (str): PGVector connection string.
+    - score_threshold (float): Minimum relevance (1 - cosine distance) to assign a call.
+    - serial_numbers (Optional[List[str]]): Restrict candidates to these calls, e.g. the metadata
+      shortlist of the question; every call in the collection if None or empty, as in the
+      transcript search.
+
+    Returns:
+    - Dict[str, Any]: {"counts": {reason: count}, "assigned": int, "total_calls": int, "coverage": float}
+    """
+    import numpy as np
+
+    reasons = list(dict.fromkeys(extract_reasons(llm_output)))
+    ids, call_vectors = normalized_call_embeddings(connection_string, vector_store.collection_name, serial_numbers or None)
+    if not reasons or not ids:
+        return {"counts": {reason: 0 for reason in reasons}, "assigned": 0, "total_calls": len(ids), "coverage": 0.0}
+
+    reason_vectors = normalize_rows(np.asarray(vector_store.embeddings.embed_documents(reasons), dtype=np.float32))
 
+    # (calls, reasons) cosine similarities, i.e. PGVector relevance scores
+    scores = call_vectors @ reason_vectors.T
+    best = scores.argmax(axis=1)
+    assigned = scores[np.arange(len(ids)), best] >= score_threshold
 
+    per_reason = np.bincount(best[assigned], minlength=len(reasons))
+    n_assigned = int(assigned.sum())
+    return {
+        "counts": {reason: int(count) for reason, count in zip(reasons, per_reason)},
+        "assigned": n_assigned,
+        "total_calls": len(ids),
+        "coverage": n_assigned / len(ids),
+    }
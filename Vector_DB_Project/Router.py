@@ -0,0 +1,219 @@
+import json
+import time
+import numpy as np
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from Settings import get_config
+from Decider import choose_filtering_function, choose_analysis_function, choose_reporting_function
+
+# Routing decisions the local router learns, mapped to the LLM chooser used as fallback
+DECISIONS = {
+    "filtering_function": choose_filtering_function,
+    "analysis_function": choose_analysis_function,
+    "reporting_function": choose_reporting_function,
+}
+
+
+def load_routing_log(path: str) -> List[Dict[str, str]]:
+    """
+    Load logged routing decisions written by Decider.module_chooser.
+
+    :param path: Path to a JSON lines file with one {"query", <decision>: <label>, ...} record per line.
+    :return: List of routing records.
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class EmbeddingRouter:
+    """
+    Nearest-centroid classifier over query embeddings for each routing decision.
+
+    Confidence is the softmax probability of the nearest centroid, using cosine
+    similarities scaled by the temperature.
+    """
+
+    def __init__(self, embedding_model: Any, temperature: float = 0.05, min_confidence: float = 0.8):
+        self.embedding_model = embedding_model
+        self.temperature = temperature
+        self.min_confidence = min_confidence
+        # decision -> (labels, unit-norm centroid matrix)
+        self.centroids: Dict[str, Tuple[List[str], np.ndarray]] = {}
+
+    def fit(self, records: List[Dict[str, str]], vectors: Optional[np.ndarray] = None) -> "EmbeddingRouter":
+        """
+        Build centroids from logged routing decisions.
+
+        :param records: Routing records as returned by load_routing_log.
+        :param vectors: Precomputed embeddings for the records' queries, embedded if not given.
+        :return: The fitted router.
+        """
+        if vectors is None:
+            vectors = np.asarray(self.embedding_model.embed_documents([r["query"] for r in records]), dtype=np.float32)
+        vectors = _normalize(vectors)
+        for decision in DECISIONS:
+            labelled = [(i, r[decision]) for i, r in enumerate(records) if r.get(decision)]
+            labels = sorted({label for _, label in labelled})
+            if not labels:
+                continue
+            centroids = np.stack([
+                vectors[[i for i, label in labelled if label == target]].mean(axis=0) for target in labels
+            ])
+            self.centroids[decision] = (labels, _normalize(centroids))
+        return self
+
+    def classify(self, vector: np.ndarray, decision: str) -> Tuple[Optional[str], float]:
+        """
+        Classify a query embedding for one routing decision.
+
+        :param vector: The query embedding.
+        :param decision: One of the keys of DECISIONS.
+        :return: Tuple of (label, confidence); label is None if the decision was never trained.
+        """
+        if decision not in self.centroids:
+            return None, 0.0
+        labels, centroids = self.centroids[decision]
+        similarities = centroids @ _normalize(np.asarray(vector, dtype=np.float32))
+        scaled = np.exp((similarities - similarities.max()) / self.temperature)
+        probabilities = scaled / scaled.sum()
+        best = int(probabilities.argmax())
+        return labels[best], float(probabilities[best])
+
+    def route(self, sub_queries: List[str], min_confidence: Optional[float] = None) -> Dict[str, Dict[str, str]]:
+        """
+        Route sub-queries locally, falling back to the LLM chooser for low-confidence decisions.
+
+        Costs one embedding request for the sub-queries (none for those already in the
+        embedding cache) plus one matrix-vector product per decision.
+
+        :param sub_queries: List of sub-queries generated by analyze_query.
+        :param min_confidence: Confidence below which the LLM chooser is called instead; the router's own by default.
+        :return: Dictionary in the same shape as Decider.module_chooser returns.
+        """
+        min_confidence = self.min_confidence if min_confidence is None else min_confidence
+        vectors = np.asarray(self.embedding_model.embed_documents(sub_queries), dtype=np.float32)
+        routed_functions = {}
+        for query, vector in zip(sub_queries, vectors):
+            routed_functions[query] = {}
+            for decision, llm_chooser in DECISIONS.items():
+                label, confidence = self.classify(vector, decision)
+                routed_functions[query][decision] = label if confidence >= min_confidence else llm_chooser(query)
+        return routed_functions
+
+    def save(self, path: str) -> None:
+        """
+        Save the centroids to a .npz file.
+        """
+        arrays = {}
+        for decision, (labels, centroids) in self.centroids.items():
+            arrays[f"{decision}.labels"] = np.asarray(labels)
+            arrays[f"{decision}.centroids"] = centroids
+        np.savez(path, temperature=self.temperature, **arrays)
+
+    @classmethod
+    def load(cls, path: str, embedding_model: Any, min_confidence: float = 0.8) -> "EmbeddingRouter":
+        """
+        Load a router saved with save.
+        """
+        data = np.load(path)
+        router = cls(embedding_model, temperature=float(data["temperature"]), min_confidence=min_confidence)
+        for decision in DECISIONS:
+            if f"{decision}.labels" in data:
+                router.centroids[decision] = ([str(label) for label in data[f"{decision}.labels"]], data[f"{decision}.centroids"])
+        return router
+
+
+@lru_cache(maxsize=None)
+def get_router() -> Optional[EmbeddingRouter]:
+    """
+    Return the router saved at ROUTER_PATH, loaded on first use, or None when it is not configured.
+
+    With a router, planning decomposes with analyze_query and routes locally instead of
+    using the single-call planner; ROUTER_MIN_CONFIDENCE sets the LLM fallback threshold.
+    """
+    config = get_config()
+    if not config.get("ROUTER_PATH"):
+        return None
+    from Embeddings import build_embedding_model
+
+    return EmbeddingRouter.load(config["ROUTER_PATH"], build_embedding_model(config), float(config.get("ROUTER_MIN_CONFIDENCE", 0.8)))
+
+
+def benchmark_router(records: List[Dict[str, str]], embedding_model: Any, holdout: float = 0.2, min_confidence: float = 0.8, seed: int = 0) -> Dict[str, Any]:
+    """
+    Measure agreement between the local router and the logged LLM decisions on a held-out split,
+    and the per-query routing latency including the embedding request.
+
+    Held-out queries are embedded one at a time, as route would for a single sub-query, so
+    pass an uncached embedding model to measure the real round trip.
+
+    :param records: Routing records as returned by load_routing_log.
+    :param embedding_model: Embedding model used for the queries.
+    :param holdout: Fraction of records used for evaluation.
+    :param min_confidence: Confidence threshold used to report fast-path coverage.
+    :param seed: Seed for the train/test split.
+    :return: Per decision: overall agreement, fast-path coverage and agreement on the fast path;
+             under "latency": mean embedding milliseconds, classification microseconds for all
+             decisions, and their total in milliseconds per routed query.
+    """
+    order = np.random.default_rng(seed).permutation(len(records))
+    n_test = max(1, int(len(records) * holdout))
+    test_idx, train_idx = order[:n_test], order[n_test:]
+
+    train_vectors = np.asarray(embedding_model.embed_documents([records[i]["query"] for i in train_idx]), dtype=np.float32)
+    router = EmbeddingRouter(embedding_model).fit([records[i] for i in train_idx], train_vectors)
+
+    embedding_seconds = classification_seconds = 0.0
+    predictions: Dict[str, List[Tuple[Optional[str], float]]] = {decision: [] for decision in DECISIONS}
+    for i in test_idx:
+        start = time.perf_counter()
+        vector = np.asarray(embedding_model.embed_query(records[i]["query"]), dtype=np.float32)
+        embedded = time.perf_counter()
+        for decision in DECISIONS:
+            predictions[decision].append(router.classify(vector, decision))
+        classification_seconds += time.perf_counter() - embedded
+        embedding_seconds += embedded - start
+
+    report: Dict[str, Any] = {}
+    for decision in DECISIONS:
+        agree = confident = confident_agree = 0
+        for i, (label, confidence) in zip(test_idx, predictions[decision]):
+            expected = records[i].get(decision)
+            agree += label == expected
+            if confidence >= min_confidence:
+                confident += 1
+                confident_agree += label == expected
+        report[decision] = {
+            "agreement": agree / n_test,
+            "fast_path_coverage": confident / n_test,
+            "fast_path_agreement": confident_agree / confident if confident else 0.0,
+        }
+    report["latency"] = {
+        "embedding_ms": embedding_seconds / n_test * 1e3,
+        "classification_us": classification_seconds / n_test * 1e6,
+        "total_ms": (embedding_seconds + classification_seconds) / n_test * 1e3,
+    }
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from Embeddings import GatewayEmbeddings
+
+    parser = argparse.ArgumentParser(description="Train the local router from logged decisions and report agreement with the LLM router")
+    parser.add_argument("log_path", help="JSON lines file of logged routing decisions (ROUTING_LOG_PATH)")
+    parser.add_argument("--save", help="Write the router trained on all records to this .npz path, for ROUTER_PATH")
+    parser.add_argument("--min-confidence", type=float, default=0.8)
+    args = parser.parse_args()
+
+    # Uncached, so the reported latency includes the embedding round trip a new sub-query pays
+    embedding_model = GatewayEmbeddings()
+    records = load_routing_log(args.log_path)
+    print(json.dumps(benchmark_router(records, embedding_model, min_confidence=args.min_confidence), indent=2))
+    if args.save:
+        EmbeddingRouter(embedding_model).fit(records).save(args.save)
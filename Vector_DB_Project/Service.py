@@ -0,0 +1,140 @@
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Literal, Optional
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from sqlalchemy import text
+from Settings import get_config
+from Pipeline import astream_answer, build_vector_stores
+from Retrieve import get_engine
+from Cache import get_response_cache
+from Retrieval_Cache import get_retrieval_cache
+
+# Warm state shared by every request, created once at startup
+state: Dict[str, Any] = {}
+
+
+class QueryRequest(BaseModel):
+    """A question to answer with the pipeline."""
+    question: str = Field(..., description="The user's question.")
+    stream: bool = Field(False, description="Stream progress events and report tokens as JSON lines.")
+    max_concurrency: int = Field(4, ge=1, le=32, description="Maximum LLM or database calls in flight for this question.")
+    counting: Literal["sql", "assign"] = Field("sql", description="Reason counting mode.")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load config, build the embedding model and vector stores and open DB connections once
+    config = get_config()
+    state["config"] = config
+    state["connection_string"] = config["PGVECTOR_CONNECTION_STRING"]
+    state["vectorstore_metadata"], state["vectorstore_embeddings"] = await asyncio.to_thread(build_vector_stores, config)
+    state["query_slots"] = asyncio.Semaphore(int(config.get("SERVICE_MAX_CONCURRENT_QUERIES", 8)))
+    await asyncio.to_thread(_ping_database)
+    state["ready"] = True
+    yield
+    state["ready"] = False
+    get_engine(state["connection_string"]).dispose()
+
+
+app = FastAPI(title="Call Analytics Query Service", lifespan=lifespan)
+
+
+def _ping_database() -> None:
+    with get_engine(state["connection_string"]).connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+def _events(request: QueryRequest):
+    return astream_answer(
+        request.question,
+        state["vectorstore_metadata"],
+        state["vectorstore_embeddings"],
+        request.max_concurrency,
+        state["connection_string"],
+        request.counting,
+    )
+
+
+@app.get("/health")
+async def health() -> Dict[str, str]:
+    """
+    Liveness: the process is up.
+    """
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready() -> Dict[str, str]:
+    """
+    Readiness: startup finished and the database answers.
+    """
+    if not state.get("ready"):
+        raise HTTPException(status_code=503, detail="starting")
+    try:
+        await asyncio.to_thread(_ping_database)
+    except Exception as error:
+        raise HTTPException(status_code=503, detail=f"database unavailable: {error}")
+    return {"status": "ready"}
+
+
+@app.get("/metrics/cache")
+async def cache_metrics() -> Dict[str, Any]:
+    """
+    Hit rates of the retrieval cache (overall and per kind of retrieval) and of the LLM response cache.
+    """
+    retrieval, response = await asyncio.to_thread(lambda: (get_retrieval_cache().stats(), get_response_cache().stats()))
+    return {"retrieval": retrieval, "response": response}
+
+
+@app.post("/query")
+async def query(request: QueryRequest) -> Any:
+    """
+    Answer a question on the warm clients. With stream=true the response is JSON lines of
+    pipeline events (see Pipeline.astream_answer); otherwise it is the final report.
+    """
+    if not state.get("ready"):
+        raise HTTPException(status_code=503, detail="starting")
+
+    if request.stream:
+        async def lines():
+            async with state["query_slots"]:
+                async for event in _events(request):
+                    yield json.dumps(event, default=str) + "\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    start = time.perf_counter()
+    progress = []
+    report: Optional[str] = None
+    trace_id: Optional[str] = None
+    usage: Optional[Dict[str, Any]] = None
+    async with state["query_slots"]:
+        async for event in _events(request):
+            if event["event"] == "done":
+                report = event["report"]
+                trace_id = event["trace_id"]
+                usage = event["usage"]
+            elif event["event"] != "token":
+                progress.append(event)
+    return {
+        "question": request.question,
+        "report": report,
+        "progress": progress,
+        "elapsed_seconds": round(time.perf_counter() - start, 3),
+        "trace_id": trace_id,
+        "usage": usage,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the query service")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,26 @@
+from typing import Any, Dict, Optional
+
+_config: Optional[Dict[str, Any]] = None
+
+
+def get_config() -> Dict[str, Any]:
+    """
+    Load the configuration on first use and share it across every module.
+
+    :return: The configuration dictionary returned by config.load_config.
+    """
+    global _config
+    if _config is None:
+        from config import load_config
+
+        _config = load_config()
+    return _config
+
+
+def set_config(config: Dict[str, Any]) -> None:
+    """
+    Use the given configuration instead of loading it, e.g. for offline benchmarks.
+    Call this before any client is created.
+    """
+    global _config
+    _config = config
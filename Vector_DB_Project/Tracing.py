@@ -0,0 +1,309 @@
+import contextvars
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from Settings import get_config
+
+# Span currently open in this thread or task; children started inside it get it as parent
+_current_span: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("current_span", default=None)
+
+# Attributes shown next to each bar of the waterfall summary
+WATERFALL_ATTRIBUTES = ["model", "node", "collection", "plan", "prompt_tokens", "completion_tokens", "rows", "cache_hit", "cache_hits", "cache_misses", "texts", "error"]
+
+
+class Span:
+    """
+    One timed operation: an LLM, embedding or database call, a cache lookup or a pipeline stage.
+    """
+
+    def __init__(self, name: str, kind: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        """
+        :param name: Operation name, e.g. "openai.chat" or "analysis".
+        :param kind: "llm", "embedding", "db", "cache", "stage" or "internal".
+        :param parent: Enclosing span; None starts a new trace.
+        :param attributes: Initial attributes such as model or query.
+        """
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes: Dict[str, Any] = {}
+        self.set(**attributes)
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self.status = "ok"
+        self._started = time.perf_counter()
+
+    @property
+    def end(self) -> Optional[float]:
+        return None if self.duration is None else self.start + self.duration
+
+    def set(self, **attributes: Any) -> "Span":
+        """
+        Add attributes, ignoring None values.
+        """
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+        return self
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """
+        Record the duration and hand the span to the exporters. Later calls do nothing.
+        """
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.status = "error"
+            self.attributes["error"] = f"{type(error).__name__}: {error}"
+        for exporter in list(get_exporters()):
+            exporter.export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.start,
+            "duration_ms": None if self.duration is None else round(self.duration * 1000, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+def current_span() -> Optional[Span]:
+    """
+    Return the span open in this thread or task, if any.
+    """
+    return _current_span.get()
+
+
+def start_span(name: str, kind: str = "internal", **attributes: Any) -> Span:
+    """
+    Start a span under the current one without making it current; call finish() when done.
+    Use this for leaf operations and for spans that stay open across yields.
+    """
+    return Span(name, kind, current_span(), attributes)
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes: Any) -> Iterator[Span]:
+    """
+    Time the enclosed block as a span, current for everything started inside it.
+    Also usable around the body of an async generator consumed by a single task.
+    """
+    current = start_span(name, kind, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as error:
+        current.finish(error)
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # An async generator closed from another context; that context never saw the span
+            pass
+        current.finish()
+
+
+def in_current_context(func: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Wrap func so that it runs under the caller's current span when submitted to a thread pool.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args: Any, **kwargs: Any) -> Any:
+        return context.copy().run(func, *args, **kwargs)
+    return run
+
+
+class JsonlExporter:
+    """
+    Append every finished span to a JSON lines file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, finished: Span) -> None:
+        line = json.dumps(finished.to_dict(), default=str)
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+class OTelExporter:
+    """
+    Forward finished spans to an OpenTelemetry SpanExporter (OTLP, console, ...) through a batch processor.
+
+    Requires the opentelemetry-sdk package; the OTLP constructor also needs
+    opentelemetry-exporter-otlp-proto-http.
+    """
+
+    def __init__(self, span_exporter: Any, service_name: str = "call-analytics"):
+        import atexit
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+        self.processor = BatchSpanProcessor(span_exporter)
+        self.resource = Resource.create({"service.name": service_name})
+        atexit.register(self.processor.shutdown)
+
+    @classmethod
+    def otlp(cls, endpoint: str, service_name: str = "call-analytics") -> "OTelExporter":
+        """
+        Export over OTLP/HTTP, e.g. to http://localhost:4318/v1/traces.
+        """
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        return cls(OTLPSpanExporter(endpoint=endpoint), service_name)
+
+    def export(self, finished: Span) -> None:
+        from opentelemetry.sdk.trace import ReadableSpan
+        from opentelemetry.trace import SpanContext, SpanKind, Status, StatusCode, TraceFlags
+
+        def context(span_id: str) -> SpanContext:
+            return SpanContext(int(finished.trace_id, 16), int(span_id, 16), is_remote=False, trace_flags=TraceFlags(TraceFlags.SAMPLED))
+
+        kinds = {"llm": SpanKind.CLIENT, "embedding": SpanKind.CLIENT, "db": SpanKind.CLIENT}
+        attributes = {
+            key: value if isinstance(value, (str, bool, int, float)) else json.dumps(value, default=str)
+            for key, value in finished.attributes.items()
+        }
+        attributes["span.kind"] = finished.kind
+        self.processor.on_end(ReadableSpan(
+            name=finished.name,
+            context=context(finished.span_id),
+            parent=context(finished.parent_id) if finished.parent_id else None,
+            resource=self.resource,
+            attributes=attributes,
+            kind=kinds.get(finished.kind, SpanKind.INTERNAL),
+            status=Status(StatusCode.ERROR if finished.status == "error" else StatusCode.OK),
+            start_time=int(finished.start * 1e9),
+            end_time=int(finished.end * 1e9),
+        ))
+
+
+class TraceCollector:
+    """
+    Keep finished spans in memory, grouped by trace, until they are taken for a waterfall summary.
+    """
+
+    def __init__(self):
+        self._traces: Dict[str, List[Span]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def export(self, finished: Span) -> None:
+        with self._lock:
+            self._traces[finished.trace_id].append(finished)
+
+    def take(self, trace_id: str) -> List[Span]:
+        """
+        Remove and return the spans of one trace.
+        """
+        with self._lock:
+            return self._traces.pop(trace_id, [])
+
+
+_exporters: Optional[List[Any]] = None
+_exporters_lock = threading.Lock()
+
+
+def get_exporters() -> List[Any]:
+    """
+    Return the span exporters, configured on first use from TRACE_JSONL_PATH and TRACE_OTLP_ENDPOINT.
+    """
+    global _exporters
+    with _exporters_lock:
+        if _exporters is None:
+            config = get_config()
+            _exporters = []
+            if config.get("TRACE_JSONL_PATH"):
+                _exporters.append(JsonlExporter(config["TRACE_JSONL_PATH"]))
+            if config.get("TRACE_OTLP_ENDPOINT"):
+                _exporters.append(OTelExporter.otlp(config["TRACE_OTLP_ENDPOINT"]))
+        return _exporters
+
+
+def add_exporter(exporter: Any) -> None:
+    """
+    Send every later finished span to this exporter as well.
+    """
+    get_exporters().append(exporter)
+
+
+def record_usage(current: Span, usage: Any) -> None:
+    """
+    Copy token counts from an OpenAI usage object or dictionary onto a span.
+    """
+    if usage is None:
+        return
+    get = usage.get if isinstance(usage, dict) else lambda key: getattr(usage, key, None)
+    current.set(prompt_tokens=get("prompt_tokens"), completion_tokens=get("completion_tokens"), total_tokens=get("total_tokens"))
+
+
+def format_waterfall(spans: List[Span], width: int = 40) -> str:
+    """
+    Render one trace as an indented waterfall with offsets, durations and key attributes,
+    followed by totals per kind of call.
+
+    :param spans: Finished spans of one trace, e.g. from TraceCollector.take.
+    :param width: Width of the timeline bars in characters.
+    :return: Multi-line text summary.
+    """
+    if not spans:
+        return ""
+    span_ids = {item.span_id for item in spans}
+    children: Dict[Optional[str], List[Span]] = defaultdict(list)
+    for item in spans:
+        children[item.parent_id if item.parent_id in span_ids else None].append(item)
+    origin = min(item.start for item in spans)
+    elapsed = max(item.end for item in spans) - origin or 1e-9
+
+    lines = []
+
+    def walk(item: Span, depth: int) -> None:
+        offset = item.start - origin
+        left = min(width - 1, int(offset / elapsed * width))
+        length = max(1, min(width - left, round(item.duration / elapsed * width)))
+        label = ("  " * depth + item.name)[:40]
+        details = " ".join(f"{key}={item.attributes[key]}" for key in WATERFALL_ATTRIBUTES if key in item.attributes)
+        lines.append(f"{label:<40} {offset * 1000:>9.1f}ms {item.duration * 1000:>9.1f}ms |{' ' * left}{'#' * length:<{width - left}}| {details}")
+        for child in sorted(children[item.span_id], key=lambda child: child.start):
+            walk(child, depth + 1)
+
+    for root in sorted(children[None], key=lambda root: root.start):
+        walk(root, 0)
+
+    totals: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+    for item in spans:
+        totals[item.kind][0] += 1
+        totals[item.kind][1] += item.duration
+    tokens = sum(item.attributes.get("total_tokens", 0) for item in spans if item.kind in ("llm", "embedding"))
+    lookups = [item for item in spans if item.name == "cache.lookup"]
+    embedding_caches = [item for item in spans if item.name == "embedding.cache"]
+    retrieval_lookups = [item for item in spans if item.name == "retrieval_cache.lookup"]
+    lines.append("")
+    for kind in ("llm", "embedding", "db"):
+        if kind in totals:
+            lines.append(f"{kind}: {int(totals[kind][0])} calls, {totals[kind][1] * 1000:.1f}ms in total")
+    lines.append(f"tokens: {tokens}")
+    if lookups:
+        hits = sum(1 for item in lookups if item.attributes.get("cache_hit"))
+        lines.append(f"response cache: {hits} hits of {len(lookups)} lookups")
+    if embedding_caches:
+        hits = sum(item.attributes.get("cache_hits", 0) for item in embedding_caches)
+        misses = sum(item.attributes.get("cache_misses", 0) for item in embedding_caches)
+        lines.append(f"embedding cache: {hits} hits, {misses} misses")
+    if retrieval_lookups:
+        hits = sum(1 for item in retrieval_lookups if item.attributes.get("cache_hit"))
+        lines.append(f"retrieval cache: {hits} hits of {len(retrieval_lookups)} lookups")
+    return "\n".join(lines)
@@ -0,0 +1,521 @@
+import json
+import math
+import random
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import text
+from Retrieve import get_engine
+from Tracing import span
+
+# Collections that get an ANN index
+COLLECTIONS = ["call_embeddings", "call_embeddings_detailed"]
+
+# Index build parameters; ef_search/probes are set per query instead (see search_session)
+DEFAULT_HNSW = {"m": 16, "ef_construction": 64}
+DEFAULT_EF_SEARCH = 40
+DEFAULT_PROBES = 10
+
+# An IVFFlat index is rebuilt once the collection has grown this much since its lists were chosen
+IVFFLAT_REBUILD_GROWTH = 2.0
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+
+# B-tree index used to fetch a shortlist's rows for exact search
+SERIAL_INDEX = f"{EMBEDDING_TABLE}_serial_number_idx"
+
+# Representation searched by an index: operator class, indexed expression, query expression and
+# distance operator. Quantized representations live only in the index; the rows keep the original
+# vectors, which rescore the quantized first pass. pgvector has no int8 type, so the scalar
+# option is half precision.
+QUANTIZATIONS = {
+    None: ("vector_cosine_ops", "{alias}embedding::vector({d})", "CAST({q} AS vector({d}))", "<=>"),
+    "halfvec": ("halfvec_cosine_ops", "{alias}embedding::halfvec({d})", "CAST({q} AS halfvec({d}))", "<=>"),
+    "binary": ("bit_hamming_ops", "binary_quantize({alias}embedding::vector({d}))::bit({d})", "binary_quantize(CAST({q} AS vector({d})))", "<~>"),
+}
+
+# Candidates taken from a quantized first pass per result kept after rescoring
+RESCORE_FACTOR = {"halfvec": 2, "binary": 10}
+
+
+@lru_cache(maxsize=None)
+def collection_info(connection_string: str, collection_name: str) -> Tuple[str, int]:
+    """
+    Look up a collection's id and embedding dimensions once per process.
+
+    Every collection shares langchain_pg_embedding, whose embedding column has no fixed
+    dimensions, so indexes are partial (one per collection) on a cast to vector(dimensions).
+    Searches must use the same collection_id literal and cast to be planned on the index.
+
+    :param connection_string: PGVector connection string.
+    :param collection_name: The collection name.
+    :return: (collection uuid, embedding dimensions).
+    """
+    query = text(f"""
+        SELECT c.uuid::text, (SELECT vector_dims(e.embedding) FROM {EMBEDDING_TABLE} e WHERE e.collection_id = c.uuid LIMIT 1)
+        FROM langchain_pg_collection c
+        WHERE c.name = :collection_name
+    """)
+    with get_engine(connection_string).connect() as conn:
+        row = conn.execute(query, {"collection_name": collection_name}).one_or_none()
+    if row is None or row[1] is None:
+        raise ValueError(f"Collection '{collection_name}' does not exist or is empty")
+    return row[0], int(row[1])
+
+
+def distance_sql(connection_string: str, collection_name: str, vector_param: str = ":vector", alias: str = "e") -> Tuple[str, str]:
+    """
+    Build the index-eligible distance expression and collection predicate for a search.
+
+    :return: (distance expression, WHERE predicate), e.g. for "ORDER BY {distance} LIMIT k".
+    """
+    collection_id, dimensions = collection_info(connection_string, collection_name)
+    distance = f"{alias}.embedding::vector({dimensions}) <=> CAST({vector_param} AS vector({dimensions}))"
+    return distance, f"{alias}.collection_id = '{collection_id}'"
+
+
+def quantized_distance_sql(connection_string: str, collection_name: str, quantization: Optional[str], vector_param: str = ":vector", alias: str = "e") -> str:
+    """
+    Build the first-pass distance expression a quantized index of the collection can serve.
+    """
+    _, dimensions = collection_info(connection_string, collection_name)
+    _, indexed, query, operator = QUANTIZATIONS[quantization]
+    return f"{indexed.format(alias=alias + '.', d=dimensions)} {operator} {query.format(q=vector_param, d=dimensions)}"
+
+
+def nearest_sql(connection_string: str, collection_name: str, columns: str, filters: str = "", limit: str = ":k", quantization: Optional[str] = None) -> str:
+    """
+    Build a SELECT of the columns and full-precision distance of the nearest rows of a collection,
+    nearest first. With a quantization, RESCORE_FACTOR times as many candidates are taken by
+    quantized distance and rescored with the original vectors.
+
+    :param columns: Select list over the alias "e", e.g. "e.id, e.document".
+    :param filters: Extra WHERE conditions starting with AND.
+    :param limit: LIMIT expression, usually a bound parameter.
+    :param quantization: None, "halfvec" or "binary", matching the collection's index.
+    """
+    distance, predicate = distance_sql(connection_string, collection_name)
+    if quantization is None:
+        return f"SELECT {columns}, {distance} AS distance FROM {EMBEDDING_TABLE} e WHERE {predicate} {filters} ORDER BY {distance} LIMIT {limit}"
+    first_pass = quantized_distance_sql(connection_string, collection_name, quantization)
+    return f"""
+        SELECT * FROM (
+            SELECT {columns}, {distance} AS distance FROM {EMBEDDING_TABLE} e
+            WHERE {predicate} {filters}
+            ORDER BY {first_pass}
+            LIMIT {RESCORE_FACTOR[quantization]} * {limit}
+        ) first_pass
+        ORDER BY distance
+        LIMIT {limit}
+    """
+
+
+def index_name(collection_name: str, quantization: Optional[str] = None) -> str:
+    return f"{collection_name}_embedding_{quantization + '_' if quantization else ''}ann_idx"
+
+
+def _row_count(conn: Any, collection_id: str) -> int:
+    return conn.execute(text(f"SELECT count(*) FROM {EMBEDDING_TABLE} WHERE collection_id = :collection_id"), {"collection_id": collection_id}).scalar()
+
+
+def ivfflat_lists(rows: int) -> int:
+    """
+    Number of IVFFlat lists for a collection size: rows / 1000 up to a million rows, sqrt(rows) beyond.
+    """
+    return max(10, rows // 1000 if rows <= 1_000_000 else int(math.sqrt(rows)))
+
+
+def create_index(connection_string: str, collection_name: str, method: str = "hnsw", m: int = DEFAULT_HNSW["m"], ef_construction: int = DEFAULT_HNSW["ef_construction"], lists: Optional[int] = None, replace: bool = False, quantization: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Build an HNSW or IVFFlat index on one collection's embeddings, without blocking writes.
+
+    :param connection_string: PGVector connection string.
+    :param collection_name: The collection to index.
+    :param method: "hnsw" or "ivfflat".
+    :param m: HNSW graph degree.
+    :param ef_construction: HNSW candidate list size while building.
+    :param lists: IVFFlat list count; by default chosen from the row count.
+    :param replace: Drop an existing index on the collection first.
+    :param quantization: None for cosine on full vectors, "halfvec" for cosine on half precision,
+                         "binary" for Hamming distance on sign bits.
+    :return: The build parameters, also stored as the index comment.
+    """
+    if method not in ("hnsw", "ivfflat"):
+        raise ValueError(f"Unknown index method '{method}'")
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization '{quantization}'")
+    collection_id, dimensions = collection_info(connection_string, collection_name)
+    name = index_name(collection_name, quantization)
+    operator_class, indexed, _, _ = QUANTIZATIONS[quantization]
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with get_engine(connection_string).connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        rows = _row_count(conn, collection_id)
+        if method == "hnsw":
+            options = {"m": m, "ef_construction": ef_construction}
+        else:
+            options = {"lists": lists or ivfflat_lists(rows)}
+        with_clause = ", ".join(f"{key} = {value}" for key, value in options.items())
+        if replace:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        start = time.perf_counter()
+        conn.execute(text(f"""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS {name}
+            ON {EMBEDDING_TABLE} USING {method} (({indexed.format(alias='', d=dimensions)})) {operator_class})
+            WITH ({with_clause})
+            WHERE collection_id = '{collection_id}'
+        """))
+        build = {"method": method, "quantization": quantization, "rows": rows, "dimensions": dimensions, **options, "build_seconds": round(time.perf_counter() - start, 3)}
+        conn.execute(text(f"COMMENT ON INDEX {name} IS '{json.dumps(build)}'"))
+        conn.execute(text(f"ANALYZE {EMBEDDING_TABLE}"))
+    return build
+
+
+def create_serial_index(connection_string: str) -> None:
+    """
+    Index rows by collection and serial number, so a shortlist's embeddings are fetched without a scan.
+    """
+    with get_engine(connection_string).connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS {SERIAL_INDEX}
+            ON {EMBEDDING_TABLE} (collection_id, (cmetadata->>'Serial Number'))
+        """))
+
+
+def drop_index(connection_string: str, collection_name: str, quantization: Optional[str] = None) -> None:
+    """
+    Drop a collection's ANN index, if any.
+    """
+    with get_engine(connection_string).connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name(collection_name, quantization)}"))
+
+
+def index_status(connection_string: str, collection_name: str, quantization: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Report a collection's ANN index: build parameters, current rows, size on disk and scans since the stats reset.
+
+    :return: None if the collection has no ANN index.
+    """
+    collection_id, _ = collection_info(connection_string, collection_name)
+    query = text("""
+        SELECT obj_description(i.indexrelid, 'pg_class'), pg_relation_size(i.indexrelid), s.idx_scan, i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        LEFT JOIN pg_stat_user_indexes s ON s.indexrelid = i.indexrelid
+        WHERE c.relname = :name
+    """)
+    with get_engine(connection_string).connect() as conn:
+        row = conn.execute(query, {"name": index_name(collection_name, quantization)}).one_or_none()
+        if row is None:
+            return None
+        rows = _row_count(conn, collection_id)
+    return {
+        "collection": collection_name,
+        "index": index_name(collection_name, quantization),
+        "build": json.loads(row[0]) if row[0] else {},
+        "rows": rows,
+        "size_mb": round(row[1] / 2 ** 20, 1),
+        "scans": row[2],
+        # A failed concurrent build leaves an invalid index behind
+        "valid": row[3],
+    }
+
+
+def maintain_indexes(connection_string: str, method: str = "hnsw", collections: Optional[List[str]] = None, quantization: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Bring the ANN indexes of the collections up to date: build missing ones, rebuild invalid
+    ones and IVFFlat indexes whose collection has outgrown their lists, then make sure the
+    serial number index exists and refresh statistics.
+
+    HNSW indexes stay current under inserts and are only rebuilt when invalid.
+
+    :param connection_string: PGVector connection string.
+    :param method: Method for indexes that are built from scratch.
+    :param collections: Collections to maintain; COLLECTIONS by default.
+    :param quantization: Which of each collection's indexes to maintain, see create_index.
+    :return: One action record per collection.
+    """
+    actions = []
+    for collection_name in collections or COLLECTIONS:
+        status = index_status(connection_string, collection_name, quantization)
+        if status is None:
+            actions.append({"collection": collection_name, "action": "created", **create_index(connection_string, collection_name, method, quantization=quantization)})
+            continue
+        build = status["build"]
+        stale = build.get("method") == "ivfflat" and status["rows"] > IVFFLAT_REBUILD_GROWTH * max(1, build.get("rows", 0))
+        if not status["valid"] or stale:
+            options = {"m": build["m"], "ef_construction": build["ef_construction"]} if build.get("method") == "hnsw" else {}
+            rebuilt = create_index(connection_string, collection_name, build.get("method", method), replace=True, quantization=quantization, **options)
+            actions.append({"collection": collection_name, "action": "rebuilt", **rebuilt})
+        else:
+            actions.append({"collection": collection_name, "action": "unchanged", **build, "rows": status["rows"]})
+    create_serial_index(connection_string)
+    with get_engine(connection_string).connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"VACUUM ANALYZE {EMBEDDING_TABLE}"))
+    return actions
+
+
+@contextmanager
+def search_session(connection_string: str, ef_search: Optional[int] = None, probes: Optional[int] = None, exact: bool = False) -> Iterator[Any]:
+    """
+    Open a transaction whose searches use the given ANN settings, reset when it ends.
+
+    :param connection_string: PGVector connection string.
+    :param ef_search: HNSW candidate list size; higher is slower with better recall.
+    :param probes: IVFFlat lists scanned; higher is slower with better recall.
+    :param exact: Disable index scans, for exact search as the recall baseline.
+    :return: The connection to run the searches on.
+    """
+    with get_engine(connection_string).begin() as conn:
+        if ef_search is not None:
+            conn.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+        if probes is not None:
+            conn.execute(text(f"SET LOCAL ivfflat.probes = {int(probes)}"))
+        if exact:
+            conn.execute(text("SET LOCAL enable_indexscan = off"))
+        yield conn
+
+
+def nearest_ids(conn: Any, connection_string: str, collection_name: str, vector: List[float], k: int, quantization: Optional[str] = None) -> List[str]:
+    """
+    Return the ids of the k nearest embeddings in a collection, using its ANN index when the session allows.
+    """
+    query = text(f"SELECT id FROM ({nearest_sql(connection_string, collection_name, 'e.id::text AS id', quantization=quantization)}) nearest")
+    with span("pgvector.ann", "db", collection=collection_name, k=k, quantization=quantization) as current:
+        ids = [row[0] for row in conn.execute(query, {"vector": "[" + ",".join(map(str, vector)) + "]", "k": k})]
+        current.set(rows=len(ids))
+    return ids
+
+
+def _sample_vectors(connection_string: str, collection_name: str, count: int, seed: float) -> List[List[float]]:
+    # Stored embeddings as queries, sampled reproducibly
+    collection_id, _ = collection_info(connection_string, collection_name)
+    with get_engine(connection_string).begin() as conn:
+        conn.execute(text("SELECT setseed(:seed)"), {"seed": seed})
+        rows = conn.execute(text(f"""
+            SELECT e.embedding::text FROM {EMBEDDING_TABLE} e
+            WHERE e.collection_id = :collection_id ORDER BY random() LIMIT :count
+        """), {"collection_id": collection_id, "count": count}).fetchall()
+    return [[float(value) for value in row[0][1:-1].split(",")] for row in rows]
+
+
+def _percentile(ordered: List[float], p: float) -> float:
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def benchmark_recall(connection_string: str, collection_name: str, settings: List[Dict[str, int]], queries: int = 100, k: int = 10, seed: float = 0.42) -> Dict[str, Any]:
+    """
+    Measure recall@k and latency of ANN search against exact search for several settings.
+
+    :param connection_string: PGVector connection string.
+    :param collection_name: The collection to search.
+    :param settings: Search settings to compare, e.g. [{"ef_search": 40}, {"ef_search": 100}] or [{"probes": 10}],
+                     optionally with a "quantization" to search that index with rescoring.
+    :param queries: Number of stored embeddings used as queries.
+    :param k: Neighbours per query.
+    :param seed: Seed for sampling the query embeddings.
+    :return: Collection size, the exact baseline latency and, per setting, mean recall and latency percentiles in ms.
+    """
+    vectors = _sample_vectors(connection_string, collection_name, queries, seed)
+
+    def run(quantization: Optional[str] = None, **session: Any) -> Tuple[List[List[str]], Dict[str, float]]:
+        results, latencies = [], []
+        for vector in vectors:
+            with search_session(connection_string, **session) as conn:
+                start = time.perf_counter()
+                results.append(nearest_ids(conn, connection_string, collection_name, vector, k, quantization))
+                latencies.append(time.perf_counter() - start)
+        ordered = sorted(latencies)
+        return results, {f"p{p}_ms": round(1000 * _percentile(ordered, p), 2) for p in (50, 95, 99)}
+
+    exact, exact_latency = run(exact=True)
+    report = {"collection": collection_name, "status": index_status(connection_string, collection_name), "queries": len(vectors), "k": k, "exact": exact_latency, "settings": []}
+    for setting in settings:
+        approximate, latency = run(**setting)
+        recall = sum(len(set(found) & set(truth)) / max(1, len(truth)) for found, truth in zip(approximate, exact)) / max(1, len(exact))
+        report["settings"].append({**setting, "recall": round(recall, 4), **latency})
+    return report
+
+
+def migrate_quantization(connection_string: str, quantization: str, collections: Optional[List[str]] = None, method: str = "hnsw", search: Optional[Dict[str, int]] = None, queries: int = 100, k: int = 10, max_recall_drop: float = 0.01, drop_full: bool = False) -> List[Dict[str, Any]]:
+    """
+    Move collections to quantized first-pass search: build the quantized index, measure it with
+    rescoring against the current full-precision index and exact search, and optionally drop
+    the full-precision index when recall holds.
+
+    Set VECTOR_QUANTIZATION to the same value afterwards so searches use the new index.
+
+    :param connection_string: PGVector connection string.
+    :param quantization: "halfvec" or "binary".
+    :param collections: Collections to migrate; COLLECTIONS by default.
+    :param method: "hnsw" or "ivfflat" for the quantized index.
+    :param search: Search setting both indexes are compared at; ef_search or probes at their defaults.
+    :param queries: Number of stored embeddings used as queries.
+    :param k: Neighbours per query.
+    :param max_recall_drop: Largest recall loss against the full-precision index that still allows dropping it.
+    :param drop_full: Drop the full-precision index when the quantized one is within max_recall_drop.
+    :return: One report per collection with index sizes, recall and latency of both indexes.
+    """
+    if quantization not in RESCORE_FACTOR:
+        raise ValueError(f"Unknown quantization '{quantization}'")
+    search = search or ({"ef_search": DEFAULT_EF_SEARCH} if method == "hnsw" else {"probes": DEFAULT_PROBES})
+    reports = []
+    for collection_name in collections or COLLECTIONS:
+        if index_status(connection_string, collection_name, quantization) is None:
+            create_index(connection_string, collection_name, method, quantization=quantization)
+        full = index_status(connection_string, collection_name)
+        quantized = index_status(connection_string, collection_name, quantization)
+
+        settings = [{**search, "quantization": quantization}]
+        if full is not None:
+            settings.insert(0, dict(search))
+        benchmark = benchmark_recall(connection_string, collection_name, settings, queries, k)
+        full_result, quantized_result = (benchmark["settings"] if full is not None else [None, benchmark["settings"][0]])
+
+        report = {
+            "collection": collection_name,
+            "quantization": quantization,
+            "full_index_mb": full["size_mb"] if full else None,
+            "quantized_index_mb": quantized["size_mb"],
+            "exact": benchmark["exact"],
+            "full": full_result,
+            "quantized": quantized_result,
+            "dropped_full_index": False,
+        }
+        if drop_full and full_result is not None and quantized_result["recall"] >= full_result["recall"] - max_recall_drop:
+            drop_index(connection_string, collection_name)
+            report["dropped_full_index"] = True
+        reports.append(report)
+    return reports
+
+
+def choose_setting(report: Dict[str, Any], target_recall: float = 0.95) -> Optional[Dict[str, Any]]:
+    """
+    Pick the fastest benchmarked setting (by p95) that reaches the target recall.
+    """
+    eligible = [setting for setting in report["settings"] if setting["recall"] >= target_recall]
+    return min(eligible, key=lambda setting: setting["p95_ms"]) if eligible else None
+
+
+def benchmark_shortlists(connection_string: str, call_collection: str, chunk_collection: str, sizes: List[int], queries: int = 20, target_recall: float = 0.95, seed: int = 42) -> Dict[str, Any]:
+    """
+    Compare the exact and ANN plans of Filtering.search_transcripts_sql under shortlists of several sizes.
+
+    The exact plan is the reference: for each size the ANN plan's recall is the share of the
+    exact plan's chunks it also returns, and its completeness the ratio of chunks returned.
+
+    :param connection_string: PGVector connection string.
+    :param call_collection: Collection searched first, as in the pipeline.
+    :param chunk_collection: Collection the chunks come from.
+    :param sizes: Shortlist sizes in calls.
+    :param queries: Queries per size, stored embeddings of call_collection.
+    :param target_recall: Recall the ANN plan must reach to be preferred.
+    :param seed: Seed for sampling queries and shortlists.
+    :return: Latency percentiles in ms, recall and completeness per size, and the suggested
+             EXACT_SEARCH_MAX_SHORTLIST.
+    """
+    from Filtering import search_transcripts_sql
+
+    collection_id, _ = collection_info(connection_string, call_collection)
+    with get_engine(connection_string).connect() as conn:
+        serials = [row[0] for row in conn.execute(text(f"""
+            SELECT DISTINCT cmetadata->>'Serial Number' FROM {EMBEDDING_TABLE}
+            WHERE collection_id = :collection_id AND cmetadata->>'Serial Number' IS NOT NULL
+        """), {"collection_id": collection_id})]
+    vectors = _sample_vectors(connection_string, call_collection, queries, seed / 100)
+    rng = random.Random(seed)
+
+    def timed(plan: str, vector: List[float], shortlist: List[str]) -> Tuple[float, List[Tuple[str, str]]]:
+        start = time.perf_counter()
+        documents = search_transcripts_sql(connection_string, call_collection, chunk_collection, vector, shortlist, plan=plan)
+        return time.perf_counter() - start, [(document.metadata.get("Serial Number"), document.page_content) for document in documents]
+
+    report = {"call_collection": call_collection, "chunk_collection": chunk_collection, "serials": len(serials), "sizes": []}
+    for size in sizes:
+        latencies: Dict[str, List[float]] = {"exact": [], "ann": []}
+        recalls, completeness = [], []
+        for vector in vectors:
+            shortlist = rng.sample(serials, min(size, len(serials)))
+            exact_seconds, exact = timed("exact", vector, shortlist)
+            ann_seconds, approximate = timed("ann", vector, shortlist)
+            latencies["exact"].append(exact_seconds)
+            latencies["ann"].append(ann_seconds)
+            if exact:
+                recalls.append(len(set(exact) & set(approximate)) / len(exact))
+                completeness.append(len(approximate) / len(exact))
+        row = {"shortlist": size}
+        for plan, values in latencies.items():
+            ordered = sorted(values)
+            row.update({f"{plan}_p50_ms": round(1000 * _percentile(ordered, 50), 2), f"{plan}_p95_ms": round(1000 * _percentile(ordered, 95), 2)})
+        row["ann_recall"] = round(sum(recalls) / len(recalls), 4) if recalls else None
+        row["ann_completeness"] = round(sum(completeness) / len(completeness), 4) if completeness else None
+        report["sizes"].append(row)
+
+    # Search exactly up to the largest size where exact search is faster or ANN misses results
+    exact_preferred = [
+        row["shortlist"] for row in report["sizes"]
+        if row["exact_p95_ms"] <= row["ann_p95_ms"] or (row["ann_recall"] is not None and row["ann_recall"] < target_recall)
+    ]
+    report["suggested_exact_max_shortlist"] = max(exact_preferred) if exact_preferred else 0
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from Settings import get_config
+
+    parser = argparse.ArgumentParser(description="Build, maintain and benchmark ANN indexes on the PGVector collections")
+    parser.add_argument("command", choices=["create", "drop", "status", "maintain", "benchmark", "shortlists", "quantize"])
+    parser.add_argument("--collection", action="append", help="Collection to act on; repeatable. Defaults to both call collections. For shortlists, the searched and the fetched collection")
+    parser.add_argument("--method", choices=["hnsw", "ivfflat"], default="hnsw")
+    parser.add_argument("--m", type=int, default=DEFAULT_HNSW["m"])
+    parser.add_argument("--ef-construction", type=int, default=DEFAULT_HNSW["ef_construction"])
+    parser.add_argument("--lists", type=int, help="IVFFlat lists; chosen from the row count by default")
+    parser.add_argument("--replace", action="store_true", help="Rebuild an existing index")
+    parser.add_argument("--quantization", choices=["halfvec", "binary"], help="Act on the quantized index instead of the full-precision one")
+    parser.add_argument("--drop-full", action="store_true", help="With quantize, drop the full-precision index when recall holds")
+    parser.add_argument("--max-recall-drop", type=float, default=0.01)
+    parser.add_argument("--ef-search", default="10,20,40,80,160", help="Comma-separated hnsw.ef_search values to benchmark")
+    parser.add_argument("--probes", default="1,5,10,20,40", help="Comma-separated ivfflat.probes values to benchmark")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--sizes", default="10,25,50,100,250,1000,5000", help="Comma-separated shortlist sizes for the shortlists benchmark")
+    args = parser.parse_args()
+
+    connection_string = get_config()["PGVECTOR_CONNECTION_STRING"]
+    collections = args.collection or COLLECTIONS
+    if args.command == "create":
+        for name in collections:
+            print(json.dumps({"collection": name, **create_index(connection_string, name, args.method, args.m, args.ef_construction, args.lists, args.replace, args.quantization)}))
+        create_serial_index(connection_string)
+    elif args.command == "drop":
+        for name in collections:
+            drop_index(connection_string, name, args.quantization)
+    elif args.command == "status":
+        for name in collections:
+            print(json.dumps(index_status(connection_string, name, args.quantization) or {"collection": name, "index": None}))
+    elif args.command == "maintain":
+        for action in maintain_indexes(connection_string, args.method, collections, args.quantization):
+            print(json.dumps(action))
+    elif args.command == "quantize":
+        if args.quantization is None:
+            parser.error("quantize needs --quantization")
+        for report in migrate_quantization(connection_string, args.quantization, collections, args.method, queries=args.queries, k=args.k, max_recall_drop=args.max_recall_drop, drop_full=args.drop_full):
+            print(json.dumps(report, indent=2))
+    elif args.command == "shortlists":
+        # main and Pipeline pass vectorstore_embeddings (call_embeddings_detailed) to search_serial_documents
+        # as the store searched for serials, and vectorstore_metadata (call_embeddings) as the one chunks come from
+        call_collection, chunk_collection = args.collection[:2] if args.collection and len(args.collection) >= 2 else ("call_embeddings_detailed", "call_embeddings")
+        sizes = [int(size) for size in args.sizes.split(",")]
+        print(json.dumps(benchmark_shortlists(connection_string, call_collection, chunk_collection, sizes, args.queries, args.target_recall), indent=2))
+    else:
+        for name in collections:
+            status = index_status(connection_string, name, args.quantization) or {}
+            method = status.get("build", {}).get("method", args.method)
+            key, values = ("ef_search", args.ef_search) if method == "hnsw" else ("probes", args.probes)
+            settings = [{key: int(value), "quantization": args.quantization} for value in values.split(",")]
+            report = benchmark_recall(connection_string, name, settings, args.queries, args.k)
+            report["recommended"] = choose_setting(report, args.target_recall)
+            print(json.dumps(report, indent=2, default=str))
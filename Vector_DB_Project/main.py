@@ -1,44 +1,102 @@
 import asyncio
-from Query_Analysis import analyze_query
-from Filtering import retrieve_serial_numbers, search_serial_numbers
-from Retrieve import counter_documents
-from Decider import module_chooser
-from Analysis import general_analysis,detailed_analysis
-from Reporting import pointers,summary
-from config import load_config
-from langchain.vectorstores import PGVector
-from langchain.embeddings.openai import OpenAIEmbeddings
+from Filtering import retrieve_serial_numbers, retrieve_serial_numbers_sql, search_serial_documents
+from Analysis import map_reduce_analysis
+from Reporting import pointers,summary,report_analysis
+from Settings import get_config
+from Pipeline import answer_batch, astream_answer, build_vector_stores, count_reasons, plan_question
+from Budget import QueryBudget, new_budget, query_budget
+from Tracing import JsonlExporter, TraceCollector, add_exporter, format_waterfall, span
 from typing import List
+import argparse
+import json
 import warnings
 
 warnings.filterwarnings("ignore")
 
-async def main():
+async def main(mode: str = "serial", max_concurrency: int = 4, counting: str = "sql", trace: bool = False, trace_file: str = None, questions_file: str = None, output: str = None):
+    # Spans go to the JSONL file and, for the waterfall summary, to memory
+    collector = TraceCollector()
+    if trace:
+        add_exporter(collector)
+    if trace_file:
+        add_exporter(JsonlExporter(trace_file))
+
+    if questions_file:
+        batch = await answer_questions_file(questions_file, output, max_concurrency, counting)
+        if trace:
+            print(format_waterfall(collector.take(batch["trace_id"])))
+        print(json.dumps(batch, indent=2))
+        return
+
+    budget = new_budget()
+    with span("main", "stage", mode=mode) as root:
+        await answer(mode, max_concurrency, counting, budget)
+    if trace:
+        print(format_waterfall(collector.take(root.trace_id)))
+    print(json.dumps(budget.accounting(), indent=2))
+
+
+async def answer(mode: str, max_concurrency: int, counting: str, budget: QueryBudget):
     # Load configuration and initialize vector stores
-    config = load_config()
-    embedding_model = OpenAIEmbeddings(openai_api_key=config['OPENAI_API_KEY'], model="text-embedding-ada-002")
-    
-    vectorstore_metadata = PGVector(
-        embedding_function=embedding_model,
-        connection_string=config['PGVECTOR_CONNECTION_STRING'],
-        collection_name="call_embeddings"
-    )
-
-    vectorstore_embeddings = PGVector(
-        embedding_function=embedding_model,
-        connection_string=config['PGVECTOR_CONNECTION_STRING'],
-        collection_name="call_embeddings_detailed"
-    )
-
-    # Analyze the question and determine sub-queries and routing
+    config = get_config()
+    vectorstore_metadata, vectorstore_embeddings = build_vector_stores(config)
+
     question = "No of calls where call duration is more than 600 seconds"
-    sub_queries = analyze_query(question)
-    print(sub_queries)
-    
-    module = module_chooser(sub_queries)
-    print(module)
-    final_response_format = module_chooser([question])
-    print(final_response_format)
+
+    # In dag mode independent sub-query branches run concurrently and the report is streamed
+    if mode == "dag":
+        async for event in astream_answer(question, vectorstore_metadata, vectorstore_embeddings, max_concurrency, config['PGVECTOR_CONNECTION_STRING'], counting, budget):
+            if event["event"] == "token":
+                print(event["text"], end="", flush=True)
+            elif event["event"] == "done":
+                print()
+            elif event["event"] != "report_started":
+                print(event)
+        return
+
+    await answer_serial(question, vectorstore_metadata, vectorstore_embeddings, budget, config['PGVECTOR_CONNECTION_STRING'], counting)
+
+
+def read_questions(path: str) -> List[str]:
+    # One question per line, either plain text or a JSON object with a "question" key
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("{"):
+                questions.append(json.loads(line)["question"])
+            elif line:
+                questions.append(line)
+    return questions
+
+
+async def answer_questions_file(questions_file: str, output: str, max_concurrency: int, counting: str):
+    # Plan every question together and share filtering, search and analysis between them
+    config = get_config()
+    vectorstore_metadata, vectorstore_embeddings = build_vector_stores(config)
+    records, batch = await answer_batch(read_questions(questions_file), vectorstore_metadata, vectorstore_embeddings, max_concurrency, config['PGVECTOR_CONNECTION_STRING'], counting)
+
+    lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(lines)
+    else:
+        print(lines, end="")
+    return batch
+
+
+async def answer_serial(question: str, vectorstore_metadata, vectorstore_embeddings, budget: QueryBudget = None, connection_string: str = None, counting: str = "sql"):
+    # Every OpenAI call is charged to the question's budget, and the analyses and the report
+    # degrade as it runs out, as in dag mode; by default a new budget from the configuration.
+    # With a connection string, filtering, search and counting run in SQL as in dag mode
+    with query_budget(budget):
+        await _answer_serial(question, vectorstore_metadata, vectorstore_embeddings, connection_string, counting)
+
+
+async def _answer_serial(question: str, vectorstore_metadata, vectorstore_embeddings, connection_string: str = None, counting: str = "sql"):
+    # Analyze the question and determine sub-queries and routing: one structured call, or
+    # decomposition plus the local router when ROUTER_PATH is configured
+    sub_queries, module, final_response_format = await plan_question(question)
     # Initialize the dictionaries for each function type
     filtering_function = {}
     analysis_function = {}
@@ -75,10 +133,6 @@ async def main():
             reporting_function[reporting_key] = []
         reporting_function[reporting_key].append(query)
     
-    print(filtering_function)
-    print(analysis_function)
-    print(reporting_function)
-    
     shortlisted_id_metadata = []
     metadata_summary = {}
     relevant_transcripts = {}
@@ -86,40 +140,59 @@ async def main():
     counts = {}
     counts_detailed ={}
     if 'metadata_filtering' in filtering_function and filtering_function['metadata_filtering']:
-        shortlisted_id_metadata,metadata_summary = retrieve_serial_numbers(filtering_function['metadata_filtering'], vectorstore_metadata)
+        with span("metadata", "stage") as current:
+            if connection_string:
+                shortlisted_id_metadata,metadata_summary = retrieve_serial_numbers_sql(filtering_function['metadata_filtering'], vectorstore_metadata, connection_string)
+            else:
+                shortlisted_id_metadata,metadata_summary = retrieve_serial_numbers(filtering_function['metadata_filtering'], vectorstore_metadata)
+            current.set(shortlisted=len(shortlisted_id_metadata))
     if 'transcript_filtering' in filtering_function and filtering_function['transcript_filtering']:
-        relevant_transcripts = await search_serial_numbers(vectorstore_embeddings,vectorstore_metadata,filtering_function['transcript_filtering'],shortlisted_id_metadata)
+        with span("search", "stage"):
+            relevant_transcripts = await search_serial_documents(vectorstore_embeddings,vectorstore_metadata,filtering_function['transcript_filtering'],shortlisted_id_metadata,connection_string)
+    # Reasons are counted among the metadata shortlist the searches were scoped to, if there was one
+    count_scope = shortlisted_id_metadata if filtering_function.get('metadata_filtering') else None
     if 'general_analysis' in analysis_function and analysis_function['general_analysis']: 
         for query in analysis_function['general_analysis']:
             if query in metadata_summary:
                 metadata_summary.pop(query)
-            relevant_docs = relevant_transcripts[query]
-            analysis = general_analysis(query,relevant_docs)
-            counts = counter_documents(analysis, vectorstore_metadata)
+            relevant_docs = relevant_transcripts.get(query, [])
+            # Transcripts are analysed in token-budgeted batches, as in dag mode
+            with span("analysis", "stage", node=query):
+                analysis = map_reduce_analysis(query,relevant_docs,False)
+            with span("count", "stage", node=query):
+                counts = count_reasons(analysis, vectorstore_metadata, connection_string, counting, count_scope)
             analysis_collection = analysis_collection + analysis
     if 'detailed_analysis' in analysis_function and analysis_function['detailed_analysis']: 
         for query in analysis_function['detailed_analysis']:
             if query in metadata_summary:
                 metadata_summary.pop(query)
-            relevant_docs = relevant_transcripts[query]
-            analysis = detailed_analysis(query,relevant_docs)
-            counts_detailed = counter_documents(analysis, vectorstore_metadata)
+            relevant_docs = relevant_transcripts.get(query, [])
+            # Transcripts are analysed in token-budgeted batches, as in dag mode
+            with span("analysis", "stage", node=query):
+                analysis = map_reduce_analysis(query,relevant_docs,True)
+            with span("count", "stage", node=query):
+                counts_detailed = count_reasons(analysis, vectorstore_metadata, connection_string, counting, count_scope)
             analysis_collection = analysis_collection + analysis
     
-    print('length of shortlisted')
-    print(shortlisted_id_metadata)
     counts.update(counts_detailed)
-    metadata_analysis = ''.join(metadata_summary.values())
-    analysis_collection = analysis_collection + metadata_analysis
-    print('Analysis Done')
-    print('Reporting process starts')
-    if 'Summary' in reporting_function_final and reporting_function_final['Summary']:
-        final_output = summary(question,analysis_collection,counts,70)
-    if 'Pointers' in reporting_function_final and reporting_function_final['Pointers']:
-        final_output = pointers(question,analysis_collection,counts,70)
+    analysis_collection = report_analysis(analysis_collection, list(metadata_summary.values()))
+    with span("report", "stage"):
+        if 'Summary' in reporting_function_final and reporting_function_final['Summary']:
+            final_output = summary(question,analysis_collection,counts,70)
+        if 'Pointers' in reporting_function_final and reporting_function_final['Pointers']:
+            final_output = pointers(question,analysis_collection,counts,70)
     
     print(final_output)
 
 # Run the main function in an asynchronous environment
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["serial", "dag"], default="serial", help="Run stages one after another or as a concurrent dependency graph")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Maximum concurrent LLM/database calls in dag mode")
+    parser.add_argument("--counting", choices=["sql", "assign"], default="sql", help="Per-reason threshold counts or exclusive best-reason assignment")
+    parser.add_argument("--trace", action="store_true", help="Print a waterfall of LLM, embedding and database spans after the answer")
+    parser.add_argument("--trace-file", help="Append every span to this JSON lines file")
+    parser.add_argument("--questions", help="Answer every question in this file (one per line) as a batch with shared planning and retrieval")
+    parser.add_argument("--output", help="Write the batch answers to this JSON lines file instead of stdout")
+    args = parser.parse_args()
+    asyncio.run(main(args.mode, args.max_concurrency, args.counting, args.trace, args.trace_file, args.questions, args.output))
@@ -0,0 +1,37 @@
+import os
+import re
+import sys
+
+import pytest
+
+# The modules live at the project root and import each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from OpenAI_Client import set_encoding
+from Settings import set_config
+
+
+class WordEncoding:
+    """
+    Stand-in for the cl100k encoding, which tiktoken downloads on first use: one token per
+    word with its trailing whitespace, so decoding a prefix gives an exact prefix of the text.
+    """
+
+    def encode(self, text, disallowed_special=()):
+        return re.findall(r"\S+\s*|\s+", text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+@pytest.fixture(autouse=True)
+def offline():
+    set_config({
+        "OPENAI_API_KEY": "test",
+        "RESPONSE_CACHE_PATH": ":memory:",
+        "EMBEDDING_CACHE_PATH": ":memory:",
+        "RETRIEVAL_CACHE_PATH": ":memory:",
+    })
+    set_encoding(WordEncoding())
+    yield
+    set_encoding(None)
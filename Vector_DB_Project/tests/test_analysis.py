@@ -0,0 +1,62 @@
+from langchain_core.documents import Document
+
+from Analysis import metadata_frame, pack_transcripts
+from OpenAI_Client import estimate_tokens
+
+
+def chunk(serial_number, words, word="w"):
+    return Document(page_content=" ".join([word] * words), metadata={"Serial Number": serial_number})
+
+
+def calls_in(batch):
+    return [line for line in batch.split("\n") if line.startswith("[Call ")]
+
+
+def test_calls_that_fit_are_never_split():
+    documents = [chunk("A", 4), chunk("B", 3), chunk("B", 3), chunk("C", 2)]
+    batches = pack_transcripts(documents, max_tokens=10)
+    # A takes 6 of 10 tokens, so B (8) starts a new batch whole instead of being split across two
+    assert [calls_in(batch) for batch in batches] == [["[Call A]"], ["[Call B]"], ["[Call C]"]]
+    assert batches[1] == "[Call B]\nw w w\nw w w"
+
+
+def test_small_calls_share_a_batch():
+    documents = [chunk("A", 2), chunk("B", 2), chunk("C", 2)]
+    assert pack_transcripts(documents, max_tokens=20) == ["[Call A]\nw w\n[Call B]\nw w\n[Call C]\nw w"]
+
+
+def test_chunks_are_grouped_by_call_in_first_seen_order():
+    documents = [chunk("A", 1, "a1"), chunk("B", 1, "b1"), chunk("A", 1, "a2")]
+    assert pack_transcripts(documents, max_tokens=20) == ["[Call A]\na1\na2\n[Call B]\nb1"]
+
+
+def test_only_calls_larger_than_the_budget_are_split_with_their_label_repeated():
+    documents = [chunk("A", 2), chunk("B", 5, "x"), chunk("B", 5, "y"), chunk("C", 2)]
+    batches = pack_transcripts(documents, max_tokens=8)
+    assert batches == [
+        "[Call A]\nw w",
+        "[Call B]\nx x x x x",
+        "[Call B]\ny y y y y",
+        "[Call C]\nw w",
+    ]
+
+
+def test_a_chunk_larger_than_the_budget_is_truncated():
+    batches = pack_transcripts([chunk("A", 50)], max_tokens=10)
+    assert len(batches) == 1
+    assert estimate_tokens(batches[0]) <= 10
+
+
+def test_special_tokens_in_transcripts_are_plain_text():
+    documents = [Document(page_content="caller said <|endoftext|> then hung up", metadata={"Serial Number": "A"})]
+    assert pack_transcripts(documents) == ["[Call A]\ncaller said <|endoftext|> then hung up"]
+
+
+def test_metadata_frame_parses_booleans_from_any_spelling():
+    flags = [True, "True", "yes", 1, "1", False, "False", "no", 0, None]
+    frame = metadata_frame([{"Opportunity Created": flag, "Call Length": "61.5"} for flag in flags])
+    assert str(frame["Opportunity Created"].dtype) == "boolean"
+    assert frame["Opportunity Created"].tolist()[:-1] == [True] * 5 + [False] * 4
+    assert frame["Opportunity Created"].isna().tolist() == [False] * 9 + [True]
+    assert frame["Business Created"].isna().all()
+    assert frame["Call Length"].tolist() == [61.5] * len(flags)
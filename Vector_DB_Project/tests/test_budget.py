@@ -0,0 +1,88 @@
+import contextvars
+from types import SimpleNamespace
+
+import pytest
+
+from Budget import (
+    CHEAPER_MODEL, FEWER_TRANSCRIPTS, NORMAL, TRUNCATED_SUMMARIES,
+    QueryBudget, charge, current_budget, new_budget, query_budget,
+)
+from Settings import set_config
+
+
+def test_charge_accepts_usage_dictionaries_and_objects():
+    budget = QueryBudget()
+    budget.charge("gpt-4o", {"prompt_tokens": 1000, "completion_tokens": 200})
+    budget.charge("gpt-4o", SimpleNamespace(prompt_tokens=500, completion_tokens=None))
+    budget.charge("gpt-4o-mini", None)
+    assert budget.tokens == 1700
+    assert budget.spent == pytest.approx((1500 * 5.0 + 200 * 15.0) / 1e6)
+    assert budget.by_model == {"gpt-4o": {"calls": 2, "prompt_tokens": 1500, "completion_tokens": 200}}
+
+
+def test_level_steps_through_the_thresholds_of_the_tighter_limit():
+    budget = QueryBudget(max_tokens=1000)
+    assert budget.level("gpt-4o", 500) == NORMAL
+    assert budget.level("gpt-4o", 600) == FEWER_TRANSCRIPTS
+    assert budget.level("gpt-4o", 700, 100) == CHEAPER_MODEL
+    budget.charge("gpt-4o", {"prompt_tokens": 900, "completion_tokens": 0})
+    assert budget.level("gpt-4o", 0) == TRUNCATED_SUMMARIES
+
+
+def test_cost_limit_uses_model_prices():
+    budget = QueryBudget(max_cost=1.0, prices={"cheap": (1.0, 1.0)})
+    # One million tokens of the default gpt-4o price is five times the budget; the same on "cheap" is all of it
+    assert budget.pressure("gpt-4o", 1_000_000) == pytest.approx(5.0)
+    assert budget.pressure("cheap", 500_000) == pytest.approx(0.5)
+    assert budget.level("cheap", 500_000) == NORMAL
+
+
+def test_without_limits_the_budget_only_accounts():
+    budget = QueryBudget()
+    budget.charge("gpt-4o", {"prompt_tokens": 10 ** 9, "completion_tokens": 0})
+    assert budget.level("gpt-4o", 10 ** 9) == NORMAL
+    assert budget.headroom("gpt-4o", 1000) == 2 ** 31
+
+
+def test_headroom_is_the_prompt_left_before_a_step():
+    budget = QueryBudget(max_tokens=1000)
+    budget.charge("gpt-4o", {"prompt_tokens": 300, "completion_tokens": 0})
+    assert budget.headroom("gpt-4o", 100) == 200
+    assert budget.headroom("gpt-4o", 100, CHEAPER_MODEL) == 400
+    budget.charge("gpt-4o", {"prompt_tokens": 500, "completion_tokens": 0})
+    assert budget.headroom("gpt-4o", 100) == 0
+
+
+def test_accounting_reports_usage_limits_and_degradations():
+    budget = QueryBudget(max_tokens=5000, max_cost=0.5)
+    budget.charge("gpt-4o-mini", {"prompt_tokens": 1000, "completion_tokens": 1000})
+    budget.degrade("cheaper_model")
+    assert budget.accounting() == {
+        "prompt_tokens": 1000,
+        "completion_tokens": 1000,
+        "total_tokens": 2000,
+        "cost_usd": 0.00075,
+        "max_tokens": 5000,
+        "max_cost_usd": 0.5,
+        "by_model": {"gpt-4o-mini": {"calls": 1, "prompt_tokens": 1000, "completion_tokens": 1000, "cost_usd": 0.00075}},
+        "degradations": ["cheaper_model"],
+    }
+
+
+def test_new_budget_reads_the_configuration():
+    set_config({"QUERY_TOKEN_BUDGET": "2000", "BUDGET_DEGRADE_AT": "[0.5, 0.7, 0.95]", "MODEL_PRICES": '{"gpt-4o": [2.5, 10]}'})
+    budget = new_budget()
+    assert budget.max_tokens == 2000
+    assert budget.max_cost is None
+    assert budget.degrade_at == (0.5, 0.7, 0.95)
+    assert budget.prices["gpt-4o"] == (2.5, 10)
+
+
+def test_query_budget_scopes_charges_to_the_block_and_copied_contexts():
+    assert current_budget() is None
+    charge("gpt-4o", {"prompt_tokens": 10, "completion_tokens": 0})
+    with query_budget(QueryBudget()) as budget:
+        charge("gpt-4o", {"prompt_tokens": 10, "completion_tokens": 5})
+        contextvars.copy_context().run(charge, "gpt-4o-mini", {"prompt_tokens": 1, "completion_tokens": 1})
+    assert current_budget() is None
+    assert budget.tokens == 17
@@ -0,0 +1,96 @@
+import pytest
+from pydantic import BaseModel
+
+import Cache
+from Cache import ResponseCache, make_key, schema_digest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(Cache.time, "time", clock)
+    return clock
+
+
+def test_key_covers_model_messages_and_params():
+    messages = [{"role": "user", "content": "hello"}]
+    key = make_key("gpt-4o", messages, {"temperature": 0, "max_tokens": 10})
+    assert make_key("gpt-4o", messages, {"max_tokens": 10, "temperature": 0}) == key
+    assert make_key("gpt-4o-mini", messages, {"temperature": 0, "max_tokens": 10}) != key
+    assert make_key("gpt-4o", [{"role": "user", "content": "hello!"}], {"temperature": 0, "max_tokens": 10}) != key
+    assert make_key("gpt-4o", messages, {"temperature": 1, "max_tokens": 10}) != key
+
+
+def test_values_round_trip_as_json():
+    cache = ResponseCache(":memory:")
+    cache.set("k", {"answer": ["a", 1, None]})
+    assert cache.get("k") == {"answer": ["a", 1, None]}
+    assert cache.get("missing") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "entries": 1}
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = ResponseCache(":memory:", ttl_seconds=60)
+    cache.set("k", "v")
+    clock.now += 60
+    assert cache.get("k") == "v"
+    clock.now += 1
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    cache = ResponseCache(":memory:", max_entries=2)
+    cache.set("a", 1)
+    clock.now += 1
+    cache.set("b", 2)
+    clock.now += 1
+    assert cache.get("a") == 1
+    clock.now += 1
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+
+def test_get_or_compute_calls_compute_once_per_request():
+    cache = ResponseCache(":memory:")
+    calls = []
+
+    def compute():
+        calls.append(True)
+        return "response"
+
+    messages = [{"role": "user", "content": "hello"}]
+    assert cache.get_or_compute("gpt-4o", messages, None, compute) == "response"
+    assert cache.get_or_compute("gpt-4o", messages, None, compute) == "response"
+    assert len(calls) == 1
+    cache.get_or_compute("gpt-4o", messages, None, compute, bypass=True)
+    assert len(calls) == 2
+
+
+def test_bypass_never_stores_or_serves():
+    cache = ResponseCache(":memory:", bypass=True)
+    cache.set("k", "v")
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
+
+
+class Plan(BaseModel):
+    steps: list
+
+
+class PlanWithReasons(BaseModel):
+    steps: list
+    reasons: list
+
+
+def test_schema_digest_changes_with_the_model_shape():
+    assert schema_digest(Plan) == schema_digest(Plan)
+    assert schema_digest(Plan) != schema_digest(PlanWithReasons)
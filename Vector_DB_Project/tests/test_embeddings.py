@@ -0,0 +1,115 @@
+import threading
+import time
+
+from langchain_core.embeddings import Embeddings
+
+from Embeddings import CachedEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    """
+    Embeds each text as [len(text)], blocking every request until released.
+    """
+
+    def __init__(self, error=None):
+        self.requests = []
+        self.error = error
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def embed_documents(self, texts):
+        self.requests.append(list(texts))
+        self.started.set()
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class WatchedInflight(dict):
+    """
+    In-flight table that counts lookups of a running embedding, i.e. threads that chose to wait for it.
+    """
+
+    waits = 0
+
+    def __getitem__(self, key):
+        self.waits += 1
+        return super().__getitem__(key)
+
+
+def wait_for_waiters(inflight, count):
+    deadline = time.monotonic() + 5
+    while inflight.waits < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert inflight.waits == count
+
+
+def run_in_threads(target, count):
+    results, errors = [None] * count, [None] * count
+
+    def run(index):
+        try:
+            results[index] = target()
+        except Exception as error:
+            errors[index] = error
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_duplicate_texts_are_embedded_once_and_then_served_from_cache():
+    inner = CountingEmbeddings()
+    inner.release.set()
+    cache = CachedEmbeddings(inner, "model", ":memory:")
+    assert cache.embed_documents(["ab", "abc", "ab"]) == [[2.0], [3.0], [2.0]]
+    assert cache.embed_documents(["abc", "abcd"]) == [[3.0], [4.0]]
+    assert inner.requests == [["ab", "abc"], ["abcd"]]
+    # Repeats within one request are neither hits nor misses
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_models_do_not_share_vectors():
+    inner = CountingEmbeddings()
+    inner.release.set()
+    CachedEmbeddings(inner, "small", ":memory:").embed_documents(["ab"])
+    CachedEmbeddings(inner, "large", ":memory:").embed_documents(["ab"])
+    assert inner.requests == [["ab"], ["ab"]]
+
+
+def test_concurrent_requests_for_the_same_text_wait_for_one_embedding():
+    inner = CountingEmbeddings()
+    cache = CachedEmbeddings(inner, "model", ":memory:")
+    cache._inflight = WatchedInflight()
+    first, first_results, _ = run_in_threads(lambda: cache.embed_documents(["abc"]), 1)
+    assert inner.started.wait(5)
+    others, other_results, _ = run_in_threads(lambda: cache.embed_documents(["abc"]), 3)
+    wait_for_waiters(cache._inflight, 3)
+    inner.release.set()
+    for thread in first + others:
+        thread.join(5)
+    assert inner.requests == [["abc"]]
+    assert first_results + other_results == [[[3.0]]] * 4
+
+
+def test_an_embedding_error_reaches_the_threads_waiting_for_it():
+    inner = CountingEmbeddings(error=RuntimeError("rate limited"))
+    cache = CachedEmbeddings(inner, "model", ":memory:")
+    cache._inflight = WatchedInflight()
+    first, _, first_errors = run_in_threads(lambda: cache.embed_documents(["abc"]), 1)
+    assert inner.started.wait(5)
+    others, _, other_errors = run_in_threads(lambda: cache.embed_documents(["abc"]), 2)
+    wait_for_waiters(cache._inflight, 2)
+    inner.release.set()
+    for thread in first + others:
+        thread.join(5)
+    assert len(inner.requests) == 1
+    assert all(isinstance(error, RuntimeError) for error in first_errors + other_errors)
+    # Nothing was cached, so the next request tries again
+    inner.error = None
+    assert cache.embed_documents(["abc"]) == [[3.0]]
@@ -0,0 +1,52 @@
+import csv
+
+from Ingest import _copy_field, chunk_transcript, content_hash, read_records
+from OpenAI_Client import estimate_tokens
+
+
+def test_chunk_transcript_keeps_turns_whole():
+    transcript = "Agent: hello there\nCustomer: hi\n\nAgent: how can I help\nCustomer: loan"
+    assert chunk_transcript(transcript, max_tokens=5) == [
+        "Agent: hello there\nCustomer: hi",
+        "Agent: how can I help",
+        "Customer: loan",
+    ]
+
+
+def test_chunk_transcript_splits_a_long_turn_into_exact_prefixes():
+    long_turn = "Customer: " + " ".join(f"w{i}" for i in range(12))
+    chunks = chunk_transcript(f"Agent: hi\n{long_turn}\nAgent: bye", max_tokens=5)
+    assert chunks == [
+        "Agent: hi",
+        "Customer: w0 w1 w2 w3 ",
+        "w4 w5 w6 w7 w8 ",
+        # The rest of the turn is packed with the turns after it like any other turn
+        "w9 w10 w11\nAgent: bye",
+    ]
+    assert all(estimate_tokens(chunk) <= 5 for chunk in chunks)
+
+
+def test_copy_field_escapes_the_copy_text_format():
+    assert _copy_field(None) == "\\N"
+    assert _copy_field("plain") == "plain"
+    assert _copy_field("a\\b\tc\nd\re") == "a\\\\b\\tc\\nd\\re"
+    # A literal backslash-N in the data must not read back as NULL
+    assert _copy_field("\\N") == "\\\\N"
+
+
+def test_read_records_coerces_csv_values(tmp_path):
+    path = tmp_path / "calls.csv"
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Serial Number", "Call Length", "Agent ID", "Opportunity Created", "Branch"])
+        writer.writerow(["S1", "61.5", "42.0", "Yes", "Jaipur"])
+        writer.writerow(["S2", "", "7", "false", ""])
+    assert list(read_records(str(path))) == [
+        {"Serial Number": "S1", "Call Length": 61.5, "Agent ID": 42, "Opportunity Created": True, "Branch": "Jaipur"},
+        {"Serial Number": "S2", "Call Length": None, "Agent ID": 7, "Opportunity Created": False, "Branch": ""},
+    ]
+
+
+def test_content_hash_ignores_key_order():
+    assert content_hash({"a": 1, "b": "x"}) == content_hash({"b": "x", "a": 1})
+    assert content_hash({"a": 1}) != content_hash({"a": 2})
@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.structured_query import Comparator, Comparison, Operation, Operator, StructuredQuery
+
+import Metadata_Table
+from Metadata_Table import SQLTranslator, compile_structured_query, iter_structured_query
+
+
+def comparison(comparator, attribute, value):
+    return Comparison(comparator=comparator, attribute=attribute, value=value)
+
+
+def test_translator_compiles_comparisons_to_bound_parameters():
+    query = StructuredQuery(query="", filter=comparison(Comparator.GT, "Call Length", 600))
+    assert SQLTranslator().visit_structured_query(query) == ("call_length > :p0", {"p0": 600})
+
+
+def test_translator_compiles_nested_operations_with_unique_parameters():
+    query = StructuredQuery(query="", filter=Operation(operator=Operator.AND, arguments=[
+        comparison(Comparator.EQ, "Branch", "Jaipur"),
+        Operation(operator=Operator.NOT, arguments=[comparison(Comparator.IN, "Language of the call", ["Hindi", "Marathi"])]),
+    ]))
+    sql, params = SQLTranslator().visit_structured_query(query)
+    assert sql == "(branch = :p0) AND (NOT (((language = ANY(:p1)))))"
+    assert params == {"p0": "Jaipur", "p1": ["Hindi", "Marathi"]}
+
+
+def test_translator_unwraps_dates_and_binds_like_patterns():
+    query = StructuredQuery(query="", filter=Operation(operator=Operator.OR, arguments=[
+        comparison(Comparator.GTE, "Call DateTime", {"date": "2024-01-01", "type": "date"}),
+        comparison(Comparator.LIKE, "Agent Name", "'; DROP TABLE call_metadata; --"),
+    ]))
+    sql, params = SQLTranslator().visit_structured_query(query)
+    assert sql == "(call_datetime >= :p0) OR (agent_name::text ILIKE :p1)"
+    assert params == {"p0": "2024-01-01", "p1": "%'; DROP TABLE call_metadata; --%"}
+
+
+def test_translator_rejects_fields_missing_from_the_table():
+    query = StructuredQuery(query="", filter=comparison(Comparator.EQ, "Rolewise Transcript", "loan"))
+    with pytest.raises(ValueError, match="not in the typed metadata table"):
+        SQLTranslator().visit_structured_query(query)
+
+
+def test_compile_structured_query_projects_fields_and_applies_the_limit():
+    query = StructuredQuery(query="", filter=comparison(Comparator.LT, "Agent ID", 5), limit=10)
+    sql, params = compile_structured_query(query, ["Serial Number", "Branch"])
+    assert sql == 'SELECT serial_number AS "Serial Number", branch AS "Branch" FROM call_metadata WHERE agent_id < :p0 LIMIT 10'
+    assert params == {"p0": 5}
+
+
+class FakeEngine:
+    """
+    Serves keyset pages from a sorted list of serial numbers, recording every page's parameters.
+    """
+
+    def __init__(self, serial_numbers):
+        self.serial_numbers = sorted(serial_numbers)
+        self.pages = []
+
+    def connect(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, statement, params):
+        self.pages.append(params)
+        after = params["after"]
+        selected = [serial for serial in self.serial_numbers if after is None or serial > after][:params["page_size"]]
+        return SimpleNamespace(fetchall=lambda: [SimpleNamespace(_mapping={"Serial Number": serial}) for serial in selected])
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = FakeEngine([f"S{i:02d}" for i in range(7)])
+    monkeypatch.setattr(Metadata_Table, "get_engine", lambda connection_string: engine)
+    return engine
+
+
+def test_keyset_paging_resumes_after_the_last_serial_of_each_page(engine):
+    query = StructuredQuery(query="", filter=comparison(Comparator.EQ, "Branch", "Jaipur"))
+    rows = list(iter_structured_query("postgresql://", query, page_size=3))
+    assert [row["Serial Number"] for row in rows] == engine.serial_numbers
+    assert [page["after"] for page in engine.pages] == [None, "S02", "S05"]
+    assert all(page["p0"] == "Jaipur" for page in engine.pages)
+
+
+def test_keyset_paging_stops_after_an_exactly_full_last_page(engine):
+    query = StructuredQuery(query="", filter=comparison(Comparator.EQ, "Branch", "Jaipur"))
+    rows = list(iter_structured_query("postgresql://", query, page_size=7))
+    assert len(rows) == 7
+    # The second round trip finds nothing and ends the scan
+    assert [page["after"] for page in engine.pages] == [None, "S06"]
+
+
+def test_keyset_paging_honours_the_query_limit(engine):
+    query = StructuredQuery(query="", filter=comparison(Comparator.EQ, "Branch", "Jaipur"), limit=5)
+    rows = list(iter_structured_query("postgresql://", query, page_size=3))
+    assert [row["Serial Number"] for row in rows] == ["S00", "S01", "S02", "S03", "S04"]
+    assert [page["page_size"] for page in engine.pages] == [3, 2]
@@ -0,0 +1,66 @@
+import pytest
+
+import OpenAI_Client
+from OpenAI_Client import TokenBucket, split_tokens, truncate_tokens
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(OpenAI_Client.time, "monotonic", clock)
+    return clock
+
+
+def test_bucket_starts_full_and_waits_for_the_missing_amount(clock):
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.wait_time(60) == 0.0
+    bucket.take(50)
+    # One unit per second refill: 10 are left, so 30 more take 20 seconds
+    assert bucket.wait_time(30) == pytest.approx(20.0)
+
+
+def test_bucket_refills_over_time_up_to_its_capacity(clock):
+    bucket = TokenBucket(per_minute=60)
+    bucket.take(60)
+    clock.now += 15
+    assert bucket.wait_time(15) == 0.0
+    assert bucket.wait_time(16) == pytest.approx(1.0)
+    clock.now += 3600
+    bucket.take(0)
+    assert bucket.level == 60
+
+
+def test_amounts_above_capacity_wait_only_for_a_full_bucket(clock):
+    bucket = TokenBucket(per_minute=60)
+    bucket.take(60)
+    assert bucket.wait_time(500) == pytest.approx(60.0)
+
+
+def test_negative_take_refunds_without_overfilling(clock):
+    bucket = TokenBucket(per_minute=60)
+    bucket.take(40)
+    bucket.take(-25)
+    assert bucket.level == 45
+    bucket.take(-100)
+    assert bucket.level == 60
+
+
+def test_split_tokens_cuts_consecutive_pieces_that_rejoin_to_the_text():
+    text = "one two three four five six seven"
+    pieces = split_tokens(text, 3)
+    assert pieces == ["one two three ", "four five six ", "seven"]
+    assert "".join(pieces) == text
+    assert split_tokens(text, 7) == [text]
+
+
+def test_truncate_tokens_keeps_a_prefix():
+    assert truncate_tokens("one two three four", 2) == "one two "
+    assert truncate_tokens("one two", 5) == "one two"
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from Pipeline import merge_sub_queries, run_dag
+
+
+def constant(value):
+    async def node(*deps):
+        return value
+    return node
+
+
+def test_run_dag_passes_dependency_results_in_order():
+    async def join(*deps):
+        return "".join(deps)
+
+    nodes = {
+        "a": (constant("a"), []),
+        "b": (constant("b"), []),
+        "ab": (join, ["a", "b"]),
+        "ba": (join, ["b", "a"]),
+        "all": (join, ["ab", "ba"]),
+    }
+    results = asyncio.run(run_dag(nodes))
+    assert results["ab"] == "ab"
+    assert results["ba"] == "ba"
+    assert results["all"] == "abba"
+
+
+def test_run_dag_runs_independent_nodes_concurrently_up_to_the_limit():
+    running, peak = 0, 0
+
+    async def work(*deps):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    nodes = {f"n{i}": (work, []) for i in range(6)}
+    asyncio.run(run_dag(nodes, max_concurrency=2))
+    assert peak == 2
+
+
+def test_run_dag_reports_completions():
+    completed = []
+    nodes = {"a": (constant(1), []), "b": (constant(2), ["a"])}
+    asyncio.run(run_dag(nodes, on_complete=lambda name, result: completed.append((name, result))))
+    assert completed == [("a", 1), ("b", 2)]
+
+
+def test_run_dag_rejects_cycles_before_running_anything():
+    started = []
+
+    async def record(*deps):
+        started.append(True)
+
+    nodes = {"start": (record, []), "a": (record, ["c"]), "b": (record, ["a"]), "c": (record, ["b"])}
+    with pytest.raises(ValueError, match="cycle"):
+        asyncio.run(run_dag(nodes))
+    assert started == []
+
+
+def test_run_dag_rejects_unknown_dependencies():
+    with pytest.raises(ValueError, match="unknown nodes"):
+        asyncio.run(run_dag({"a": (constant(1), ["missing"])}))
+
+
+def test_run_dag_propagates_node_errors():
+    async def fail(*deps):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError, match="boom"):
+        asyncio.run(run_dag({"a": (fail, []), "b": (constant(1), ["a"])}))
+
+
+ROUTING = {"filtering_function": "transcript_filtering", "analysis_function": "general_analysis", "reporting_function": "Pointers"}
+
+
+class FixedEmbeddings:
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.vectors[text] for text in texts]
+
+
+def test_merge_sub_queries_merges_canonical_duplicates_with_the_same_routing():
+    routed = {
+        "Why do customers refuse?": ROUTING,
+        "why do customers refuse": ROUTING,
+        "Why do customers refuse ": {**ROUTING, "analysis_function": "detailed_analysis"},
+    }
+    merged = merge_sub_queries(routed)
+    assert merged["why do customers refuse"] == "Why do customers refuse?"
+    assert merged["Why do customers refuse "] == "Why do customers refuse "
+
+
+def test_merge_sub_queries_merges_near_identical_embeddings():
+    routed = {"reasons for refusal": ROUTING, "why customers refuse": ROUTING, "call durations": ROUTING}
+    embeddings = FixedEmbeddings({
+        "reasons for refusal": [1.0, 0.0],
+        "why customers refuse": [0.99, 0.05],
+        "call durations": [0.0, 1.0],
+    })
+    merged = merge_sub_queries(routed, embeddings, threshold=0.97)
+    assert merged == {
+        "reasons for refusal": "reasons for refusal",
+        "why customers refuse": "reasons for refusal",
+        "call durations": "call durations",
+    }
@@ -0,0 +1,141 @@
+import pytest
+
+import Retrieval_Cache
+from Cache import ResponseCache
+from Retrieval_Cache import RetrievalCache, canonical_query, fingerprint, get_retrieval_cache, watermarks_changed
+from Settings import set_config
+
+
+class Watermarks:
+    """
+    Stands in for read_watermark, returning the current version and counting reads.
+    """
+
+    def __init__(self):
+        self.version = 1
+        self.reads = 0
+
+    def __call__(self, connection_string, collection_names):
+        self.reads += 1
+        return f"{list(collection_names)}@{self.version}"
+
+
+@pytest.fixture
+def watermarks(monkeypatch):
+    watermarks = Watermarks()
+    monkeypatch.setattr(Retrieval_Cache, "read_watermark", watermarks)
+    return watermarks
+
+
+def retrieval_cache(watermark_seconds=0.0):
+    return RetrievalCache(ResponseCache(":memory:"), connection_string="postgresql://", watermark_seconds=watermark_seconds)
+
+
+def test_canonical_query_ignores_case_punctuation_and_spacing():
+    assert canonical_query("  Why do customers REFUSE the loan?? ") == canonical_query("why do customers refuse the loan")
+
+
+def test_fingerprint_ignores_order_and_duplicates():
+    assert fingerprint(["S2", "S1", "S2"]) == fingerprint(["S1", "S2"])
+    assert fingerprint(["S1"]) != fingerprint(["S1", "S2"])
+
+
+def test_key_changes_when_the_watermark_moves(watermarks):
+    cache = retrieval_cache()
+    before = cache.key("transcripts", "loan refusals", ["calls"], {"k": 5})
+    assert cache.key("transcripts", "Loan refusals?", ["calls"], {"k": 5}) == before
+    watermarks.version += 1
+    assert cache.key("transcripts", "loan refusals", ["calls"], {"k": 5}) != before
+
+
+def test_key_depends_on_kind_collections_and_params(watermarks):
+    cache = retrieval_cache()
+    key = cache.key("transcripts", "loan", ["calls"], {"k": 5})
+    assert cache.key("self_query", "loan", ["calls"], {"k": 5}) != key
+    assert cache.key("transcripts", "loan", ["calls", "detailed"], {"k": 5}) != key
+    assert cache.key("transcripts", "loan", ["calls"], {"k": 6}) != key
+
+
+def test_watermark_is_reused_within_its_window(watermarks):
+    cache = retrieval_cache(watermark_seconds=60.0)
+    first = cache.watermark(["calls"])
+    watermarks.version += 1
+    assert cache.watermark(["calls"]) == first
+    assert watermarks.reads == 1
+    # Each set of collections has its own watermark
+    cache.watermark(["calls", "detailed"])
+    assert watermarks.reads == 2
+
+
+def test_forgotten_watermarks_are_read_again(watermarks):
+    cache = retrieval_cache(watermark_seconds=60.0)
+    first = cache.watermark(["calls"])
+    watermarks.version += 1
+    cache.forget_watermarks()
+    assert cache.watermark(["calls"]) != first
+    assert watermarks.reads == 2
+
+
+def test_a_read_racing_with_forget_is_not_remembered(watermarks, monkeypatch):
+    cache = retrieval_cache(watermark_seconds=60.0)
+
+    def read_then_commit(connection_string, collection_names):
+        # An ingestion commits and forgets the watermarks while this read is in flight
+        value = watermarks(connection_string, collection_names)
+        watermarks.version += 1
+        cache.forget_watermarks()
+        return value
+
+    monkeypatch.setattr(Retrieval_Cache, "read_watermark", read_then_commit)
+    stale = cache.watermark(["calls"])
+    monkeypatch.setattr(Retrieval_Cache, "read_watermark", watermarks)
+    assert cache.watermark(["calls"]) != stale
+
+
+def test_watermarks_changed_reaches_the_shared_cache(watermarks):
+    get_retrieval_cache.cache_clear()
+    # Not opened yet: nothing to forget, and nothing is opened
+    watermarks_changed()
+    assert get_retrieval_cache.cache_info().currsize == 0
+    set_config({"RETRIEVAL_CACHE_PATH": ":memory:", "PGVECTOR_CONNECTION_STRING": "postgresql://", "RETRIEVAL_CACHE_WATERMARK_SECONDS": "60"})
+    cache = get_retrieval_cache()
+    cache.watermark(["calls"])
+    watermarks_changed()
+    cache.watermark(["calls"])
+    assert watermarks.reads == 2
+    get_retrieval_cache.cache_clear()
+
+
+def test_without_a_connection_string_there_is_no_watermark(watermarks):
+    cache = RetrievalCache(ResponseCache(":memory:"))
+    assert cache.watermark(["calls"]) is None
+    assert watermarks.reads == 0
+
+
+def test_get_or_compute_serves_hits_until_ingestion(watermarks):
+    cache = retrieval_cache()
+    computed = []
+
+    def compute():
+        computed.append(True)
+        return ["S1", "S2"]
+
+    assert cache.get_or_compute("self_query", "branch Jaipur", ["calls"], None, compute) == ["S1", "S2"]
+    assert cache.get_or_compute("self_query", "Branch: Jaipur", ["calls"], None, compute) == ["S1", "S2"]
+    assert len(computed) == 1
+    watermarks.version += 1
+    cache.get_or_compute("self_query", "branch Jaipur", ["calls"], None, compute)
+    assert len(computed) == 2
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 2)
+    assert stats["by_kind"]["self_query"]["hit_rate"] == pytest.approx(1 / 3)
+
+
+def test_bypass_never_reads_or_stores(watermarks):
+    cache = RetrievalCache(ResponseCache(":memory:", bypass=True), connection_string="postgresql://")
+    key, value = cache.get("transcripts", "loan", ["calls"])
+    cache.set(key, ["S1"])
+    assert (key, value) == ("", None)
+    assert watermarks.reads == 0
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import Retrieve
+from Retrieve import assign_reasons, extract_reasons, normalize_rows
+
+ANALYSIS = "Customers gave these reasons:\n1. High interest rate\n2. Needs more time\n"
+
+CALLS = {
+    "S1": [1.0, 0.0],
+    "S2": [0.9, 0.1],
+    "S3": [0.0, 1.0],
+    "S4": [-1.0, 0.0],
+}
+
+
+class ReasonEmbeddings:
+    def embed_documents(self, texts):
+        return [{"High interest rate": [1.0, 0.0], "Needs more time": [0.0, 1.0]}[text] for text in texts]
+
+
+@pytest.fixture
+def store(monkeypatch):
+    requested = []
+
+    def call_embeddings(connection_string, collection_name, serial_numbers=None):
+        requested.append(serial_numbers)
+        ids = [serial for serial in CALLS if serial_numbers is None or serial in serial_numbers]
+        return ids, normalize_rows(np.array([CALLS[serial] for serial in ids], dtype=np.float32))
+
+    monkeypatch.setattr(Retrieve, "normalized_call_embeddings", call_embeddings)
+    return SimpleNamespace(collection_name="call_embeddings", embeddings=ReasonEmbeddings(), requested=requested)
+
+
+def test_extract_reasons_reads_numbered_lines():
+    assert extract_reasons(ANALYSIS) == ["High interest rate", "Needs more time"]
+
+
+def test_each_call_counts_once_towards_its_best_reason(store):
+    result = assign_reasons(ANALYSIS, store, "postgresql://", score_threshold=0.8)
+    assert result["counts"] == {"High interest rate": 2, "Needs more time": 1}
+    assert (result["assigned"], result["total_calls"], result["coverage"]) == (3, 4, 0.75)
+
+
+def test_a_shortlist_restricts_the_candidates(store):
+    result = assign_reasons(ANALYSIS, store, "postgresql://", serial_numbers=["S1", "S3"])
+    assert result["counts"] == {"High interest rate": 1, "Needs more time": 1}
+    assert result["total_calls"] == 2
+
+
+def test_an_empty_shortlist_means_no_filter_as_in_the_transcript_search(store):
+    result = assign_reasons(ANALYSIS, store, "postgresql://", serial_numbers=[])
+    assert store.requested == [None]
+    assert result["total_calls"] == 4